@@ -1,8 +1,8 @@
-import os, sys, json
+import os, sys, json, time, hashlib, uuid
 from typing import Dict, List, Optional
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import asyncio
@@ -37,8 +37,19 @@ if PROJECT_ROOT not in sys.path:
 from main import (
     Menu, Preferences, ConversationTurn,
     _validate_menu, normalize_menu, write_menu_json,
-    generate_conversation,
+    generate_conversation, normalize_user_text, recommend_turn, generate_ai_reply,
+    extract_prefs_from_text, merge_prefs_inplace, recommend_all_turn,
 )
+import menu_snapshot
+import menu_search
+import cache_utils
+import ollama_fuc
+from menu_snapshot import EncodedBody
+from menu_facets import ENRICHED_KEYS
+import menu_enrich
+import dish_blurbs
+from prefetch import Prefetcher
+from cross_recommend import CrossRecommender
 
 # 匯入爬蟲模組
 try:
@@ -139,7 +150,8 @@ def load_latest_crawled_menu() -> Optional[Menu]:
                                 "items": [
                                     {
                                         "name": item.get('name', ''),
-                                        "price": item.get('price', '價格未提供').replace('$', '').replace(',', '').strip() if isinstance(item.get('price'), str) else item.get('price')
+                                        "price": item.get('price', '價格未提供').replace('$', '').replace(',', '').strip() if isinstance(item.get('price'), str) else item.get('price'),
+                                        **{k: item[k] for k in ENRICHED_KEYS if k in item},
                                     }
                                     for item in data.get('menu_items', [])
                                 ]
@@ -211,7 +223,8 @@ for menu_file in menu_files:
                                 "items": [
                                     {
                                         "name": item.get('name', ''),
-                                        "price": item.get('price', '價格未提供').replace('$', '').replace(',', '').strip() if isinstance(item.get('price'), str) else item.get('price')
+                                        "price": item.get('price', '價格未提供').replace('$', '').replace(',', '').strip() if isinstance(item.get('price'), str) else item.get('price'),
+                                        **{k: item[k] for k in ENRICHED_KEYS if k in item},
                                     }
                                     for item in data.get('menu_items', [])
                                 ]
@@ -238,10 +251,111 @@ else:
         ACTIVE_RESTAURANT = "預設餐廳"
         RESTAURANT_MENUS["預設餐廳"] = menu
 
+# 3️⃣ 選用：SQLite 菜單儲存（MENU_STORE=sqlite），以資料庫內容為準
+MENU_STORE = None
+if os.environ.get("MENU_STORE", "json").lower() == "sqlite":
+    from menu_store import MenuStore, import_json_files
+    MENU_STORE = MenuStore()
+    if not MENU_STORE.restaurant_names():
+        for _name, _count in import_json_files(MENU_STORE, PROJECT_ROOT).items():
+            print(f" 匯入 SQLite：{_name} ({_count} 項)")
+    stored_menus = MENU_STORE.load_all()
+    if stored_menus:
+        RESTAURANT_MENUS.clear()
+        RESTAURANT_MENUS.update(stored_menus)
+        ACTIVE_RESTAURANT = next(reversed(RESTAURANT_MENUS))  # 最近更新的餐廳
+        menu = RESTAURANT_MENUS[ACTIVE_RESTAURANT]
+    print(f" SQLite 菜單儲存：{MENU_STORE.db_path}（{len(stored_menus)} 間餐廳，FTS5={MENU_STORE.fts_tokenizer}）")
+
+
+def _store_restaurant(name: str) -> None:
+    """啟用 SQLite 儲存時，把單一餐廳寫入資料庫（JSON 檔仍照舊保留）"""
+    if MENU_STORE is None or name not in RESTAURANT_MENUS:
+        return
+    try:
+        MENU_STORE.save_restaurant(name, RESTAURANT_MENUS[name])
+    except Exception as e:
+        print(f"[警告] 寫入 SQLite 失敗: {e}")
+
+
+# 菜品介紹：每個菜單版本在背景生成一次，存在快照裡（CHAT_REPLY_MODE=blurb 時預設開啟）
+DISH_BLURBS = os.environ.get(
+    "DISH_BLURBS", "true" if os.environ.get("CHAT_REPLY_MODE", "llm").lower() == "blurb" else "false"
+).lower() == "true"
+BLURB_JOB = cache_utils.register(dish_blurbs.BlurbJob())
+
+
+def _publish_snapshot() -> None:
+    """RESTAURANT_MENUS 或 ACTIVE_RESTAURANT 變動後重建預先序列化的菜單快照"""
+    snap = menu_snapshot.publish(RESTAURANT_MENUS, ACTIVE_RESTAURANT)
+    if DISH_BLURBS:
+        BLURB_JOB.schedule(snap)
+    reindexed = menu_search.INDEX.sync(snap)
+    pruned = ollama_fuc.prune_recommendations({rs.version for rs in snap.restaurants.values()})
+    rebuilt = ollama_fuc.COMBO_TABLES.sync(snap) if ollama_fuc.COMBO_TABLE else 0
+    # 索引與組合表都建好後才 fork 推薦工作行程，讓它們以 copy-on-write 共用
+    workers = ollama_fuc.RECOMMEND_POOL.sync(snap)
+    print(f" [快照] 已發佈第 {snap.version} 版（{len(snap.restaurants)} 間餐廳，重建搜尋索引 {reindexed} 間、"
+          f"組合表 {rebuilt} 間，清除推薦快取 {pruned} 筆，推薦工作行程 {workers} 個）")
+
+
+# 爬取 / 匯入後的 enrichment（見 menu_enrich）：在背景算好品項類型與屬性，
+# 完成後換上新的菜單物件並寫回 JSON / SQLite，之後 recommend() 直接查表
+_ENRICH_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="menu-enrich")
+
+
+def _enrich_in_background(name: str, path: Optional[str] = None) -> None:
+    def run() -> None:
+        global menu
+        base = RESTAURANT_MENUS.get(name)
+        if base is None:
+            return
+        use_llm = os.environ.get("USE_LLM_CLASSIFICATION", "true").lower() == "true"
+        enriched, stats = menu_enrich.enrich_menu(base, use_llm=use_llm)
+        if RESTAURANT_MENUS.get(name) is not base:
+            return  # 期間菜單已被更新或刪除，放棄這次結果
+        RESTAURANT_MENUS[name] = enriched
+        if menu is base:
+            menu = enriched
+        _store_restaurant(name)
+        if path and os.path.exists(path):
+            menu_enrich.enrich_file(path, use_llm=use_llm)  # LLM 類型已在分類快取中，這裡只是寫回檔案
+        _publish_snapshot()
+        print(f" [enrichment] {name}：{stats['items']} 項（關鍵字 {stats['keyword']}、LLM {stats['llm']}）")
+
+    def report(future: concurrent.futures.Future) -> None:
+        if future.exception() is not None:
+            print(f"[警告] {name} enrichment 失敗: {future.exception()}")
+
+    _ENRICH_POOL.submit(run).add_done_callback(report)
+
+
+def _encoded_response(request: Request, body: EncodedBody) -> Response:
+    """回傳預先壓縮好的 JSON；If-None-Match 命中時回 304"""
+    encoding = menu_snapshot.choose_encoding(request.headers.get("accept-encoding"))
+    content, etag = body.variant(encoding)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if body.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if content is not body.raw:
+        headers["Content-Encoding"] = encoding
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+_publish_snapshot()
 # 簡單 session 記憶
 SESSIONS: Dict[str, Dict[str, object]] = {}
 
 
+def _session_seed(session_id: str) -> int:
+    """每個 session 固定的推薦種子（重新整理頁面、重啟服務都一樣）"""
+    return int(hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:8], 16)
+
+
 def _log_chat(session_id: str, user_text: str, reply: str, prefs: Preferences) -> None:
     """將每次對話紀錄成一行 JSON 方便之後分析。
 
@@ -268,9 +382,17 @@ def _log_chat(session_id: str, user_text: str, reply: str, prefs: Preferences) -
 class ChatReq(BaseModel):
     sessionId: str
     text: str
+    scope: Optional[str] = None  # "all"：在所有已載入的餐廳中推薦（不限目前餐廳）
+
+class CrossReq(BaseModel):
+    text: str = ""
+    sessionId: Optional[str] = None  # 指定時以該 session 累積的偏好為基礎（不寫回 session）
+    top: int = 3
 
 class ChatResp(BaseModel):
     reply: str
+    replyId: Optional[str] = None  # 模板優先模式：LLM 潤飾中的回覆 id，可用 /api/chat/replies/{id} 取得
+    pending: bool = False
 
 class CrawlReq(BaseModel):
     query: str
@@ -316,54 +438,108 @@ class UpdateMenuResp(BaseModel):
     restaurant_name: Optional[str] = None
     menu_items_count: Optional[int] = None
 
+# 啟動時在背景確保 ollama daemon 就緒並預熱模型（OLLAMA_WARMUP=false 可關閉）
+@app.on_event("startup")
+def _warm_up_models() -> None:
+    if os.environ.get("OLLAMA_WARMUP", "true").lower() != "true":
+        return
+    import threading
+    threading.Thread(target=ollama_fuc.warm_up, name="ollama-warmup", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def _close_recommend_pool() -> None:
+    ollama_fuc.RECOMMEND_POOL.close()
+
+
 @app.get("/health")
 def health():
-    return {"ok": True}
+    """存活檢查：服務本身有回應即為 ok，另附 ollama daemon 狀態與探測延遲"""
+    status = ollama_fuc.readiness()
+    return {"ok": True, "ollama": {"daemonUp": status["daemonUp"], "probeMs": status["probeMs"]}}
+
+
+@app.get("/ready")
+def ready():
+    """就緒檢查：daemon 在線且預熱模型都已常駐才回 200，否則 503（負載平衡器只導流到暖機完成的節點）"""
+    status = ollama_fuc.readiness()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/api/metrics")
+def metrics():
+    """各快取的命中率等統計"""
+    return {
+        "caches": cache_utils.all_stats(),
+        "router": ollama_fuc.ROUTER.stats(),
+        "pool": ollama_fuc.POOL.stats() if ollama_fuc.POOL is not None else None,
+    }
 
 @app.get("/")
 def index():
     return FileResponse(os.path.join(WEB_DIR, "web.html"))
 
 @app.get("/api/current-menu")
-def get_current_menu():
+def get_current_menu(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    category: Optional[str] = None,
+    format: Optional[str] = None,
+):
     """
-    回傳當前活動餐廳的菜單資料
+    回傳當前活動餐廳的菜單資料（直接使用快照中預先序列化的內容）
+
+    選用參數（大型菜單 / 行動裝置）：
+    - limit: 每個分類只回傳前 N 筆，附 nextCursor
+    - cursor: 取某分類的下一頁
+    - fields: 只回傳指定欄位，例如 fields=name,price
+    - category: 只回傳指定分類
+    - format=ndjson: 以 NDJSON 逐行串流
     """
+    snap = menu_snapshot.current()
+    if snap is None:
+        _publish_snapshot()
+        snap = menu_snapshot.current()
+
+    rs = snap.active_restaurant()
+    if rs is None or (limit is None and cursor is None and fields is None
+                      and category is None and format is None):
+        return _encoded_response(request, snap.current_menu_body())
+
+    projection = menu_snapshot.parse_fields(fields)
+    if format == "ndjson":
+        return StreamingResponse(
+            menu_snapshot.menu_ndjson(rs, projection, category),
+            media_type="application/x-ndjson",
+        )
+
+    if limit is None and cursor is None:
+        categories = [c for c in rs.project(projection) if category is None or c["name"] == category]
+        return {"success": True, "restaurantName": rs.name, "version": rs.version, "categories": categories}
+
     try:
-        if not ACTIVE_RESTAURANT or not menu:
-            return {
-                "success": False,
-                "message": "目前未載入任何菜單",
-                "restaurantName": None,
-                "categories": []
-            }
-        
-        # 獲取當前餐廳的菜單資料
-        restaurant_data = menu.get("restaurants", {}).get(ACTIVE_RESTAURANT, {})
-        categories_dict = restaurant_data.get("categories", {})
-        
-        # 轉換成前端友善的格式（陣列）
-        categories_array = []
-        for category_name, category_data in categories_dict.items():
-            categories_array.append({
-                "name": category_name,
-                "items": category_data.get("items", [])
-            })
-        
-        return {
-            "success": True,
-            "restaurantName": ACTIVE_RESTAURANT,
-            "categories": categories_array
-        }
-    
-    except Exception as e:
-        print(f"[錯誤] 獲取菜單失敗: {e}")
-        return {
-            "success": False,
-            "message": f"獲取菜單時發生錯誤: {str(e)}",
-            "restaurantName": None,
-            "categories": []
-        }
+        return menu_snapshot.menu_page(rs, limit or 20, cursor, projection, category)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+@app.get("/api/search")
+def search_dishes(q: str, limit: int = 20, restaurant: Optional[str] = None):
+    """跨所有已載入餐廳搜尋菜品（中文 bigram + 英文單字反向索引）"""
+    start = time.perf_counter()
+    results = menu_search.INDEX.search(q, limit=max(1, min(limit, 100)), restaurant=restaurant)
+    return {
+        "query": q,
+        "results": results,
+        "tookMs": round((time.perf_counter() - start) * 1000, 3),
+    }
+
+
+@app.get("/api/search/suggest")
+def suggest_dishes(q: str, limit: int = 10):
+    """自動完成：回傳不重複的菜名，最後一個英文字視為前綴"""
+    return {"query": q, "suggestions": menu_search.INDEX.suggest(q, limit=max(1, min(limit, 50)))}
 
 
 @app.post("/api/search-foodpanda", response_model=FoodpandaSearchResp)
@@ -471,7 +647,8 @@ async def api_crawl_foodpanda(req: FoodpandaReq):
                                 "items": [
                                     {
                                         "name": item.get('name', ''),
-                                        "price": item.get('price', '價格未提供').replace('$', '').replace(',', '').strip()
+                                        "price": item.get('price', '價格未提供').replace('$', '').replace(',', '').strip(),
+                                        **{k: item[k] for k in ENRICHED_KEYS if k in item},
                                     }
                                     for item in data.get('menu_items', [])
                                 ]
@@ -485,6 +662,9 @@ async def api_crawl_foodpanda(req: FoodpandaReq):
             RESTAURANT_MENUS[restaurant.name] = crawled_menu
             ACTIVE_RESTAURANT = restaurant.name
             menu = crawled_menu
+            _store_restaurant(restaurant.name)
+            _enrich_in_background(restaurant.name, str(json_file))
+            _publish_snapshot()
             print(f" 已將 {restaurant.name} 加入餐廳列表並設為當前活動餐廳")
             
             return FoodpandaResp(
@@ -518,42 +698,128 @@ async def api_crawl_foodpanda(req: FoodpandaReq):
 
 @app.post("/api/chat", response_model=ChatResp)
 def api_chat(req: ChatReq):
-    s = SESSIONS.setdefault(req.sessionId, {"prefs": {}, "history": []})
+    s = SESSIONS.setdefault(req.sessionId, {
+        "prefs": {}, "history": [], "seed": _session_seed(req.sessionId), "lastText": None,
+    })
     prefs: Preferences = s["prefs"]  # type: ignore[assignment]
     history: List[ConversationTurn] = s["history"]  # type: ignore[assignment]
-    reply, _ = generate_conversation(history, req.text, menu, prefs)
-
-    # 寫入簡單對話日誌，方便之後分析「大家怎麼問」、「實際推薦了什麼」
-    _log_chat(req.sessionId, req.text, reply, prefs)
-
-    return {"reply": reply}
+    # 重複同一句沿用原本的 seed（結果相同、直接命中推薦快取）；換一句話（例如「換一套」）才換一組隨機挑選
+    text_key = normalize_user_text(req.text)
+    if s["lastText"] is not None and text_key != s["lastText"]:
+        s["seed"] += 1  # type: ignore[operator]
+    s["lastText"] = text_key
+    seed: int = s["seed"]  # type: ignore[assignment]
+    current_menu = menu
+
+    if req.scope == "all":
+        # 跨餐廳推薦：結果不屬於目前餐廳，不做預先計算
+        _, reply = recommend_all_turn(history, req.text, RESTAURANT_MENUS, prefs, CROSS_RECOMMEND, seed=seed)  # type: ignore[arg-type]
+        history.append({"role": "assistant", "content": reply, "meta": {}})
+        _log_chat(req.sessionId, req.text, reply, prefs)
+        return {"reply": reply}
+
+    def prefetched(merged: Preferences) -> Optional[Dict[str, object]]:
+        return PREFETCH.take(req.sessionId, current_menu, merged, seed)  # type: ignore[arg-type]
+
+    if CHAT_REPLY_MODE == "template-first":
+        resp = _chat_template_first(req, history, prefs, seed, prefetched)
+    elif CHAT_REPLY_MODE == "blurb":
+        # 介紹模式：模板 + 預先生成的菜品介紹就是最終回覆，不即時呼叫 LLM
+        _, reply = recommend_turn(history, req.text, current_menu, prefs, seed=seed, prefetched=prefetched)
+        history.append({"role": "assistant", "content": reply, "meta": {}})
+        _log_chat(req.sessionId, req.text, reply, prefs)
+        resp = {"reply": reply}
+    else:
+        reply, _ = generate_conversation(history, req.text, current_menu, prefs, seed=seed,
+                                         session=req.sessionId, prefetched=prefetched)
+
+        # 寫入簡單對話日誌，方便之後分析「大家怎麼問」、「實際推薦了什麼」
+        _log_chat(req.sessionId, req.text, reply, prefs)
+        resp = {"reply": reply}
+
+    # 回應後在背景先算好最常見的下一句（換一套、降預算、切換飲料）
+    PREFETCH.schedule(req.sessionId, current_menu, prefs, seed, history)  # type: ignore[arg-type]
+    return resp
+
+
+# 模板優先模式（CHAT_REPLY_MODE=template-first）：
+# 先回傳 _fallback_format 的模板回覆與 replyId，LLM 潤飾在背景執行，前端再輪詢取得
+CHAT_REPLY_MODE = os.environ.get("CHAT_REPLY_MODE", "llm").lower()
+_REPLY_POOL = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.environ.get("REPLY_WORKERS", "2")), thread_name_prefix="llm-reply"
+)
+PENDING_REPLIES = cache_utils.register(cache_utils.LRUCache(1024, name="pendingReplies", ttl=600))
+PREFETCH = cache_utils.register(Prefetcher())
+CROSS_RECOMMEND = cache_utils.register(CrossRecommender())
+
+
+@app.post("/api/recommend-all")
+def api_recommend_all(req: CrossReq):
+    """在所有已載入的餐廳中找出最適合的幾家（每家一組推薦），依分數遞減"""
+    prefs: Preferences = {}
+    session = SESSIONS.get(req.sessionId) if req.sessionId else None
+    if session is not None:
+        prefs = json.loads(json.dumps(session["prefs"], ensure_ascii=False))
+    if req.text:
+        merge_prefs_inplace(prefs, extract_prefs_from_text(req.text))
+    seed = session["seed"] if session is not None else None
+    result = CROSS_RECOMMEND.recommend_all(RESTAURANT_MENUS, prefs, k=max(1, min(req.top, 20)), seed=seed)  # type: ignore[arg-type]
+    return {"prefs": prefs, **result}
+
+
+def _chat_template_first(req: ChatReq, history: List[ConversationTurn], prefs: Preferences, seed: int,
+                         prefetched=None) -> Dict[str, object]:
+    rec, template = recommend_turn(history, req.text, menu, prefs, seed=seed, prefetched=prefetched)
+    context = [dict(m) for m in history]  # 背景潤飾時 history 可能已被下一輪改動
+    turn: ConversationTurn = {"role": "assistant", "content": template, "meta": {}}
+    history.append(turn)
+    if rec is None:
+        _log_chat(req.sessionId, req.text, template, prefs)
+        return {"reply": template}
+
+    reply_id = uuid.uuid4().hex
+    logged_prefs = json.loads(json.dumps(prefs, ensure_ascii=False))
+
+    def upgrade() -> str:
+        reply = generate_ai_reply(rec, req.text, session=req.sessionId, history=context, prefs=logged_prefs)
+        turn["content"] = reply  # 歷史紀錄改成潤飾後的版本
+        _log_chat(req.sessionId, req.text, reply, logged_prefs)
+        return reply
+
+    future = _REPLY_POOL.submit(upgrade)
+    PENDING_REPLIES.put(reply_id, {"future": future, "template": template})
+    return {"reply": template, "replyId": reply_id, "pending": True}
+
+
+@app.get("/api/chat/replies/{reply_id}")
+async def get_chat_reply(reply_id: str, wait: float = 0.0):
+    """取得背景 LLM 回覆；wait > 0 時最多等待該秒數（上限 30 秒）再回應"""
+    entry = PENDING_REPLIES.get(reply_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="找不到此回覆（可能已過期）")
+    future: concurrent.futures.Future = entry["future"]
+    if not future.done() and wait > 0:
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=min(wait, 30.0))
+        except asyncio.TimeoutError:
+            pass
+    if not future.done():
+        return {"replyId": reply_id, "status": "pending", "reply": entry["template"]}
+    try:
+        return {"replyId": reply_id, "status": "done", "reply": future.result()}
+    except Exception as e:
+        print(f"[警告] 背景回覆失敗: {e}")
+        return {"replyId": reply_id, "status": "failed", "reply": entry["template"]}
 
 # 多餐廳管理 API
 @app.get("/api/restaurants")
-def list_restaurants():
-    """列出所有可用的餐廳"""
-    restaurants_list = []
-    
-    for name, menu_data in RESTAURANT_MENUS.items():
-        # 計算總菜品數量（遍歷所有分類）
-        total_items = 0
-        restaurant_data = menu_data.get("restaurants", {}).get(name, {})
-        categories = restaurant_data.get("categories", {})
-        
-        for category_name, category_data in categories.items():
-            items = category_data.get("items", [])
-            total_items += len(items)
-        
-        restaurants_list.append({
-            "name": name,
-            "active": name == ACTIVE_RESTAURANT,
-            "itemCount": total_items
-        })
-    
-    return {
-        "restaurants": restaurants_list,
-        "activeRestaurant": ACTIVE_RESTAURANT
-    }
+def list_restaurants(request: Request):
+    """列出所有可用的餐廳（品項數量在發佈快照時就已計算好）"""
+    snap = menu_snapshot.current()
+    if snap is None:
+        _publish_snapshot()
+        snap = menu_snapshot.current()
+    return _encoded_response(request, snap.restaurants_body)
 
 @app.post("/api/switch-restaurant")
 def switch_restaurant(restaurant_name: str):
@@ -565,6 +831,7 @@ def switch_restaurant(restaurant_name: str):
     
     ACTIVE_RESTAURANT = restaurant_name
     menu = RESTAURANT_MENUS[restaurant_name]
+    _publish_snapshot()
     
     return {
         "success": True,
@@ -581,8 +848,10 @@ def delete_menu(restaurant_name: str):
     if restaurant_name not in RESTAURANT_MENUS:
         raise HTTPException(404, f"餐廳 '{restaurant_name}' 不存在")
     
-    # 1. 從記憶體中移除
+    # 1. 從記憶體中移除（啟用 SQLite 時一併刪除資料庫中的資料）
     del RESTAURANT_MENUS[restaurant_name]
+    if MENU_STORE is not None:
+        MENU_STORE.delete_restaurant(restaurant_name)
     
     # 2. 刪除對應的 JSON 檔案
     menu_file = os.path.join(PROJECT_ROOT, f"menu_{restaurant_name}.json")
@@ -593,6 +862,7 @@ def delete_menu(restaurant_name: str):
             print(f"[刪除] 已刪除檔案: {menu_file}")
         except Exception as e:
             print(f"[錯誤] 刪除檔案失敗: {e}")
+            _publish_snapshot()
             raise HTTPException(500, f"刪除檔案失敗: {str(e)}")
     
     # 3. 如果刪除的是當前活動餐廳，切換到其他餐廳
@@ -607,6 +877,7 @@ def delete_menu(restaurant_name: str):
             ACTIVE_RESTAURANT = None
             menu = {"restaurants": {}}
             print(f"[警告] 已無可用餐廳")
+    _publish_snapshot()
     
     return {
         "success": True,
@@ -671,7 +942,7 @@ async def update_menu(req: UpdateMenuReq):
             
             # 重新載入菜單到系統中
             try:
-                global RESTAURANT_MENUS, ACTIVE_RESTAURANT
+                global RESTAURANT_MENUS, ACTIVE_RESTAURANT, menu
                 
                 # 重新讀取剛儲存的菜單檔案
                 with open(output_file, "r", encoding="utf-8") as f:
@@ -687,7 +958,8 @@ async def update_menu(req: UpdateMenuReq):
                                         "items": [
                                             {
                                                 "name": item.get('name', ''),
-                                                "price": item.get('price', '價格未提供').replace('$', '').replace(',', '').strip() if isinstance(item.get('price'), str) else item.get('price')
+                                                "price": item.get('price', '價格未提供').replace('$', '').replace(',', '').strip() if isinstance(item.get('price'), str) else item.get('price'),
+                                                **{k: item[k] for k in ENRICHED_KEYS if k in item},
                                             }
                                             for item in data.get('menu_items', [])
                                         ]
@@ -699,6 +971,9 @@ async def update_menu(req: UpdateMenuReq):
                     RESTAURANT_MENUS[restaurant.name] = crawled_menu
                     ACTIVE_RESTAURANT = restaurant.name
                     menu = crawled_menu
+                    _store_restaurant(restaurant.name)
+                    _enrich_in_background(restaurant.name, output_file)
+                    _publish_snapshot()
                     print(f"[系統] 已將 {restaurant.name} 設為活動餐廳")
             except Exception as e:
                 print(f"[警告] 重新載入菜單失敗: {e}")
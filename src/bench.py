@@ -0,0 +1,531 @@
+"""效能基準測試（手動執行，不在服務中使用）
+
+用法：
+    python src/bench.py search [--dishes 100000]
+    python src/bench.py matcher [--items 10000]
+    python src/bench.py lexer [--repeat 50]
+    python src/bench.py pool [--backends 3 --requests 300]
+    python src/bench.py combos [--mains 40 --queries 200]
+    python src/bench.py cross [--restaurants 200 --workers 8]
+    python src/bench.py procs [--restaurants 50 --clients 8]
+"""
+import argparse
+import contextlib
+import glob
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SRC_DIR, os.pardir))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+
+def _real_dish_names() -> List[str]:
+    """從專案內的 menu.json / menu_*.json 收集真實菜名，當作合成資料的素材"""
+    names: List[str] = []
+    for path in [os.path.join(PROJECT_ROOT, "menu.json"), *glob.glob(os.path.join(PROJECT_ROOT, "menu_*.json"))]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            continue
+        for cat in data.get("categories", []):
+            names.extend(it.get("name", "") for it in cat.get("items", []))
+        names.extend(it.get("name", "") for it in data.get("menu_items", []))
+    return [n for n in names if n] or ["冰蜂蜜奶茶 Iced Honey Milk Tea", "鵝油高麗菜", "大麥克 Big Mac"]
+
+
+def synthetic_restaurants(n_dishes: int, per_restaurant: int = 200, seed: int = 0) -> Dict[str, List[Dict[str, Any]]]:
+    """產生合成菜單：{餐廳名: 前端格式分類列表}，菜名由真實菜名加上前綴變化組成"""
+    rng = random.Random(seed)
+    base = _real_dish_names()
+    prefixes = ["", "招牌", "經典", "特製", "辣味", "黃金", "小份", "大份", "Spicy ", "Deluxe "]
+    cats = ["主餐", "小菜", "飲料", "甜點", "套餐"]
+    restaurants: Dict[str, List[Dict[str, Any]]] = {}
+    for start in range(0, n_dishes, per_restaurant):
+        name = f"餐廳{start // per_restaurant:05d}"
+        by_cat: Dict[str, List[Dict[str, Any]]] = {c: [] for c in cats}
+        for _ in range(min(per_restaurant, n_dishes - start)):
+            dish = rng.choice(prefixes) + rng.choice(base)
+            by_cat[rng.choice(cats)].append({"name": dish, "price": rng.randrange(30, 800, 5)})
+        restaurants[name] = [{"name": c, "items": items} for c, items in by_cat.items()]
+    return restaurants
+
+
+def _timeit(fn, repeat: int) -> float:
+    """回傳每次呼叫的平均毫秒數"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def bench_search(args: argparse.Namespace) -> None:
+    from menu_search import MenuSearchIndex
+
+    restaurants = synthetic_restaurants(args.dishes)
+    index = MenuSearchIndex()
+    start = time.perf_counter()
+    for name, categories in restaurants.items():
+        index.update_restaurant(name, categories)
+    print(f"建立索引：{len(index)} 道菜 / {len(restaurants)} 間餐廳，{time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    first = next(iter(restaurants))
+    index.update_restaurant(first, restaurants[first])
+    print(f"單一餐廳增量更新：{(time.perf_counter() - start) * 1000:.2f}ms")
+
+    for q in ["奶茶", "蜂蜜奶茶", "milk te", "honey milk", "高麗菜", "big", "鵝", "招牌 tea"]:
+        hits = len(index.search(q, limit=20))
+        print(f"  search({q!r:12}) {hits:3d} 筆  {_timeit(lambda: index.search(q, limit=20), args.repeat):.3f}ms")
+    for q in ["冰蜂", "lat", "spicy b"]:
+        print(f"  suggest({q!r:11}) {_timeit(lambda: index.suggest(q), args.repeat):.3f}ms")
+
+
+def bench_matcher(args: argparse.Namespace) -> None:
+    """排除 + 分類 + 偏好：逐表 any(kw in name) 與 Aho-Corasick 單次掃描的比較"""
+    from ollama_fuc import _ITEM_TYPE_KEYWORDS, _ITEM_TYPE_ORDER, _PREFERRED_DISH_KEYWORDS, _item_matcher, item_type_from_labels, _EXCLUDE_LABEL
+
+    restaurants = synthetic_restaurants(args.items, per_restaurant=args.items)
+    names = [it["name"].lower() for cats in restaurants.values() for c in cats for it in c["items"]]
+    excludes = ("牛肉", "花生", "辣", "飲料", "豬")
+    preferred = _PREFERRED_DISH_KEYWORDS["漢堡"]
+
+    def naive() -> List[Tuple[str, bool]]:
+        out = []
+        for name in names:
+            if any(kw in name for kw in excludes):
+                continue
+            t = next((t for t in _ITEM_TYPE_ORDER if any(kw in name for kw in _ITEM_TYPE_KEYWORDS[t])), "other")
+            out.append((t, any(kw in name for kw in preferred)))
+        return out
+
+    matcher = _item_matcher(excludes)
+
+    def automaton() -> List[Tuple[str, bool]]:
+        out = []
+        for name in names:
+            labels = matcher.labels(name)
+            if _EXCLUDE_LABEL in labels:
+                continue
+            out.append((item_type_from_labels(labels), "pref:漢堡" in labels))
+        return out
+
+    assert naive() == automaton(), "兩種做法結果不一致"
+    t_naive = _timeit(naive, args.repeat)
+    t_auto = _timeit(automaton, args.repeat)
+    print(f"{len(names)} 個菜名，排除 {len(excludes)} 個關鍵字")
+    print(f"  any() 逐表掃描：{t_naive:.2f}ms")
+    print(f"  Aho-Corasick ：{t_auto:.2f}ms（{t_naive / t_auto:.1f}x）")
+
+
+def _chat_log_texts() -> List[str]:
+    """logs/chat_log.jsonl 裡的使用者訊息，沒有紀錄時用幾句常見輸入代替"""
+    texts: List[str] = []
+    try:
+        with open(os.path.join(PROJECT_ROOT, "logs", "chat_log.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    text = json.loads(line).get("user_text")
+                except Exception:
+                    continue
+                if text:
+                    texts.append(text)
+    except OSError:
+        pass
+    return texts or ["兩個人預算500，不要牛肉", "想吃漢堡，要飲料", "3人 吃素 單品150以下", "不吃辣、不要花生，日式"]
+
+
+def bench_lexer(args: argparse.Namespace) -> None:
+    """偏好關鍵字抽取：舊版逐項掃描與 pref_lexer 單次掃描的比較"""
+    import re
+    import pref_lexer as pl
+
+    def multi_pass(text: str) -> Dict[str, Any]:
+        # 舊版 _extract_prefs_uncached 的關鍵字部分（去掉除錯輸出）
+        t = text.strip()
+        prefs: Dict[str, Any] = {}
+        for w in pl.SPICE_WORDS:
+            if w in t:
+                prefs["spiceLevel"] = "小辣" if w == "微辣" else w
+                break
+        else:
+            if any(k in t for k in pl.SPICE_FALLBACK):
+                prefs["spiceLevel"] = "辣"
+        excludes: List[str] = []
+        for cue in pl.EXCLUDE_CUES:
+            idx = t.find(cue)
+            if idx != -1:
+                excludes.extend(pl._exclusion_segment(t, idx, cue))
+        if excludes:
+            prefs["excludes"] = list(dict.fromkeys(excludes))
+        t_budget = t
+        m_item = re.search(r"(單品|每道|每樣|每份)\s*(?:不超過|小於|低於)?\s*(\d{2,5})\s*(?:元|塊)?\s*(?:以下|以內)?", t)
+        if m_item:
+            prefs["maxItemPrice"] = float(m_item.group(2))
+            t_budget = t[:m_item.start()] + t[m_item.end():]
+        m = re.search(r"(預算|不超過|小於|低於|<=)\s*(\d{2,6})", t_budget)
+        if not m:
+            m = re.search(r"(\d{2,6})\s*(元|塊|NT|NTD)", t_budget, flags=re.IGNORECASE)
+        if m:
+            try:
+                prefs["budget"] = float(m.group(2) if m.lastindex and m.lastindex >= 2 else m.group(1))
+            except Exception:
+                pass
+        if any(k in t for k in pl.VEGETARIAN_CUES):
+            prefs["vegetarian"] = True
+        if re.search(r"(不要|不吃|不含|排除)\s*時價", t):
+            prefs["noMarketPrice"] = True
+        for c in pl.CUISINES:
+            if c in t:
+                prefs["cuisine"] = c
+                break
+        for dish, kws in pl.PREFERRED_DISHES:
+            if any(kw in t for kw in kws):
+                prefs["preferredDish"] = dish
+                break
+        if "飲料" in excludes or re.search(r"(不要|不含|無|不需要|別加)\s*飲料", t):
+            prefs["needDrink"] = False
+        elif any(k in t for k in pl.DRINK_POS):
+            prefs["needDrink"] = True
+        m2 = re.search(r"(\d{1,2})\s*人", t)
+        if m2:
+            prefs["people"] = int(m2.group(1))
+        cue_main = any(k in t for k in pl.CUE_MAIN)
+        cue_variety = any(k in t for k in pl.CUE_VARIETY)
+        cue_light = any(k in t for k in pl.CUE_LIGHT)
+        has_budget = prefs.get("budget") is not None
+        need_drink = prefs.get("needDrink", False)
+        constraint_count = sum([has_budget, bool(need_drink), "spiceLevel" in prefs, bool(excludes),
+                                "cuisine" in prefs, cue_main, cue_variety, cue_light])
+        prefs["weights"] = {
+            "price": 1.0 if has_budget and constraint_count == 1 else (0.8 if has_budget else 0.3),
+            "main": 0.8 if cue_main else 0.5,
+            "variety": 0.8 if cue_variety else 0.4,
+            "drink": (0.6 if need_drink else -0.8),
+            "spice": 0.7 if prefs.get("spiceLevel") == "不辣" or cue_light else 0.2,
+            "category": 0.5,
+            "cuisine": 0.6 if "cuisine" in prefs else 0.0,
+        }
+        return prefs
+
+    texts = _chat_log_texts()
+    # 數字跨過單品價格片段等邊界情況，加上隨機拼接的線索片段
+    edge_cases = ["預算300每道1500300", "每道150預算300", "預算每道20050", "單品1200預算3000元以內", "預算<=每份99 8人"]
+    rng = random.Random(0)
+    fragments = ["預算", "每道", "單品", "每份", "不超過", "以下", "元", "塊", "不要", "不吃", "牛肉", "辣", "不辣",
+                 "飲料", "人", "素", "時價", "日式", "漢堡", "、", " ", "<=", "3", "50", "300", "1500", "12"]
+    fuzz = ["".join(rng.choice(fragments) for _ in range(rng.randint(1, 8))) for _ in range(args.fuzz)]
+    for text in [*texts, *edge_cases, *fuzz]:
+        assert multi_pass(text) == pl.keyword_prefs(text), f"結果不一致：{text!r}"
+        pl.keyword_prefs_with_coverage(text)
+    print(f"與逐項掃描一致：{len(texts)} 則訊息 + {len(edge_cases)} 則邊界情況 + {len(fuzz)} 則隨機片段")
+    t_old = _timeit(lambda: [multi_pass(t) for t in texts], args.repeat) * 1000 / len(texts)
+    t_new = _timeit(lambda: [pl.keyword_prefs(t) for t in texts], args.repeat) * 1000 / len(texts)
+    print(f"{len(texts)} 則使用者訊息")
+    print(f"  逐項掃描：{t_old:.1f}µs / 則")
+    print(f"  單次掃描：{t_new:.1f}µs / 則（{t_old / t_new:.1f}x）")
+
+
+def stand_in_server(delay: float) -> ThreadingHTTPServer:
+    """本機假 ollama：/api/version 立即回應，/api/generate 一次只處理一個（像單一 GPU），睡 delay 秒後回傳自己的 port"""
+    busy = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, body: Dict[str, Any]) -> None:
+            raw = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_GET(self) -> None:
+            self._reply({"version": "stand-in"})
+
+        def do_POST(self) -> None:
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with busy:
+                time.sleep(delay)
+            self._reply({"response": str(self.server.server_address[1]), "done": True})
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_pool(args: argparse.Namespace) -> None:
+    from ollama_pool import OllamaPool
+
+    # 其中一台比較慢；另外加一個沒人監聽的位址，模擬掛掉的後端
+    delays = [args.delay] * (args.backends - 1) + [args.delay * 3]
+    servers = [stand_in_server(d) for d in delays]
+    urls = [f"http://127.0.0.1:{srv.server_address[1]}" for srv in servers]
+    dead = stand_in_server(0)
+    dead_url = f"http://127.0.0.1:{dead.server_address[1]}"
+    dead.shutdown()
+    dead.server_close()
+
+    def run(pool: OllamaPool) -> Tuple[float, Dict[str, int]]:
+        sessions = [f"s{i}" for i in range(args.sessions)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+            outs = list(ex.map(lambda i: pool.generate("m", "hi", timeout=5, session=sessions[i % len(sessions)]),
+                               range(args.requests)))
+        counts: Dict[str, int] = {}
+        for port in outs:
+            counts[port] = counts.get(port, 0) + 1
+        return args.requests / (time.perf_counter() - start), counts
+
+    single, _ = run(OllamaPool(urls[:1]))
+    print(f"單一後端：{single:.1f} req/s")
+    pool = OllamaPool(urls + [dead_url], max_failures=2)
+    rate, counts = run(pool)
+    print(f"{len(urls)} 台後端 + 1 台掛掉：{rate:.1f} req/s（{rate / single:.1f}x）")
+    for b in pool.stats()["backends"]:
+        port = b["url"].rsplit(":", 1)[1]
+        print(f"  {b['url']:24} 處理 {counts.get(port, 0):4d}  錯誤 {b['errors']}  "
+              f"剔除 {b['ejections']}  同 session 命中 {b['affinityHits']}  平均 {b['latencyMs']}ms")
+    for srv in servers:
+        srv.shutdown()
+
+
+def synthetic_chain_menu(args: argparse.Namespace, seed: int = 0) -> Dict[str, Any]:
+    """合成連鎖速食菜單（菜名含關鍵字，不需 LLM 分類）"""
+    rng = random.Random(seed)
+    flavors = ["", "辣味", "經典", "雙層", "照燒", "培根", "黃金"]
+    bases = {
+        "主餐": (["牛肉漢堡", "雞腿堡", "豬排堡", "咖哩飯", "牛肉麵"], args.mains, (69, 229)),
+        "點心": (["薯條", "雞塊", "沙拉", "洋蔥圈"], args.sides, (35, 99)),
+        "飲料": (["紅茶", "綠茶", "奶茶", "咖啡", "可樂"], args.drinks, (25, 89)),
+        "甜點": (["蛋撻", "冰淇淋", "蘋果派"], args.desserts, (30, 69)),
+    }
+    categories = []
+    for cat, (names, n, (lo, hi)) in bases.items():
+        items = [{"name": f"{rng.choice(flavors)}{rng.choice(names)}{i:02d}", "price": rng.randrange(lo, hi, 5)}
+                 for i in range(n)]
+        categories.append({"name": cat, "items": items})
+    return {"categories": categories}
+
+
+def bench_combos(args: argparse.Namespace) -> None:
+    """預先算好的組合表（bisect + bitset 過濾）與請求時即時挑選的比較"""
+    import copy
+    import combo_table
+    import menu_facets
+    import menu_snapshot
+    import ollama_fuc
+
+    menu = synthetic_chain_menu(args)
+    tables = combo_table.ComboTables(ollama_fuc.COMBO_TABLES.labeler, ollama_fuc.item_type_from_labels, layers=args.layers)
+    table = tables.build(menu, version="v1")
+    print(f"菜單 {args.mains}/{args.sides}/{args.drinks}/{args.desserts}（主餐/配菜/飲料/甜點），"
+          f"組合表 {len(table)} 套，建表 {table.build_ms:.1f}ms")
+    for cat, label, reused in ((2, "飲料", "主餐 + 配菜"), (3, "甜點", "主餐 + 配菜 + 飲料")):
+        changed = copy.deepcopy(menu)
+        changed["categories"][cat]["items"][0]["price"] += 5  # 只改一道菜的價格
+        start = time.perf_counter()
+        tables.build(changed, version=f"v-{label}")
+        print(f"  只改{label}後增量重建：{(time.perf_counter() - start) * 1000:.1f}ms（沿用{reused}的合併結果）")
+
+    facets = menu_facets.index_for(menu, tables.labeler, tables.typer)
+    by_type: Dict[str, List[Tuple[int, float, float]]] = {}
+    for t in combo_table.STAGES:
+        ids = list(menu_facets.iter_bits(facets.types.get(t, 0)))
+        rank = {name: score for _, score, (name,) in
+                combo_table.type_points([(str(facets.items[i]["name"]), float(facets.items[i]["price"])) for i in ids])}
+        by_type[t] = [(i, float(facets.items[i]["price"]), rank[str(facets.items[i]["name"])]) for i in ids]
+
+    def on_the_fly(budget: float, allowed: int) -> float:
+        """即時列舉所有組合，回傳預算內的最高分"""
+        pools = [[x for x in by_type[t] if allowed >> x[0] & 1] for t in ("main", "side", "drink")]
+        desserts = [None] + [x for x in by_type["dessert"] if allowed >> x[0] & 1]
+        best = -1.0
+        for combo in itertools.product(*pools):
+            cost = sum(x[1] for x in combo)
+            score = sum(x[2] for x in combo)
+            for d in desserts:
+                total, value = (cost, score) if d is None else (cost + d[1], score + d[2])
+                if total <= budget and value > best:
+                    best = value
+        return best
+
+    rng = random.Random(1)
+    words = ["牛肉", "辣", "雞", "咖啡", "培根", "奶"]
+    queries = [(float(rng.randrange(150, 450, 10)), facets.filter(excludes=rng.sample(words, rng.randint(0, 2))))
+               for _ in range(args.queries)]
+    # 排除條件可能把前幾層前緣都濾掉，此時查表結果不一定是最佳，統計一致率與分數差距
+    agree = 0
+    ratio = 0.0
+    for budget, allowed in queries[:args.verify]:
+        hits = table.query(budget, allowed, limit=1)
+        got = table.scores[hits[0]] if hits else 0.0
+        expected = on_the_fly(budget, allowed)
+        agree += round(got, 6) == round(expected, 6)
+        ratio += got / expected if expected > 0 else 1.0
+    t_table = _timeit(lambda: [table.query(b, a) for b, a in queries], 5) / len(queries)
+    t_fly = _timeit(lambda: [on_the_fly(b, a) for b, a in queries[:args.verify]], 1) / args.verify
+    print(f"  查詢（預算 + 排除）：組合表 {t_table * 1000:.1f}µs / 即時列舉 {t_fly:.2f}ms"
+          f"（{t_fly / t_table:.0f}x）")
+    print(f"  前 {args.verify} 筆與即時列舉的最佳分數一致 {agree}/{args.verify}，平均達最佳分數的 {ratio / args.verify:.1%}")
+
+    # 整個 recommend()：有無組合表
+    menu_snapshot.publish({"bench": menu}, "bench")
+    ollama_fuc.COMBO_TABLES.sync(menu_snapshot.current())
+    os.environ["USE_LLM_CLASSIFICATION"] = "false"
+    prefs = [{"budget": b, "excludes": ["牛肉"]} for b, _ in queries[:50]]
+    for enabled in (False, True):
+        ollama_fuc.COMBO_TABLE = enabled
+        with contextlib.redirect_stdout(io.StringIO()):
+            ms = _timeit(lambda: [ollama_fuc.recommend(menu, p) for p in prefs], 3) / len(prefs)
+        print(f"  recommend() {'組合表' if enabled else '即時挑選'}：{ms:.2f}ms/次")
+
+
+def bench_cross(args: argparse.Namespace) -> None:
+    """跨餐廳推薦：逐家呼叫 recommend() 與分片平行（CrossRecommender）的比較"""
+    import cross_recommend
+    import menu_snapshot
+    import ollama_fuc
+
+    os.environ["USE_LLM_CLASSIFICATION"] = "false"
+    menus = {f"餐廳{i:04d}": synthetic_chain_menu(args, seed=i) for i in range(args.restaurants)}
+    menu_snapshot.publish(menus, None)  # 推薦快取以快照版本為 key
+    prefs = {"budget": args.budget, "excludes": ["牛肉"], "needDrink": True}
+    print(f"{len(menus)} 家餐廳，每家 {args.mains}/{args.sides}/{args.drinks}/{args.desserts}（主餐/配菜/飲料/甜點）")
+
+    def sequential(seed: int) -> List[Tuple[float, str]]:
+        scored = []
+        for name, m in menus.items():
+            value = cross_recommend.score(ollama_fuc.recommend(m, prefs, seed=seed, quiet=True), prefs, name)
+            if value is not None:
+                scored.append((value, name))
+        return sorted(scored, reverse=True)[:3]
+
+    searcher = cross_recommend.CrossRecommender(workers=args.workers, deadline=60)
+    # 每輪用不同的 seed，避開推薦快取
+    for label, base, fn in (("逐家", 1000, sequential),
+                            (f"{searcher.workers} 執行緒 / {searcher.shards} 份", 2000,
+                             lambda s: searcher.recommend_all(menus, prefs, seed=s))):
+        start = time.perf_counter()
+        for r in range(args.repeat):
+            fn(base + r)
+        print(f"  {label}：{(time.perf_counter() - start) * 1000 / args.repeat:.1f}ms/次（未命中快取）")
+    searcher.recommend_all(menus, prefs, seed=3000)
+    start = time.perf_counter()
+    result = searcher.recommend_all(menus, prefs, seed=3000)
+    print(f"  命中推薦快取：{(time.perf_counter() - start) * 1000:.1f}ms/次")
+    expected = sequential(3000)
+    got = [(r["score"], r["restaurant"]) for r in result["results"]]
+    print(f"  前 3 名與逐家排序一致：{got == expected}  {got}")
+
+
+def bench_procs(args: argparse.Namespace) -> None:
+    """同時多個請求呼叫 recommend()：行程內（GIL）與 fork 工作行程（RECOMMEND_POOL）的吞吐量比較"""
+    import menu_snapshot
+    import ollama_fuc
+
+    os.environ["USE_LLM_CLASSIFICATION"] = "false"
+    menus = {f"餐廳{i:04d}": synthetic_chain_menu(args, seed=i) for i in range(args.restaurants)}
+    snap = menu_snapshot.publish(menus, None)
+    pool = ollama_fuc.RECOMMEND_POOL
+    pool.workers = args.workers or pool.workers
+    pool.enabled = True
+    pool.sync(snap)
+    print(f"{len(menus)} 家餐廳，每家 {args.mains}/{args.sides}/{args.drinks}/{args.desserts}（主餐/配菜/飲料/甜點），"
+          f"{args.clients} 個同時請求；fork {pool.workers} 個工作行程 {pool.fork_ms:.0f}ms")
+    # 多人聚餐走組合搜尋，是最吃 CPU 的一條路徑
+    prefs = [{"budget": 200 + 10 * (i % 30), "excludes": ["牛肉"], "people": 1 + i % 10} for i in range(args.requests)]
+    names = list(menus)
+
+    def one(i: int, base: int) -> None:
+        ollama_fuc.recommend(menus[names[i % len(names)]], prefs[i], seed=base + i, quiet=True)
+
+    for label, enabled, base in (("行程內", False, 10_000), (f"{pool.workers} 個工作行程", True, 20_000)):
+        pool.enabled = enabled
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.clients) as clients:
+            list(clients.map(lambda i: one(i, base), range(args.requests)))
+        elapsed = time.perf_counter() - start
+        print(f"  {label}：{args.requests / elapsed:.0f} 次/秒（{elapsed * 1000 / args.requests:.2f}ms/次）")
+    print(f"  {pool.stats()}")
+    pool.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="點餐助手效能基準測試")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("search", help="菜品反向索引查詢延遲")
+    p.add_argument("--dishes", type=int, default=100_000)
+    p.add_argument("--repeat", type=int, default=200)
+    p.set_defaults(func=bench_search)
+
+    p = sub.add_parser("matcher", help="關鍵字分類 / 排除過濾")
+    p.add_argument("--items", type=int, default=10_000)
+    p.add_argument("--repeat", type=int, default=20)
+    p.set_defaults(func=bench_matcher)
+
+    p = sub.add_parser("lexer", help="偏好關鍵字抽取")
+    p.add_argument("--repeat", type=int, default=50)
+    p.add_argument("--fuzz", type=int, default=100_000, help="隨機線索片段組合的比對筆數")
+    p.set_defaults(func=bench_lexer)
+
+    p = sub.add_parser("pool", help="多台 ollama 後端負載平衡（本機假後端）")
+    p.add_argument("--backends", type=int, default=3)
+    p.add_argument("--requests", type=int, default=300)
+    p.add_argument("--sessions", type=int, default=20)
+    p.add_argument("--concurrency", type=int, default=12)
+    p.add_argument("--delay", type=float, default=0.02)
+    p.set_defaults(func=bench_pool)
+
+    p = sub.add_parser("combos", help="預先算好的套餐組合表 vs 即時挑選")
+    p.add_argument("--mains", type=int, default=40)
+    p.add_argument("--sides", type=int, default=12)
+    p.add_argument("--drinks", type=int, default=20)
+    p.add_argument("--desserts", type=int, default=8)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--verify", type=int, default=20)
+    p.add_argument("--layers", type=int, default=None, help="Pareto 前緣層數（預設 COMBO_TABLE_LAYERS）")
+    p.set_defaults(func=bench_combos)
+
+    p = sub.add_parser("cross", help="跨餐廳推薦（所有已載入菜單）")
+    p.add_argument("--restaurants", type=int, default=200)
+    p.add_argument("--mains", type=int, default=12)
+    p.add_argument("--sides", type=int, default=6)
+    p.add_argument("--drinks", type=int, default=8)
+    p.add_argument("--desserts", type=int, default=4)
+    p.add_argument("--budget", type=float, default=200)
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_cross)
+
+    p = sub.add_parser("procs", help="多行程推薦後端（RECOMMEND_POOL）吞吐量")
+    p.add_argument("--restaurants", type=int, default=50)
+    p.add_argument("--mains", type=int, default=40)
+    p.add_argument("--sides", type=int, default=12)
+    p.add_argument("--drinks", type=int, default=20)
+    p.add_argument("--desserts", type=int, default=8)
+    p.add_argument("--requests", type=int, default=400)
+    p.add_argument("--clients", type=int, default=8)
+    p.add_argument("--workers", type=int, default=None)
+    p.set_defaults(func=bench_procs)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
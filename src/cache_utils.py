@@ -0,0 +1,188 @@
+"""共用快取工具：有上限的 LRU（可選 TTL、可存檔）、single-flight 合併，並統計命中率供 /api/metrics 匯出"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 1024, name: str = "cache", ttl: Optional[float] = None) -> None:
+        """ttl：項目存活秒數，None 表示不過期"""
+        self.maxsize = maxsize
+        self.name = name
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._expires: Dict[Hashable, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, key: Hashable) -> bool:
+        """呼叫時須持有鎖；過期的項目順便移除"""
+        if self.ttl is None or self._expires.get(key, float("inf")) > time.monotonic():
+            return False
+        del self._data[key]
+        self._expires.pop(key, None)
+        self.expirations += 1
+        return True
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data and not self._expired(key)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING or self._expired(key):
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.ttl is not None:
+                self._expires[key] = time.monotonic() + self.ttl
+            while len(self._data) > self.maxsize:
+                old, _ = self._data.popitem(last=False)
+                self._expires.pop(old, None)
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Tuple[Any, bool]:
+        """回傳 (值, 是否命中)；未命中時呼叫 compute() 並存入"""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value, True
+        value = compute()
+        self.put(key, value)
+        return value, False
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+
+    def prune(self, keep: Callable[[Hashable], bool]) -> int:
+        """移除 keep(key) 為 False 的項目，回傳移除筆數"""
+        with self._lock:
+            stale = [k for k in self._data if not keep(k)]
+            for k in stale:
+                del self._data[k]
+                self._expires.pop(k, None)
+        return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        stats = {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRate": round(self.hits / total, 4) if total else 0.0,
+        }
+        if self.ttl is not None:
+            stats["ttl"] = self.ttl
+            stats["expirations"] = self.expirations
+        return stats
+
+    # 存檔（只支援字串鍵與可 JSON 序列化的值）-----------------------
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            rows = [[k, v] for k, v in self._data.items() if isinstance(k, str)]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        os.replace(tmp, path)
+
+    def load(self, path: str) -> int:
+        """讀回存檔，回傳載入筆數；檔案不存在或損壞的行直接略過"""
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    key, value = json.loads(line)
+                except Exception:
+                    continue
+                self.put(key, value)
+                count += 1
+        return count
+
+
+class _Call:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """相同鍵的並行呼叫只執行一次：第一個呼叫者實際執行，其餘等待並共用結果（或例外）"""
+
+    def __init__(self, name: str = "singleflight") -> None:
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """回傳 (值, 是否共用了別人的執行結果)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.value, False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"inFlight": len(self._calls), "executed": self.executed, "coalesced": self.coalesced}
+
+
+# 各模組註冊的快取，/api/metrics 會逐一匯出 stats()
+_REGISTRY: Dict[str, Any] = {}
+
+
+def register(cache: Any) -> Any:
+    _REGISTRY[cache.name] = cache
+    return cache
+
+
+def all_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: cache.stats() for name, cache in _REGISTRY.items()}
@@ -0,0 +1,229 @@
+"""菜品 LLM 分類的微批次排程
+
+recommend() 與新爬到的菜單都會需要分類菜名。各處不再各自送 prompt，而是把尚未分類的菜名
+丟進同一個佇列：收集一小段時間（CLASSIFY_BATCH_WINDOW_MS）或累積到 token 上限就出發，
+依 token 上限切成數個 prompt 送給模型，再把解析出的分類分送回各個等待者。
+- 已分類過的菜名直接從快取回傳（鍵 = (模型, 菜名)）
+- 同一菜名同時被多處要求時只排一次
+- 每個 prompt 有品項上限，大菜單會切成多個 prompt 平行送出，每個 prompt 回來就先把結果交給等待者；
+  呼叫端可只等到期限，已完成的部分先用，其餘繼續在背景跑完並寫入快取
+- 每行以編號標示菜品（「3: drink」），依編號對回菜名，模型漏掉一行也不會讓後面全部錯位
+- 模型失敗或漏掉某個編號時該菜名回傳 None，由呼叫端改用關鍵字分類（不快取，之後可重試）
+"""
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import cache_utils
+import context_window
+
+LABELS = ("main", "side", "drink", "dessert", "other")
+
+_PROMPT_HEAD = """請分類以下菜品，每個菜品只回答一個分類代碼：
+- main: 主食/主餐（漢堡、套餐、吐司、貝果、米飯、麵食等）
+- side: 配菜/小食（薯條、雞塊、魚圈、蝦塊、沙拉等）
+- drink: 飲料（茶、咖啡、可樂、果汁、奶茶、啤酒、紅酒、白酒、各種酒類等）
+- dessert: 甜點（蛋撻、蛋糕、冰淇淋、派等）
+- other: 其他
+
+重要：所有酒類（啤酒、紅酒、白酒、威士忌等）都應分類為 drink（飲料）
+
+菜品列表：
+"""
+_PROMPT_TAIL = """
+請回答每個菜品的分類，每行格式為「編號: 代碼」（代碼只寫 main/side/drink/dessert/other），範例：
+1: main
+2: drink
+3: side
+"""
+_PROMPT_OVERHEAD = context_window.count_tokens(_PROMPT_HEAD + _PROMPT_TAIL)
+# 「3: drink」「3. drink」「(3) drink」都接受
+_TAGGED_RE = re.compile(r"^\W*(\d+)\W+([a-z]+)")
+
+
+def build_prompt(names: List[str]) -> str:
+    items_text = "\n".join(f"{i + 1}. {name}" for i, name in enumerate(names))
+    return _PROMPT_HEAD + items_text + "\n" + _PROMPT_TAIL
+
+
+def parse_labels(response: str, n: int) -> List[Optional[str]]:
+    """依編號取出 n 個分類代碼；缺少或不認得的編號為 None。
+
+    模型完全沒寫編號、但剛好回了 n 行代碼時才退回依行序對應。
+    """
+    labels: List[Optional[str]] = [None] * n
+    bare: List[str] = []
+    tagged = False
+    for line in response.lower().split("\n"):
+        m = _TAGGED_RE.match(line)
+        if m:
+            tagged = True
+            idx, label = int(m.group(1)) - 1, m.group(2)
+            if 0 <= idx < n and label in LABELS:
+                labels[idx] = label
+        elif line.strip():
+            bare.append(line.strip())
+    if not tagged and len(bare) == n:
+        return [label if label in LABELS else None for label in bare]
+    return labels
+
+
+def _item_tokens(index: int, name: str) -> int:
+    return context_window.count_tokens(f"{index}. {name}") + 1
+
+
+class ClassifyBatcher:
+    def __init__(
+        self,
+        call: Callable[[str, str], str],
+        name: str = "classifyBatcher",
+        window_ms: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        max_items: Optional[int] = None,
+        workers: Optional[int] = None,
+        cache_size: Optional[int] = None,
+    ) -> None:
+        """call(prompt, model) -> 模型回覆文字"""
+        self.call = call
+        self.name = name
+        self.window = (window_ms if window_ms is not None else float(os.environ.get("CLASSIFY_BATCH_WINDOW_MS", "30"))) / 1000
+        self.max_tokens = max_tokens or int(os.environ.get("CLASSIFY_BATCH_MAX_TOKENS", "1200"))
+        self.max_items = max_items or int(os.environ.get("CLASSIFY_BATCH_MAX_ITEMS", "25"))
+        self.cache = cache_utils.LRUCache(
+            cache_size or int(os.environ.get("CLASSIFY_CACHE_SIZE", "20000")), name="dishClassification"
+        )
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers or int(os.environ.get("CLASSIFY_BATCH_WORKERS", "3")), thread_name_prefix="classify-batch"
+        )
+        self._cond = threading.Condition()
+        self._futures: Dict[Tuple[str, str], Future] = {}  # 排隊中或送出中的 (模型, 菜名)
+        self._queue: Dict[str, List[str]] = {}              # 模型 → 排隊中的菜名
+        self._queued_tokens = 0
+        self._first_queued: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self.requested = 0
+        self.coalesced = 0
+        self.prompts = 0
+        self.batched_items = 0
+        self.failed_items = 0
+        self.partial_returns = 0
+
+    # 呼叫端 -------------------------------------------------------------
+
+    def submit(self, names: Iterable[str], model: str) -> Dict[str, Future]:
+        """把菜名排入佇列（已快取的直接完成），回傳 菜名 → Future[Optional[str]]"""
+        out: Dict[str, Future] = {}
+        queued = False
+        with self._cond:
+            for name in dict.fromkeys(n for n in names if n):
+                self.requested += 1
+                label = self.cache.get((model, name))
+                if label is not None:
+                    done: Future = Future()
+                    done.set_result(label)
+                    out[name] = done
+                    continue
+                key = (model, name)
+                future = self._futures.get(key)
+                if future is not None:
+                    self.coalesced += 1
+                else:
+                    future = self._futures[key] = Future()
+                    self._queue.setdefault(model, []).append(name)
+                    self._queued_tokens += _item_tokens(len(self._queue[model]), name)
+                    queued = True
+                out[name] = future
+            if queued:
+                if self._first_queued is None:
+                    self._first_queued = time.monotonic()
+                self._ensure_thread()
+                self._cond.notify()
+        return out
+
+    def classify(self, names: Iterable[str], model: str, timeout: Optional[float] = None) -> Dict[str, Optional[str]]:
+        """等待分類結果，最多等 timeout 秒；到期時已完成的 prompt 結果照用，其餘菜名為 None（仍在背景跑完）"""
+        futures = self.submit(names, model)
+        _, not_done = wait(list(futures.values()), timeout=timeout)
+        if not_done:
+            with self._cond:
+                self.partial_returns += 1
+        return {name: f.result() if f.done() else None for name, f in futures.items()}
+
+    # 排程 ---------------------------------------------------------------
+
+    def _ensure_thread(self) -> None:
+        """呼叫時須持有鎖"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="classify-batcher", daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                # 等到收集時間結束，或排隊的量已足夠塞滿一個 prompt
+                while self._queued_tokens + _PROMPT_OVERHEAD < self.max_tokens \
+                        and sum(len(v) for v in self._queue.values()) < self.max_items:
+                    remaining = self._first_queued + self.window - time.monotonic()  # type: ignore[operator]
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                queue, self._queue = self._queue, {}
+                self._queued_tokens = 0
+                self._first_queued = None
+            for model, names in queue.items():
+                for batch in self._pack(names):
+                    self._pool.submit(self._run_batch, model, batch)
+
+    def _pack(self, names: List[str]) -> List[List[str]]:
+        """依 token 與品項上限切成數個 prompt（每個至少一項）"""
+        batches: List[List[str]] = []
+        current: List[str] = []
+        tokens = _PROMPT_OVERHEAD
+        for name in names:
+            cost = _item_tokens(len(current) + 1, name)
+            if current and (tokens + cost > self.max_tokens or len(current) >= self.max_items):
+                batches.append(current)
+                current, tokens = [], _PROMPT_OVERHEAD
+                cost = _item_tokens(1, name)
+            current.append(name)
+            tokens += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    def _run_batch(self, model: str, names: List[str]) -> None:
+        try:
+            labels = parse_labels(self.call(build_prompt(names), model), len(names))
+        except Exception as e:
+            print(f" [分類批次] {len(names)} 項失敗：{e}")
+            labels = [None] * len(names)
+        with self._cond:
+            self.prompts += 1
+            self.batched_items += len(names)
+            self.failed_items += sum(1 for label in labels if label is None)
+            # 先寫入快取再移除 future，同時 submit() 的請求一定找得到其中之一，不會重複送出同一道菜
+            for name, label in zip(names, labels):
+                if label is not None:
+                    self.cache.put((model, name), label)
+            futures = [self._futures.pop((model, name)) for name in names]
+        for label, future in zip(labels, futures):
+            future.set_result(label)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "requested": self.requested,
+                "coalesced": self.coalesced,
+                "queued": sum(len(v) for v in self._queue.values()),
+                "prompts": self.prompts,
+                "batchedItems": self.batched_items,
+                "avgBatchSize": round(self.batched_items / self.prompts, 1) if self.prompts else 0.0,
+                "failedItems": self.failed_items,
+                "partialReturns": self.partial_returns,
+                "cache": self.cache.stats(),
+            }
@@ -0,0 +1,203 @@
+"""每家餐廳預先算好的套餐組合表（主食 + 配菜 + 飲料，可再加甜點），以總價排序供預算查詢
+
+連鎖店菜單的有效組合只跟菜單有關，不必每次請求都重新挑：
+- 每道菜的分數 = 在同類型中的價格名次（0～1，越貴份量 / 等級越高），組合分數為各道相加
+- 只保留「分數 vs 總價」的前 COMBO_TABLE_LAYERS 層 Pareto 前緣：第一層是每個價位的最佳組合，
+  後面幾層是排除條件把前面的組合濾掉時的備援
+- 依序合併 主食 → +配菜 → +飲料 → (+甜點)，每一步都先剪回前幾層前緣，組合數不會爆炸；菜單沒有配菜時略過配菜
+- 查詢：總價 bisect 找出預算內的前綴，再以 facet bitset 過濾含被排除菜品的組合
+- 增量重建：每一步的結果依「參與類型的菜品內容雜湊」快取，只有飲料變動時主食 + 配菜那一步直接沿用
+表在發佈快照時由 ComboTables.sync() 建立（COMBO_TABLE=true 時），recommend() 以 for_menu() 取用。
+"""
+import bisect
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import cache_utils
+import menu_facets
+import menu_snapshot
+
+STAGES = ("main", "side", "drink", "dessert")
+REQUIRED = ("main", "drink")  # 菜單沒有配菜時略過配菜；甜點可有可無
+COMBO_TABLE_LAYERS = int(os.environ.get("COMBO_TABLE_LAYERS", "8"))
+
+# (總價, 分數, 菜名)；菜名依 STAGES 順序（略過的類型不佔位）
+Point = Tuple[float, float, Tuple[str, ...]]
+
+
+def pareto_layers(points: List[Point], layers: int) -> List[Point]:
+    """保留前 layers 層 Pareto 前緣（總價低、分數高為佳），依總價排序回傳"""
+    remaining = sorted(points, key=lambda p: (p[0], -p[1]))
+    kept: List[Point] = []
+    for _ in range(layers):
+        if not remaining:
+            break
+        rest: List[Point] = []
+        best = -math.inf
+        for p in remaining:
+            if p[1] > best:
+                kept.append(p)
+                best = p[1]
+            else:
+                rest.append(p)
+        remaining = rest
+    kept.sort(key=lambda p: (p[0], -p[1]))
+    return kept
+
+
+def type_points(items: List[Tuple[str, float]]) -> List[Point]:
+    """單一類型的菜品 → 點；分數為價格名次（同價同分）"""
+    prices = sorted({p for _, p in items})
+    n = len(prices)
+    rank = {p: (i + 1) / n for i, p in enumerate(prices)}
+    return [(p, rank[p], (name,)) for name, p in items]
+
+
+def combine(a: List[Point], b: List[Point], layers: int) -> List[Point]:
+    return pareto_layers([(pa + pb, sa + sb, na + nb) for pa, sa, na in a for pb, sb, nb in b], layers)
+
+
+def _content_key(items: List[Tuple[str, float]]) -> str:
+    raw = json.dumps(sorted(items), ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class ComboTable:
+    """單一菜單版本的組合表；combos 依總價遞增"""
+
+    def __init__(self, version: str, combos: List[Tuple[float, float, Tuple[int, ...], Tuple[str, ...]]],
+                 build_ms: float) -> None:
+        self.version = version
+        self.totals = [c[0] for c in combos]
+        self.scores = [c[1] for c in combos]
+        self.ids = [c[2] for c in combos]
+        self.types = [c[3] for c in combos]  # 與 ids 對應的品項類型
+        self.masks = [sum(1 << i for i in ids) for ids in self.ids]
+        self.build_ms = build_ms
+
+    def __len__(self) -> int:
+        return len(self.totals)
+
+    def query(self, budget: Optional[float], allowed: int, prefer: int = 0, avoid: int = 0,
+              limit: int = 3) -> List[int]:
+        """預算內、只含 allowed 品項且不含 avoid 品項的組合索引，依（含 prefer 品項, 分數, 總價）排序"""
+        end = bisect.bisect_right(self.totals, budget) if budget else len(self.totals)
+        hits = [j for j in range(end) if not self.masks[j] & ~allowed and not self.masks[j] & avoid]
+        hits.sort(key=lambda j: (bool(self.masks[j] & prefer), self.scores[j], self.totals[j]), reverse=True)
+        return hits[:limit]
+
+
+class ComboTables:
+    """所有餐廳的組合表；依快照版本增量更新"""
+
+    def __init__(self, labeler: Callable[[str], Set[str]], typer: Callable[[Set[str]], str],
+                 name: str = "comboTables", layers: Optional[int] = None) -> None:
+        self.name = name
+        self.labeler = labeler
+        self.typer = typer
+        self.layers = layers or COMBO_TABLE_LAYERS
+        self.stages = cache_utils.LRUCache(int(os.environ.get("COMBO_STAGE_CACHE_SIZE", "256")), name="comboStages")
+        self._lock = threading.Lock()
+        self._tables: Dict[str, ComboTable] = {}
+        self.builds = 0
+        self.queries = 0
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self) -> None:
+        """fork 出的工作行程（見 recommend_pool）只有一條執行緒，換掉 fork 當下可能被持有的鎖"""
+        self._lock = threading.Lock()
+
+    def build(self, menu: Dict[str, Any], restaurant: Optional[str] = None, version: str = "") -> ComboTable:
+        """由菜單的 facet 索引建表；restaurant 指定時只用該餐廳的品項（多餐廳格式）"""
+        started = time.perf_counter()
+        facets = menu_facets.index_for(menu, self.labeler, self.typer)
+        # 類型 → [(菜名, 價格)]；無價格與時價（0）不列入，同類型同名只留第一道
+        by_type: Dict[str, List[Tuple[str, float]]] = {}
+        id_of: Dict[Tuple[str, str], int] = {}
+        for t in STAGES:
+            for i in menu_facets.iter_bits(facets.types.get(t, 0)):
+                item = facets.items[i]
+                if restaurant is not None and item.get("restaurant") not in (None, restaurant):
+                    continue
+                value = item.get("priceValue")
+                price = float(value) if value is not None else menu_facets.numeric_price(item.get("price"))
+                name = str(item.get("name", ""))
+                if not price or not name or (t, name) in id_of:
+                    continue
+                id_of[(t, name)] = i
+                by_type.setdefault(t, []).append((name, price))
+
+        points: List[Point] = []
+        used: Tuple[str, ...] = ()
+        if all(by_type.get(t) for t in REQUIRED):
+            key: Tuple[str, ...] = ()
+            for t in STAGES:
+                if not by_type.get(t):
+                    continue
+                key += (t, _content_key(by_type[t]))
+                cached = self.stages.get((key, self.layers))
+                if cached is None:
+                    typed = pareto_layers(type_points(by_type[t]), self.layers)
+                    if not points:
+                        cached = typed
+                    elif t == "dessert":
+                        # 有甜點與沒甜點的組合一起取前緣
+                        cached = pareto_layers(points + combine(points, typed, self.layers), self.layers)
+                    else:
+                        cached = combine(points, typed, self.layers)
+                    self.stages.put((key, self.layers), cached)
+                points = cached
+                used += (t,)
+
+        combos = [(total, score, tuple(id_of[(used[k], n)] for k, n in enumerate(names)), used[:len(names)])
+                  for total, score, names in points]
+        table = ComboTable(version, combos, round((time.perf_counter() - started) * 1000, 2))
+        with self._lock:
+            self.builds += 1
+        return table
+
+    def sync(self, snapshot: Any) -> int:
+        """依菜單快照增量更新，回傳重建的餐廳數"""
+        changed = 0
+        tables: Dict[str, ComboTable] = {}
+        for name, rs in snapshot.restaurants.items():
+            table = self._tables.get(name)
+            if table is None or table.version != rs.version:
+                table = self.build(rs.source, restaurant=name, version=rs.version)
+                changed += 1
+            tables[name] = table
+        with self._lock:
+            self._tables = tables
+        return changed
+
+    def for_menu(self, menu: Dict[str, Any]) -> Optional[ComboTable]:
+        """menu 只對應到快照中的一家餐廳、且該版本已建表時回傳其組合表"""
+        snap = menu_snapshot.current()
+        if snap is None:
+            return None
+        owners = [rs for rs in snap.restaurants.values() if rs.source is menu]
+        if len(owners) != 1:
+            return None
+        table = self._tables.get(owners[0].name)
+        if table is None or table.version != owners[0].version:
+            return None
+        with self._lock:
+            self.queries += 1
+        return table
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "tables": len(self._tables),
+                "combos": sum(len(t) for t in self._tables.values()),
+                "builds": self.builds,
+                "queries": self.queries,
+                "buildMs": round(sum(t.build_ms for t in self._tables.values()), 2),
+                "stages": self.stages.stats(),
+            }
@@ -0,0 +1,112 @@
+"""對話上下文視窗：估算 token 數、只保留最近幾輪、較舊的內容以偏好摘要代替
+
+session 的 history 會一直累積，但使用者說過的條件早已合併進 Preferences，
+所以舊訊息不必原文保留：送進模型的上下文 = 偏好摘要 + 放得進 token 預算的最近幾則訊息，
+不論對話多長，prompt 大小都維持固定上限。
+"""
+import os
+import re
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+# 送進模型的上下文 token 上限，與每個 session 保留的訊息則數（user + assistant 各算一則）
+CONTEXT_MAX_TOKENS = int(os.environ.get("CONTEXT_MAX_TOKENS", "3000"))
+HISTORY_MAX_MESSAGES = int(os.environ.get("HISTORY_MAX_MESSAGES", "12"))
+
+# 粗估：漢字一字一個 token、英數字每 4 個字元一個 token、其他符號一個 token
+_TOKEN_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]|[A-Za-z0-9]+|\S")
+# 每則訊息的角色前綴與換行
+_MESSAGE_OVERHEAD = 3
+
+
+def count_tokens(text: str) -> int:
+    total = 0
+    for tok in _TOKEN_RE.findall(text):
+        total += (len(tok) + 3) // 4 if tok.isascii() and tok.isalnum() else 1
+    return total
+
+
+def message_tokens(message: Mapping[str, Any]) -> int:
+    return count_tokens(str(message.get("content", ""))) + _MESSAGE_OVERHEAD
+
+
+def summarize_prefs(prefs: Mapping[str, Any]) -> str:
+    """把累積的偏好濃縮成一行文字（例如「預算 $500、2 人、不要牛肉、要飲料」）"""
+    parts: List[str] = []
+    if prefs.get("budget") is not None:
+        parts.append(f"預算 ${float(prefs['budget']):.0f}")
+    if prefs.get("people"):
+        parts.append(f"{prefs['people']} 人")
+    if prefs.get("spiceLevel"):
+        parts.append(f"辣度 {prefs['spiceLevel']}")
+    if prefs.get("cuisine"):
+        parts.append(f"菜系 {prefs['cuisine']}")
+    if prefs.get("preferredDish"):
+        parts.append(f"想吃 {prefs['preferredDish']}")
+    if prefs.get("excludes"):
+        parts.append("不要 " + "/".join(str(x) for x in prefs["excludes"]))
+    if "needDrink" in prefs:
+        parts.append("要飲料" if prefs["needDrink"] else "不要飲料")
+    if prefs.get("vegetarian"):
+        parts.append("素食")
+    if prefs.get("noMarketPrice"):
+        parts.append("不要時價")
+    if prefs.get("maxItemPrice") is not None:
+        parts.append(f"單品 ≤ ${float(prefs['maxItemPrice']):.0f}")
+    return "、".join(parts) if parts else "尚無特別條件"
+
+
+def trim_history(history: List[Any], max_messages: int = HISTORY_MAX_MESSAGES) -> int:
+    """就地只保留最近 max_messages 則訊息，回傳丟掉的則數"""
+    dropped = max(0, len(history) - max_messages)
+    if dropped:
+        del history[:dropped]
+    return dropped
+
+
+def fit_messages(
+    messages: Sequence[Mapping[str, Any]],
+    max_tokens: int = CONTEXT_MAX_TOKENS,
+    summary: Optional[str] = None,
+) -> List[Mapping[str, Any]]:
+    """挑出放得進 max_tokens 的訊息：system 訊息全留、其餘由新到舊放入，最新一則一定保留。
+
+    有訊息被捨棄且提供 summary 時，在 system 訊息後插入一則摘要代替。
+    """
+    system = [m for m in messages if m.get("role") == "system"]
+    turns = [m for m in messages if m.get("role") != "system"]
+    budget = max_tokens - sum(message_tokens(m) for m in system)
+
+    summary_msg: Optional[Dict[str, Any]] = None
+    if summary:
+        summary_msg = {"role": "system", "content": f"先前對話摘要：{summary}"}
+        budget -= message_tokens(summary_msg)
+
+    kept: List[Mapping[str, Any]] = []
+    for m in reversed(turns):
+        cost = message_tokens(m)
+        if kept and cost > budget:
+            break
+        kept.append(m)
+        budget -= cost
+    kept.reverse()
+
+    if summary_msg is not None and len(kept) < len(turns):
+        return [*system, summary_msg, *kept]
+    return [*system, *kept]
+
+
+def build_context(
+    history: Sequence[Mapping[str, Any]],
+    prefs: Mapping[str, Any],
+    max_tokens: int = CONTEXT_MAX_TOKENS,
+) -> List[Mapping[str, Any]]:
+    """session 歷史 → 送進模型的訊息：累積偏好摘要 + 放得進 max_tokens 的最近幾則原文
+
+    session 歷史已由 trim_history 截掉較舊的訊息，那些輪次說過的條件都已合併在 prefs 裡，
+    所以有先前的輪次就固定以一則摘要代替，不論對話多長大小都不變。
+    """
+    messages = [{"role": m.get("role", "user"), "content": m.get("content", "")} for m in history]
+    if not messages:
+        return []
+    summary = {"role": "system", "content": f"先前對話摘要：{summarize_prefs(prefs)}"}
+    return [summary, *fit_messages(messages, max_tokens - message_tokens(summary))]
@@ -0,0 +1,164 @@
+"""跨餐廳推薦：一次在所有已載入的菜單（RESTAURANT_MENUS）中找出最適合的幾家與組合
+
+「附近 200 元最好的晚餐」這類問題不限定目前的餐廳：
+- 餐廳切成 CROSS_RECOMMEND_SHARDS 份，交給執行緒池平行處理；每家照常呼叫 recommend()
+  （沿用各餐廳的 facet 索引、組合表與推薦快取，分類等待 LLM 時也不會卡住其他餐廳）
+- 各份每算完一家就放進共用的前 k 名（heap，以鎖保護），期限到時直接取當下的結果
+- 整體期限 CROSS_RECOMMEND_DEADLINE 秒：到期後各份不再開始新的餐廳，以已完成的排名；
+  已完成的餐廳結果留在推薦快取，同一句再問一次會比較到更多家
+- score()：涵蓋的餐點類型（主食 / 配菜 / 飲料 / 甜點）為主，預算用得越充分越好；超出預算的不列入
+"""
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import ollama_fuc
+
+# recommend() 的推薦理由 → 餐點類型（多人組合與組合表也沿用同一組理由）
+_REASON_TYPES = {
+    "主餐推薦": "main",
+    "最經濟實惠的主餐": "main",
+    "搭配配菜": "side",
+    "搭配飲品": "drink",
+    "搭配甜點": "dessert",
+}
+
+
+def _price(item: Dict[str, Any]) -> float:
+    price = item.get("price")
+    return float(price) if isinstance(price, (int, float)) else 0.0
+
+
+def score(rec: Dict[str, Any], prefs: Dict[str, Any], restaurant: str = "") -> Optional[float]:
+    """推薦結果的跨餐廳分數；沒有品項或超出預算時回傳 None"""
+    items = [it for it in rec.get("items") or [] if isinstance(it, dict)]
+    if not items:
+        return None
+    total = sum(_price(it) for it in items)
+    budget = prefs.get("budget")
+    if isinstance(budget, (int, float)) and budget > 0 and total > budget:
+        return None
+    wanted = {"main", "side", "drink", "dessert"}
+    if prefs.get("needDrink") is False:
+        wanted.discard("drink")
+    covered = {_REASON_TYPES.get(str(it.get("reason"))) for it in items} & wanted
+    value = float(len(covered)) + (1.0 if "main" in covered else 0.0)  # 沒有主食的組合排在後面
+    if isinstance(budget, (int, float)) and budget > 0:
+        value += total / budget
+    cuisine = prefs.get("cuisine")
+    if isinstance(cuisine, str) and cuisine and cuisine in restaurant:
+        value += 0.5
+    return round(value, 4)
+
+
+class CrossRecommender:
+    def __init__(
+        self,
+        recommend: Callable[..., Dict[str, Any]] = ollama_fuc.recommend,
+        name: str = "crossRecommend",
+        workers: Optional[int] = None,
+        shards: Optional[int] = None,
+        deadline: Optional[float] = None,
+    ) -> None:
+        self.recommend = recommend
+        self.name = name
+        self.workers = workers or int(os.environ.get("CROSS_RECOMMEND_WORKERS", "8"))
+        self.shards = shards or int(os.environ.get("CROSS_RECOMMEND_SHARDS", str(self.workers * 2)))
+        self.deadline = deadline if deadline is not None else float(os.environ.get("CROSS_RECOMMEND_DEADLINE", "5"))
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cross-recommend")
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.restaurants = 0
+        self.skipped = 0
+        self.errors = 0
+        self.last_ms = 0.0
+
+    def _shard(self, names: List[str], menus: Dict[str, Dict[str, Any]], prefs: Dict[str, Any], k: int,
+               seed: Optional[int], until: float, board: Dict[str, Any], lock: threading.Lock) -> None:
+        """處理一份餐廳，每算完一家就放進共用的前 k 名（board）；過了期限就不再開始新的餐廳"""
+        for name in names:
+            if time.monotonic() > until:
+                break
+            try:
+                rec = self.recommend(menus[name], prefs, top_k=5, seed=seed, quiet=True)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f" [跨餐廳推薦] {name} 失敗：{e}")
+                with lock:
+                    board["done"] += 1
+                continue
+            value = score(rec, prefs, name)
+            with lock:
+                board["done"] += 1
+                if value is None:
+                    continue
+                top: List[Tuple[float, str, Dict[str, Any]]] = board["top"]
+                entry = (value, name, rec)
+                if len(top) < k:
+                    heapq.heappush(top, entry)
+                elif entry[:2] > top[0][:2]:
+                    heapq.heapreplace(top, entry)
+
+    def recommend_all(self, menus: Dict[str, Dict[str, Any]], prefs: Dict[str, Any], k: int = 3,
+                      seed: Optional[int] = None) -> Dict[str, Any]:
+        """所有餐廳中分數最高的 k 家（每家一組推薦），依分數遞減
+
+        各份把算完的餐廳直接放進共用的前 k 名，期限到時取當下的結果：
+        卡在某一家（例如等 LLM 分類）的那份，先前算完的餐廳仍會列入。
+        """
+        started = time.monotonic()
+        until = started + self.deadline
+        names = list(menus)
+        n_shards = max(1, min(self.shards, len(names)))
+        board: Dict[str, Any] = {"top": [], "done": 0}
+        lock = threading.Lock()
+        futures = [
+            self._pool.submit(self._shard, names[i::n_shards], menus, prefs, k, seed, until, board, lock)
+            for i in range(n_shards)
+        ] if names else []
+        wait(futures, timeout=max(0.0, until - time.monotonic()))
+
+        with lock:
+            searched = board["done"]
+            best = heapq.nlargest(k, board["top"], key=lambda e: (e[0], e[1]))
+
+        elapsed = round((time.monotonic() - started) * 1000, 1)
+        with self._lock:
+            self.requests += 1
+            self.restaurants += searched
+            self.skipped += len(names) - searched
+            self.last_ms = elapsed
+        return {
+            "results": [
+                {
+                    "restaurant": name,
+                    "score": value,
+                    "total": sum(_price(it) for it in rec.get("items", []) if isinstance(it, dict)),
+                    "items": rec.get("items", []),
+                    "meta": rec.get("meta", {}),
+                }
+                for value, name, rec in best
+            ],
+            "meta": {
+                "restaurants": len(names),
+                "searched": searched,
+                "timedOut": searched < len(names),
+                "elapsedMs": elapsed,
+            },
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "shards": self.shards,
+                "requests": self.requests,
+                "restaurants": self.restaurants,
+                "skipped": self.skipped,
+                "errors": self.errors,
+                "lastMs": self.last_ms,
+            }
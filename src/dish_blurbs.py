@@ -0,0 +1,155 @@
+"""每道菜的預先生成介紹（blurb）
+
+每個菜單版本只生成一次：發佈快照後由背景工作把還沒有介紹的菜，每 BLURB_CHUNK_SIZE 道包成一個
+prompt 送給模型（每行以編號標示，依編號對回菜名），結果存在 RestaurantSnapshot.blurbs。
+菜單更新時名稱相同的菜沿用舊介紹（見 menu_snapshot.publish），只補新菜。
+回覆時用 lookup() 取介紹，套進 _fallback_format 的模板與預算試算，不必即時呼叫 LLM。
+"""
+import os
+import re
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+import menu_snapshot
+from menu_snapshot import MenuSnapshot, RestaurantSnapshot
+
+BLURB_MAX_CHARS = 60
+_TAGGED_RE = re.compile(r"^\W*(\d+)\s*[:：.、)）]\s*(.+)$")
+
+_PROMPT_HEAD = """你是餐廳的菜單文案。請為以下每道菜寫一句 15～30 字的繁體中文介紹（口味、口感或適合的場合），不要提到價格。
+
+菜品列表：
+"""
+_PROMPT_TAIL = """
+每行格式為「編號: 介紹」，不要其他說明，範例：
+1: 外皮酥脆、肉汁飽滿，配飯配酒都對味
+2: 清爽回甘，解膩剛好
+"""
+
+
+def build_prompt(dishes: List[Tuple[str, str]]) -> str:
+    """dishes：[(菜名, 分類), ...]"""
+    lines = "\n".join(f"{i + 1}. {name}（{category}）" for i, (name, category) in enumerate(dishes))
+    return _PROMPT_HEAD + lines + "\n" + _PROMPT_TAIL
+
+
+def parse_blurbs(response: str, n: int) -> List[Optional[str]]:
+    """依編號取出 n 則介紹；缺少的為 None"""
+    blurbs: List[Optional[str]] = [None] * n
+    for line in response.split("\n"):
+        m = _TAGGED_RE.match(line.strip())
+        if not m:
+            continue
+        idx = int(m.group(1)) - 1
+        text = m.group(2).strip().strip("「」\"'")
+        if 0 <= idx < n and text:
+            blurbs[idx] = text[:BLURB_MAX_CHARS]
+    return blurbs
+
+
+def _dishes(rs: RestaurantSnapshot) -> List[Tuple[str, str]]:
+    seen: Dict[str, str] = {}
+    for cat in rs.categories:
+        for item in cat["items"]:
+            name = str(item.get("name", "")) if isinstance(item, dict) else ""
+            if name and name not in seen:
+                seen[name] = cat["name"]
+    return list(seen.items())
+
+
+class BlurbJob:
+    """單一背景執行緒依序補齊各餐廳的介紹（活動餐廳優先）；不與即時請求搶模型"""
+
+    def __init__(self, name: str = "dishBlurbs", chunk_size: Optional[int] = None, model: Optional[str] = None) -> None:
+        self.name = name
+        self.chunk_size = chunk_size or int(os.environ.get("BLURB_CHUNK_SIZE", "20"))
+        self.model = model or os.environ.get("BLURB_MODEL") or os.environ.get("OLLAMA_MODEL", "gemma3:12b")
+        self._cond = threading.Condition()
+        self._queue: Deque[RestaurantSnapshot] = deque()
+        self._thread: Optional[threading.Thread] = None
+        self.prompts = 0
+        self.generated = 0
+        self.failed = 0
+
+    def schedule(self, snap: MenuSnapshot) -> int:
+        """把快照中還有菜缺介紹的餐廳排入佇列，回傳缺介紹的菜數"""
+        missing = 0
+        ordered = sorted(snap.restaurants.values(), key=lambda rs: rs.name != snap.active)
+        with self._cond:
+            for rs in ordered:
+                todo = sum(1 for name, _ in _dishes(rs) if name not in rs.blurbs)
+                if todo and all(q is not rs for q in self._queue):
+                    self._queue.append(rs)
+                missing += todo
+            if self._queue:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name="dish-blurbs", daemon=True)
+                    self._thread.start()
+                self._cond.notify()
+        return missing
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                rs = self._queue.popleft()
+            try:
+                self.generate(rs)
+            except Exception as e:
+                print(f" [菜品介紹] {rs.name} 生成失敗：{e}")
+
+    def generate(self, rs: RestaurantSnapshot) -> int:
+        """補齊單一餐廳快照的介紹，回傳新增則數（模型失敗的菜留待下次發佈再試）"""
+        from ollama_fuc import chat
+
+        todo = [d for d in _dishes(rs) if d[0] not in rs.blurbs]
+        added = 0
+        for start in range(0, len(todo), self.chunk_size):
+            chunk = todo[start:start + self.chunk_size]
+            try:
+                response = chat([{"role": "user", "content": build_prompt(chunk)}], model=self.model,
+                                timeout=120.0, task="blurb")
+                blurbs = parse_blurbs(response, len(chunk))
+            except Exception as e:
+                print(f" [菜品介紹] {rs.name} 第 {start // self.chunk_size + 1} 批失敗：{e}")
+                blurbs = [None] * len(chunk)
+            for (name, _), blurb in zip(chunk, blurbs):
+                if blurb:
+                    rs.blurbs[name] = blurb
+                    added += 1
+            with self._cond:
+                self.prompts += 1
+                self.generated += sum(1 for b in blurbs if b)
+                self.failed += sum(1 for b in blurbs if not b)
+        if added:
+            print(f" [菜品介紹] {rs.name}：新增 {added} 則（共 {len(rs.blurbs)}）")
+        return added
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "queued": len(self._queue),
+                "prompts": self.prompts,
+                "generated": self.generated,
+                "failed": self.failed,
+                "model": self.model,
+            }
+
+
+def lookup(names: Iterable[str], restaurant: Optional[str] = None) -> Dict[str, str]:
+    """從目前快照取介紹；先找指定（預設為活動）餐廳，找不到再找其他餐廳"""
+    snap = menu_snapshot.current()
+    if snap is None:
+        return {}
+    first = snap.restaurants.get(restaurant or snap.active or "")
+    sources = ([first] if first is not None else []) + [rs for rs in snap.restaurants.values() if rs is not first]
+    found: Dict[str, str] = {}
+    for name in names:
+        for rs in sources:
+            blurb = rs.blurbs.get(name)
+            if blurb:
+                found[name] = blurb
+                break
+    return found
@@ -0,0 +1,228 @@
+"""多人聚餐的組合搜尋：依人數配置各類型道數，在預算內一次找出數套彼此不同的組合
+
+recommend() 的一般流程固定挑 2 主食 / 1 配菜 / 2 飲料 / 1 甜點，8～20 人的聚餐不夠吃，
+「換一套」也只是重新洗牌。人數達 GROUP_COMBO_MIN_PEOPLE 時改用這裡：
+- slot_counts()：依人數決定各類型道數（分享式點菜，約兩人一道主菜）；預算連最便宜的組合都付不起時依序減少甜點、配菜、飲料
+- 逐道填入的 beam search，每一步以「已選成本 + 剩餘道數可能的最低成本」剪掉超出預算的分支
+- 多樣性：同一類型中同一菜單分類最多 ceil(道數 / 分類數) 道；每多涵蓋一個菜單分類加分
+- k 套備選：每找到一套，就對其中的菜扣分再搜一次，與已選組合重疊超過 GROUP_COMBO_MAX_OVERLAP 的不收
+- 整體時間上限 GROUP_COMBO_TIME_MS；到期後剩下的道數改為每步只留一個分支（仍保證回傳完整組合）
+- 大菜單每類型只取 GROUP_COMBO_CANDIDATES 道候選，搜尋量與菜單大小無關
+"""
+import math
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+TYPES = ("main", "side", "drink", "dessert")
+REASONS = {"main": "主餐推薦", "side": "搭配配菜", "drink": "搭配飲品", "dessert": "搭配甜點"}
+# 預算不夠時依序減少的類型（主食至少留 1 道）
+_SHRINK_ORDER = ("dessert", "side", "drink", "main")
+_NO_PRICE = 999999.0
+
+GROUP_MIN_PEOPLE = int(os.environ.get("GROUP_COMBO_MIN_PEOPLE", "8"))
+GROUP_COMBO_K = int(os.environ.get("GROUP_COMBO_K", "3"))
+GROUP_COMBO_TIME_MS = float(os.environ.get("GROUP_COMBO_TIME_MS", "200"))
+GROUP_COMBO_BEAM = int(os.environ.get("GROUP_COMBO_BEAM", "48"))
+GROUP_COMBO_CANDIDATES = int(os.environ.get("GROUP_COMBO_CANDIDATES", "40"))
+GROUP_COMBO_MAX_OVERLAP = float(os.environ.get("GROUP_COMBO_MAX_OVERLAP", "0.5"))
+
+DIVERSITY_BONUS = 0.3  # 每多涵蓋一個菜單分類
+REPEAT_PENALTY = 0.8   # 已出現在前面組合中的菜，每出現一次扣分
+
+
+def slot_counts(people: int, need_drink: bool = True) -> Dict[str, int]:
+    """依人數決定各類型道數"""
+    return {
+        "main": max(2, math.ceil(people / 2)),
+        "side": max(1, people // 4),
+        "drink": max(1, math.ceil(people / 4)) if need_drink else 0,
+        "dessert": max(1, people // 6),
+    }
+
+
+def _cheapest(prices: List[float], n: int) -> float:
+    return sum(prices[:n])
+
+
+def fit_to_budget(counts: Dict[str, int], sorted_prices: Dict[str, List[float]],
+                  budget: Optional[float]) -> Dict[str, int]:
+    """道數不超過可選菜數；預算連最便宜的組合都不夠時依 _SHRINK_ORDER 逐道減少"""
+    fitted = {t: min(counts.get(t, 0), len(sorted_prices.get(t, []))) for t in TYPES}
+    if budget is None:
+        return fitted
+    while sum(_cheapest(sorted_prices[t], fitted[t]) for t in TYPES if fitted[t]) > budget:
+        for t in _SHRINK_ORDER:
+            if fitted[t] > (1 if t == "main" else 0):
+                fitted[t] -= 1
+                break
+        else:
+            break  # 只剩一道主食仍超出預算，交給呼叫端處理
+    return fitted
+
+
+class _State:
+    __slots__ = ("score", "cost", "picked", "last", "per_cat", "cats")
+
+    def __init__(self, score: float, cost: float, picked: Tuple[int, ...], last: int,
+                 per_cat: Dict[Tuple[str, str], int], cats: frozenset) -> None:
+        self.score = score
+        self.cost = cost
+        self.picked = picked
+        self.last = last
+        self.per_cat = per_cat
+        self.cats = cats
+
+
+def search(
+    pools: Dict[str, List[Dict[str, Any]]],
+    people: int,
+    price: Callable[[Dict[str, Any]], float],
+    budget: Optional[float] = None,
+    need_drink: bool = True,
+    bonus: Optional[Callable[[Dict[str, Any]], float]] = None,
+    rng: Optional[random.Random] = None,
+    k: Optional[int] = None,
+    time_budget_ms: Optional[float] = None,
+    beam_width: Optional[int] = None,
+    max_overlap: Optional[float] = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """pools：類型 → 菜品（已過濾）；回傳 (組合列表（最佳在前）, 統計)
+
+    每套組合為 {"items": [...], "total": 總價, "score": 分數}，items 與 recommend() 的格式相同。
+    bonus(item) 為額外加分（例如符合偏好菜色）；rng 只用來打散同分的菜，讓不同 seed 得到不同組合。
+    """
+    k = k or GROUP_COMBO_K
+    beam_width = beam_width or GROUP_COMBO_BEAM
+    max_overlap = GROUP_COMBO_MAX_OVERLAP if max_overlap is None else max_overlap
+    started = time.monotonic()
+    deadline = started + (GROUP_COMBO_TIME_MS if time_budget_ms is None else time_budget_ms) / 1000
+    rng = rng or random.Random()
+
+    # 候選菜：無價格的不參與（總價無法試算）；同名只留一道
+    # 大菜單每類型只留 GROUP_COMBO_CANDIDATES 道：一半取分數最高、一半取最便宜（預算緊時仍湊得出組合）
+    wanted = slot_counts(people, need_drink)
+    cands: List[Tuple[str, Dict[str, Any], float, str, float]] = []  # (類型, 菜品, 價格, 菜單分類, 基本分)
+    by_type: Dict[str, List[int]] = {t: [] for t in TYPES}
+    seen = set()
+    for t in TYPES:
+        pool = [it for it in pools.get(t, []) if price(it) < _NO_PRICE]
+        top = max((price(it) for it in pool), default=0.0) or 1.0
+        scored: List[Tuple[Dict[str, Any], float]] = []
+        for it in sorted(pool, key=price):
+            name = str(it.get("name", ""))
+            if not name or name in seen:
+                continue
+            seen.add(name)
+            # 有預算時偏好份量較足（較貴）的菜，讓預算用得充分；沒有預算時只看偏好與隨機
+            base = 1.0 + (bonus(it) if bonus else 0.0) + rng.uniform(0.0, 0.3)
+            if budget is not None:
+                base += 0.5 * price(it) / top
+            scored.append((it, base))
+        half = GROUP_COMBO_CANDIDATES // 2
+        keep = set(range(min(max(wanted[t], half), len(scored))))
+        keep.update(sorted(range(len(scored)), key=lambda j: -scored[j][1])[:half])
+        for j in sorted(keep):  # 維持價格遞增
+            it, base = scored[j]
+            by_type[t].append(len(cands))
+            cands.append((t, it, price(it), str(it.get("category") or "未分類"), base))
+
+    sorted_prices = {t: [cands[i][2] for i in by_type[t]] for t in TYPES}
+    counts = fit_to_budget(wanted, sorted_prices, budget)
+    slots = [t for t in TYPES for _ in range(counts[t])]
+    stats: Dict[str, Any] = {"slots": counts, "runs": 0, "expanded": 0, "timedOut": False}
+    if not counts["main"]:  # 沒有主食撐不起聚餐，交回一般流程
+        stats["elapsedMs"] = round((time.monotonic() - started) * 1000, 1)
+        return [], stats
+
+    # 同一類型中每個菜單分類最多幾道（分散到菜單各處）
+    cat_cap = {
+        t: max(1, math.ceil(counts[t] / max(1, len({cands[i][3] for i in by_type[t]})))) for t in TYPES
+    }
+    # 預算剪枝用的下界：選了本類型第 pos 個候選後，同類型剩下的道數只能從 pos 之後挑（價格遞增，取緊接的幾道），
+    # 後面各類型則取最便宜的幾道
+    # rest_same[level]：第 level 道之後同類型還剩幾道；later_min[level]：之後其他類型的最低成本
+    prefix = {t: [0.0] for t in TYPES}
+    for t in TYPES:
+        for p in sorted_prices[t]:
+            prefix[t].append(prefix[t][-1] + p)
+    rest_same = [0] * len(slots)
+    later_min = [0.0] * len(slots)
+    for level, t in enumerate(slots):
+        rest_same[level] = sum(1 for s in slots[level + 1:] if s == t)
+        later_min[level] = sum(prefix[u][counts[u]] for u in TYPES[TYPES.index(t) + 1:])
+
+    used: Dict[int, int] = {}
+    combos: List[Dict[str, Any]] = []
+    picked_sets: List[frozenset] = []
+    for _ in range(k * 2):  # 被重疊規則擋掉的也算一次搜尋，最多 2k 次
+        if len(combos) >= k or (combos and time.monotonic() > deadline):
+            break
+        stats["runs"] += 1
+        best = _beam(cands, by_type, slots, cat_cap, prefix, rest_same, later_min, budget, used, beam_width, deadline, stats)
+        if best is None:
+            break
+        picked = frozenset(best.picked)
+        for i in picked:
+            used[i] = used.get(i, 0) + 1
+        if picked in picked_sets or any(len(picked & p) > max_overlap * min(len(picked), len(p)) for p in picked_sets):
+            continue
+        picked_sets.append(picked)
+        combos.append({
+            "items": [
+                {
+                    "name": cands[i][1].get("name"),
+                    "price": cands[i][2],
+                    "category": cands[i][1].get("category", "未分類"),
+                    "reason": REASONS[cands[i][0]],
+                }
+                for i in best.picked
+            ],
+            "total": round(best.cost, 1),
+            "score": round(best.score, 3),
+        })
+    stats["elapsedMs"] = round((time.monotonic() - started) * 1000, 1)
+    return combos, stats
+
+
+def _beam(cands: List[Tuple[str, Dict[str, Any], float, str, float]], by_type: Dict[str, List[int]],
+          slots: List[str], cat_cap: Dict[str, int], prefix: Dict[str, List[float]], rest_same: List[int],
+          later_min: List[float], budget: Optional[float],
+          used: Dict[int, int], beam_width: int, deadline: float, stats: Dict[str, Any]) -> Optional[_State]:
+    """逐道填入；同類型依候選順序遞增挑選（組合而非排列，不會產生重複狀態）"""
+    beam = [_State(0.0, 0.0, (), -1, {}, frozenset())]
+    for level, t in enumerate(slots):
+        width = beam_width
+        if time.monotonic() > deadline:
+            stats["timedOut"] = True
+            width = 1
+        new_type = level == 0 or slots[level - 1] != t
+        nxt: List[_State] = []
+        # 預算下界不考慮分類上限，兩者衝突時這一道放寬上限（預算優先於分散）
+        for capped in (True, False):
+            for st in beam:
+                start = 0 if new_type else st.last + 1
+                pool = by_type[t]
+                for pos in range(start, len(pool) - rest_same[level]):
+                    i = pool[pos]
+                    _, _, p, cat, base = cands[i]
+                    rest = prefix[t][pos + 1 + rest_same[level]] - prefix[t][pos + 1] + later_min[level]
+                    if budget is not None and st.cost + p + rest > budget:
+                        break  # 候選依價格遞增，後面只會更貴
+                    if capped and st.per_cat.get((t, cat), 0) >= cat_cap[t]:
+                        continue
+                    stats["expanded"] += 1
+                    gain = base - REPEAT_PENALTY * used.get(i, 0)
+                    if cat not in st.cats:
+                        gain += DIVERSITY_BONUS
+                    per_cat = dict(st.per_cat)
+                    per_cat[(t, cat)] = per_cat.get((t, cat), 0) + 1
+                    nxt.append(_State(st.score + gain, st.cost + p, st.picked + (i,), pos, per_cat, st.cats | {cat}))
+            if nxt:
+                break
+        if not nxt:
+            return None
+        nxt.sort(key=lambda s: (-s.score, s.cost))
+        beam = nxt[:width]
+    return beam[0]
@@ -0,0 +1,96 @@
+"""多關鍵字比對（Aho-Corasick 自動機）
+
+把多張關鍵字表（分類、排除、偏好…）編譯成一個自動機，
+對每個菜名只掃描一次，就能得到所有命中的標籤，
+取代 `any(kw in name for kw in [...])` 逐表逐字比對。
+"""
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterable, List, Mapping, Set, Tuple
+
+
+class KeywordMatcher:
+    def __init__(self, tables: Mapping[str, Iterable[str]]) -> None:
+        """tables: {標籤: [關鍵字, ...]}；同一關鍵字可屬於多個標籤，空字串會被忽略"""
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+
+        pending: List[Set[Tuple[str, str]]] = [set()]
+        for label, keywords in tables.items():
+            for kw in keywords:
+                if not kw:
+                    continue
+                node = 0
+                for ch in kw:
+                    nxt = self._goto[node].get(ch)
+                    if nxt is None:
+                        nxt = len(self._goto)
+                        self._goto[node][ch] = nxt
+                        self._goto.append({})
+                        self._fail.append(0)
+                        pending.append(set())
+                    node = nxt
+                pending[node].add((kw, label))
+
+        # BFS 建立 fail 連結，並把 fail 鏈上的輸出合併進每個節點
+        queue = deque(self._goto[0].values())
+        order: List[int] = []
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for ch, nxt in self._goto[node].items():
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                queue.append(nxt)
+
+        merged = pending
+        for node in order:
+            merged[node] = merged[node] | merged[self._fail[node]]
+        self._words = [tuple(sorted(m)) for m in merged]
+        self._out = [frozenset(label for _, label in m) for m in merged]
+        # 出現在任何關鍵字中的字元；其他字元必定回到根節點，可直接跳過
+        self._alphabet = frozenset(self._goto[0]).union(*(g.keys() for g in self._goto))
+
+    def _walk(self, text: str) -> Iterable[int]:
+        goto, fail, alphabet = self._goto, self._fail, self._alphabet
+        node = 0
+        for ch in text:
+            if ch not in alphabet:
+                node = 0
+            else:
+                while node and ch not in goto[node]:
+                    node = fail[node]
+                node = goto[node].get(ch, 0)
+            yield node
+
+    def labels(self, text: str) -> Set[str]:
+        """回傳 text 中命中的所有標籤（熱路徑，迴圈手動內聯）"""
+        goto, fail, out, alphabet = self._goto, self._fail, self._out, self._alphabet
+        found: Set[str] = set()
+        node = 0
+        for ch in text:
+            if ch not in alphabet:
+                node = 0
+                continue
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found |= out[node]
+        return found
+
+    def matches(self, text: str) -> List[Tuple[int, str, str]]:
+        """回傳所有命中 (結束位置, 關鍵字, 標籤)，主要用於除錯"""
+        hits: List[Tuple[int, str, str]] = []
+        for end, node in enumerate(self._walk(text)):
+            for kw, label in self._words[node]:
+                hits.append((end, kw, label))
+        return hits
+
+
+@lru_cache(maxsize=128)
+def compile_tables(tables: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> KeywordMatcher:
+    """以不可變的表格內容快取已編譯的自動機（例如每位使用者不同的排除清單）"""
+    return KeywordMatcher(dict(tables))
@@ -1,8 +1,15 @@
 #import
 from __future__ import annotations
-import os, json, re, shutil, subprocess, random, time
-from typing import Dict, List, Optional, TypedDict, Literal, Tuple
+import os, json, re, shutil, subprocess, random, time, hashlib
+import concurrent.futures
+from typing import Callable, Dict, List, Optional, TypedDict, Literal, Tuple
 
+from keyword_matcher import KeywordMatcher
+import cache_utils
+import context_window
+import cross_recommend
+import dish_blurbs
+import pref_lexer
 
 DEFAULT_MODEL = os.environ.get("OLLAMA_MODEL", "gemma3:12b")
 OLLAMA_BIN = os.getenv("OLLAMA_BIN", "ollama")
@@ -31,7 +38,10 @@ def ensure_daemon() -> None:
             kwargs["startupinfo"] = startupinfo
             kwargs["creationflags"] = creationflags
         subprocess.Popen([OLLAMA_BIN, "serve"], **kwargs)  # 已在跑會快速返回
-        time.sleep(0.3)  
+        if ollama_wait_until_ready is not None:
+            ollama_wait_until_ready()  # 輪詢直到 daemon 回應
+        else:
+            time.sleep(0.3)
     except Exception:
         pass
     _DAEMON_SPAWNED = True
@@ -71,11 +81,13 @@ try:
         recommend as ollama_recommend,
         chat as ollama_chat,
         ensure_daemon as ollama_ensure_daemon,
+        wait_until_ready as ollama_wait_until_ready,
     )
 except Exception:
     ollama_recommend = None  # type: ignore
     ollama_chat = None       # type: ignore
     ollama_ensure_daemon = None  # type: ignore
+    ollama_wait_until_ready = None  # type: ignore
 
 
 # 型別定義 
@@ -109,6 +121,9 @@ class Preferences(TypedDict, total=False):
     needDrink: bool
     people: int
     weights: Dict[str, float]
+    vegetarian: bool        # 只推薦有「素」標籤的品項
+    noMarketPrice: bool     # 排除時價品項
+    maxItemPrice: float     # 單品價格上限
 
 
 class ConversationTurn(TypedDict, total=False):
@@ -136,12 +151,13 @@ _BEVERAGE_KEYWORDS = [
     "飲料",
 ]
 _BEVERAGE_EXACT = {"季節限定"}  #此分類皆為飲品
+_BEVERAGE_MATCHER = KeywordMatcher({"beverage": _BEVERAGE_KEYWORDS})
 
 
 def _is_beverage_category(name: str) -> bool:
     if name in _BEVERAGE_EXACT:
         return True
-    return any(k in name for k in _BEVERAGE_KEYWORDS)
+    return bool(_BEVERAGE_MATCHER.labels(name))
 
 
 def normalize_menu(menu: Menu) -> Dict[str, int]:
@@ -177,11 +193,9 @@ def normalize_menu(menu: Menu) -> Dict[str, int]:
 
 
 # 偏好抽取
-_SPICE_WORDS = ["不辣", "微辣", "小辣", "中辣", "大辣", "很辣"]
-
 
-def extract_prefs_with_llm(text: str) -> Preferences:
-    """ 使用 LLM 智能提取使用者偏好（語意理解）"""
+def extract_prefs_with_llm(text: str) -> Optional[Preferences]:
+    """ 使用 LLM 智能提取使用者偏好（語意理解）；呼叫或解析失敗回傳 None（與「什麼都沒提到」的 {} 區分）"""
     try:
         from ollama_fuc import chat
         
@@ -208,7 +222,7 @@ def extract_prefs_with_llm(text: str) -> Preferences:
 請回傳 JSON（如果某項沒提到就不要包含該欄位）:
 """
         
-        response = chat([{"role": "user", "content": prompt}], model=model, timeout=60.0)
+        response = chat([{"role": "user", "content": prompt}], model=model, timeout=60.0, task="pref")
         print(f" [LLM偏好] 原始回應: {response[:200]}")
         
         # 提取 JSON
@@ -219,165 +233,134 @@ def extract_prefs_with_llm(text: str) -> Preferences:
         try:
             prefs = json.loads(response)
             print(f" [LLM偏好] 成功: {prefs}")
-            return prefs
         except:
             # 嘗試提取 JSON 區塊
             json_match = re.search(r'\{[^{}]*\}', response, re.DOTALL)
             if json_match:
                 prefs = json.loads(json_match.group(0))
                 print(f" [LLM偏好] 提取成功: {prefs}")
-                return prefs
             else:
                 print(f" [LLM偏好] 解析失敗，降級")
-                return {}
+                return None
+        if not isinstance(prefs, dict):
+            print(f" [LLM偏好] 回應不是 JSON 物件，降級")
+            return None
+        return prefs
     except Exception as e:
         print(f" [LLM偏好] 錯誤: {e}")
-        return {}
+        return None
+
+
+# 偏好抽取快取：相同句子（正規化後）直接回傳，不再跑正則 / LLM
+# 抽取規則有改動時要遞增版本，舊快取（含存檔）自然失效
+_PREF_EXTRACTOR_VERSION = "2"
+_PREF_CACHE = cache_utils.register(
+    cache_utils.LRUCache(int(os.environ.get("PREF_CACHE_SIZE", "2048")), name="prefExtraction")
+)
+_PREF_CACHE_PATH = os.environ.get("PREF_CACHE_PATH")  # 設定後啟動時載入、結束時存檔
+if _PREF_CACHE_PATH:
+    import atexit
+    _PREF_CACHE.load(_PREF_CACHE_PATH)
+    atexit.register(_PREF_CACHE.save, _PREF_CACHE_PATH)
+
+# 全形英數 / 全形空白 → 半形
+_FULLWIDTH_TABLE = {cp: cp - 0xFEE0 for cp in range(0xFF01, 0xFF5F) if chr(cp - 0xFEE0).isalnum()}
+_FULLWIDTH_TABLE[0x3000] = ord(" ")
+
+
+def normalize_user_text(text: str) -> str:
+    """快取鍵用的正規化：全形英數轉半形、連續空格合併、去頭尾空白
+
+    不改大小寫、標點與換行（換行在忌口解析中是斷句符號）。
+    """
+    return re.sub(r"[ \t]+", " ", text.translate(_FULLWIDTH_TABLE)).strip()
 
 
 def extract_prefs_from_text(text: str) -> Preferences:
-    """主要入口：結合 LLM 智能提取 + 關鍵字提取"""
-    
-    # 檢查是否啟用 LLM（預設 false）
+    """主要入口：結合 LLM 智能提取 + 關鍵字提取（結果依正規化文字快取）"""
     use_llm = os.environ.get("USE_LLM_EXTRACTION", "false").lower() == "true"
-    
-    if use_llm:
-        # 優先嘗試 LLM 提取
-        llm_prefs = extract_prefs_with_llm(text)
-    else:
-        llm_prefs = {}
-    
-    # 關鍵字提取（作為補充）
-    prefs: Preferences = {}
-    t = text.strip()
-
-    # 辣度
-    for w in _SPICE_WORDS:
-        if w in t:
-            prefs["spiceLevel"] = "小辣" if w == "微辣" else w
-            break
+    normalized = normalize_user_text(text)
+    key = "|".join([
+        _PREF_EXTRACTOR_VERSION,
+        os.environ.get("PREF_MODEL", "gemma3:latest") if use_llm else "keyword",
+        normalized,
+    ])
+    prefs = _PREF_CACHE.get(key)
+    if prefs is not None:
+        print(f" [偏好快取] 命中：'{normalized}'")
     else:
-        # 沒有出現明確等級，但提到想吃辣/重口味，也給一個預設辣度
-        if any(k in t for k in ["要辣", "吃辣", "辣一點", "重口味"]):
-            prefs["spiceLevel"] = "辣"
-
-    # 忌口
-    excludes: List[str] = []
-    for cue in ("不要", "不吃", "忌口"):
-        idx = t.find(cue)
-        if idx != -1:
-            seg = t[idx + len(cue):]
-            for stop in ["。", " ", "，", ",", ";", "！", "?", "\n"]:
-                cut = seg.find(stop)
-                if cut != -1:
-                    seg = seg[:cut]
-                    break
-            for p in re.split(r"[、,\s]+", seg):
-                p = p.strip()
-                if p:
-                    excludes.append(p)
-    if excludes:
-        prefs["excludes"] = list(dict.fromkeys(excludes))
-
-    # 預算
-    m = re.search(r"(預算|不超過|小於|低於|<=)\s*(\d{2,6})", t)
-    if not m:
-        m = re.search(r"(\d{2,6})\s*(元|塊|NT|NTD)", t, flags=re.IGNORECASE)
-    if m:
-        try:
-            prefs["budget"] = float(m.group(2) if m.lastindex and m.lastindex >= 2 else m.group(1))
-        except Exception:
-            pass
+        prefs, pending, llm_failed = _extract_prefs_uncached(normalized, use_llm)
+        if pending is not None:
+            # LLM 逾時：這次先用關鍵字結果，不寫快取；LLM 回來後再把合併結果寫進快取（LLM 失敗就不寫）
+            keyword_prefs = json.loads(json.dumps(prefs, ensure_ascii=False))
+            pending.add_done_callback(lambda f: _cache_llm_result(key, keyword_prefs, f.result()))
+        elif not llm_failed:
+            # LLM 失敗時只有關鍵字結果，不能記在 LLM 模式的鍵下（否則存檔後永遠不會再問 LLM）
+            _PREF_CACHE.put(key, prefs)
+    # 呼叫端會就地修改（例如補 notes），回傳副本
+    return json.loads(json.dumps(prefs, ensure_ascii=False))
 
-    # 菜系
-    for c in ("中式", "日式", "泰式", "美式", "韓式", "義式"):
-        if c in t:
-            prefs["cuisine"] = c
-            break
-    
-    # 特定菜品類型偏好
-    print(f" [DEBUG extract_prefs] 使用者輸入: '{t}'")
-    if any(kw in t for kw in ["漢堡", "burger", "堡", "芝加哥堡"]):
-        prefs["preferredDish"] = "漢堡"
-        print(f" [DEBUG extract_prefs] 識別到漢堡偏好")
-    elif any(kw in t for kw in ["吐司", "toast"]):
-        prefs["preferredDish"] = "吐司"
-        print(f" [DEBUG extract_prefs] 識別到吐司偏好")
-    elif any(kw in t for kw in ["貝果", "bagel"]):
-        prefs["preferredDish"] = "貝果"
-        print(f" [DEBUG extract_prefs] 識別到貝果偏好")
-    elif any(kw in t for kw in ["套餐", "combo"]):
-        prefs["preferredDish"] = "套餐"
-        print(f" [DEBUG extract_prefs] 識別到套餐偏好")
-    
-    # 改進：檢測否定詞（不要、不含、無）+ 飲料
-    need_drink_neg = re.search(r"(不要|不含|無|不需要|別加)\s*飲料", t)
-    need_drink_pos = ("飲料" in t) or ("喝" in t) or ("飲品" in t)
-    
-    # 優先檢查 excludes 中是否有「飲料」
-    if excludes and "飲料" in excludes:
-        prefs["needDrink"] = False
-        print(f" [DEBUG extract_prefs] excludes 中有「飲料」，設定 needDrink=False")
-    elif need_drink_neg:
-        prefs["needDrink"] = False
-        print(f" [DEBUG extract_prefs] 識別到「不要飲料」，設定 needDrink=False")
-    elif need_drink_pos and not need_drink_neg:
-        # 只有在明確要飲料時才設定 True
-        prefs["needDrink"] = True
-        print(f" [DEBUG extract_prefs] 識別到「要飲料」，設定 needDrink=True")
-
-    # 人數
-    m2 = re.search(r"(\d{1,2})\s*人", t)
-    if m2:
-        try:
-            prefs["people"] = int(m2.group(1))
-        except Exception:
-            pass
 
-    # 動態權重線索
-    cue_main = any(k in t for k in ["主菜", "吃飽", "份量", "大份", "有菜有肉"])
-    cue_variety = any(k in t for k in ["多樣", "不要都一樣", "各點一些", "分著吃", "分享", "拼盤", "試試看"])
-    cue_light = any(k in t for k in ["清爽", "清淡", "健康", "少油"])
-
-    has_budget = prefs.get("budget") is not None
-    need_drink = prefs.get("needDrink", False)  # 從 prefs 取得，而非重複判斷
-    
-    constraint_count = sum([
-        1 if has_budget else 0,
-        1 if need_drink else 0,
-        1 if "spiceLevel" in prefs else 0,
-        1 if excludes else 0,
-        1 if "cuisine" in prefs else 0,
-        1 if cue_main else 0,
-        1 if cue_variety else 0,
-        1 if cue_light else 0,
-    ])
-    only_budget = has_budget and constraint_count == 1
-
-    # 改進權重計算：考慮「不要飲料」的負面權重
-    weights = {
-        "price": 1.0 if only_budget else (0.8 if has_budget else 0.3),
-        "main": 0.8 if cue_main else 0.5,
-        "variety": 0.8 if cue_variety else 0.4,
-        "drink": (0.6 if need_drink else -0.8),  # 不要飲料給更大的負權重
-        "spice": 0.7 if prefs.get("spiceLevel") == "不辣" or cue_light else 0.2,
-        "category": 0.5,  # 類別基本權重
-        "cuisine": 0.6 if "cuisine" in prefs else 0.0,
-    }
-    prefs["weights"] = weights
-    
-    # 🔄 合併 LLM 提取的結果（LLM 結果優先）
+# 混合抽取：關鍵字規則先跑（微秒級），只有讀不懂的部分夠多時才問 LLM，且最多等一小段時間
+_PREF_LLM_MIN_CONFIDENCE = float(os.environ.get("PREF_LLM_MIN_CONFIDENCE", "0.75"))
+_PREF_LLM_MIN_RESIDUAL = int(os.environ.get("PREF_LLM_MIN_RESIDUAL", "2"))
+_PREF_LLM_DEADLINE = float(os.environ.get("PREF_LLM_DEADLINE", "4.0"))
+_PREF_LLM_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="pref-llm")
+
+
+def _needs_llm(confidence: float, residual: str) -> bool:
+    residual_chars = sum(ch.isalnum() for ch in residual)
+    return residual_chars >= _PREF_LLM_MIN_RESIDUAL or (residual_chars > 0 and confidence < _PREF_LLM_MIN_CONFIDENCE)
+
+
+def _merge_llm_prefs(prefs: Preferences, llm_prefs: Preferences) -> Preferences:
+    """合併 LLM 提取的結果：關鍵字沒抓到的欄位補上，菜品偏好以 LLM 為準"""
     for key, value in llm_prefs.items():
         if key not in prefs or prefs[key] is None:
             prefs[key] = value
         # 如果 LLM 有值且更具體，覆蓋關鍵字結果
         elif key == "preferredDish" and value:
             prefs[key] = value
-    
-    print(f" [最終偏好] LLM:{llm_prefs} + 關鍵字 = {prefs}")
     return prefs
 
 
+def _cache_llm_result(key: str, keyword_prefs: Preferences, llm_prefs: Optional[Preferences]) -> None:
+    """逾時的 LLM 工作完成後呼叫：成功才把合併結果寫進快取"""
+    if llm_prefs is not None:
+        _PREF_CACHE.put(key, _merge_llm_prefs(keyword_prefs, llm_prefs))
+
+
+def _extract_prefs_uncached(
+    text: str, use_llm: bool
+) -> Tuple[Preferences, Optional[concurrent.futures.Future], bool]:
+    """回傳 (偏好, 尚未完成的 LLM 工作, LLM 是否失敗)
+
+    LLM 在期限內回來或根本沒呼叫時第二項為 None；第三項為 True 表示問了 LLM 但沒拿到結果，偏好只有關鍵字部分。
+    """
+    # 關鍵字提取：單次掃描，規則見 pref_lexer
+    prefs, confidence, residual = pref_lexer.keyword_prefs_with_coverage(text)
+
+    llm_prefs: Optional[Preferences] = {}
+    if use_llm:
+        if not _needs_llm(confidence, residual):
+            print(f" [偏好] 關鍵字信心 {confidence:.2f}，略過 LLM")
+        else:
+            print(f" [偏好] 關鍵字信心 {confidence:.2f}，殘餘「{residual}」，詢問 LLM")
+            future = _PREF_LLM_POOL.submit(extract_prefs_with_llm, text)
+            try:
+                llm_prefs = future.result(timeout=_PREF_LLM_DEADLINE)
+            except concurrent.futures.TimeoutError:
+                print(f" [偏好] LLM 超過 {_PREF_LLM_DEADLINE}s，先用關鍵字結果")
+                return prefs, future, False
+
+    if llm_prefs is None:
+        print(f" [最終偏好] LLM 失敗，只用關鍵字 = {prefs}")
+        return prefs, None, True
+    _merge_llm_prefs(prefs, llm_prefs)
+    print(f" [最終偏好] LLM:{llm_prefs} + 關鍵字 = {prefs}")
+    return prefs, None, False
+
+
 def merge_prefs_inplace(base: Preferences, delta: Preferences) -> None:
     if "budget" in delta and delta["budget"] is not None:
         base["budget"] = delta["budget"]
@@ -395,14 +378,18 @@ def merge_prefs_inplace(base: Preferences, delta: Preferences) -> None:
         base["weights"] = delta["weights"]  # 每輪依新輸入動態重算
     if "notes" in delta:
         base["notes"] = delta["notes"]
+    for key in ("vegetarian", "noMarketPrice", "maxItemPrice"):
+        if key in delta:
+            base[key] = delta[key]
     # 合併菜品偏好
     if "preferredDish" in delta:
         base["preferredDish"] = delta["preferredDish"]
         print(f" [DEBUG merge_prefs] 更新菜品偏好: {delta['preferredDish']}")
 
-def _fallback_format(rec: Dict[str, object]) -> str:
+def _fallback_format(rec: Dict[str, object], blurbs: Optional[Dict[str, str]] = None) -> str:
     """備用模板（LLM 失敗時使用）—— 原 format_recommend_text 邏輯完整保留。"""
     """將推薦結果整理成 Gemini 風格：有段落、理由、預算計算。"""
+    # blurbs：菜名 → 預先生成的介紹（dish_blurbs），有的話取代制式理由
 
     items = rec.get("items") if isinstance(rec, dict) else None
     if not isinstance(items, list) or not items:
@@ -490,7 +477,7 @@ def _fallback_format(rec: Dict[str, object]) -> str:
             "name": item.get("name") or "菜品",
             "category": item.get("category") or "菜色",
             "price_label": label,
-            "reason": enrich_reason(item),
+            "reason": (blurbs or {}).get(str(item.get("name"))) or enrich_reason(item),
         }
         section_key = classify_section(item)
         sections.setdefault(section_key, {"title": "其他", "items": []})["items"].append(entry)
@@ -536,6 +523,15 @@ def _fallback_format(rec: Dict[str, object]) -> str:
         else:
             lines.append(f"目前約超出預算 $ {abs(diff):.0f}，可視需求刪減或換成更平價的菜。")
 
+    # 多人聚餐一次算出的其他組合（見 group_combos）
+    alternatives = rec.get("alternatives") if isinstance(rec, dict) else None
+    if isinstance(alternatives, list) and alternatives:
+        lines.append("")
+        lines.append(" 其他備選組合")
+        for i, alt in enumerate(alternatives, 2):
+            names = "、".join(str(it.get("name")) for it in alt.get("items", []) if isinstance(it, dict))
+            lines.append(f"- 第 {i} 套（約 $ {float(alt.get('total') or 0):.0f}）：{names}")
+
     # 移除小提醒訊息
     # lines.append("")
     # lines.append(" 小提醒：如果想調整份量或菜色方向，直接跟我說，例如加海鮮、換辣味、或再多一壺飲料。")
@@ -575,6 +571,16 @@ def _build_recommendation_prompt(rec: Dict[str, object], user_input: str) -> str
 
     items_json = json.dumps(items, ensure_ascii=False, indent=2)
 
+    alternatives = rec.get("alternatives") if isinstance(rec, dict) else None
+    alt_text = ""
+    if isinstance(alternatives, list) and alternatives:
+        alt_lines = [
+            f"- 第 {i} 套（約 NT${float(alt.get('total') or 0):.0f}）："
+            + "、".join(str(it.get("name")) for it in alt.get("items", []) if isinstance(it, dict))
+            for i, alt in enumerate(alternatives, 2)
+        ]
+        alt_text = "\n【其他備選組合（最後用一兩句帶過即可）】\n" + "\n".join(alt_lines) + "\n"
+
     return f"""你是一位親切的台灣中文點餐助理。請根據以下推薦清單，用自然、有溫度的繁體中文回覆使用者。
 
 【使用者需求】
@@ -582,7 +588,7 @@ def _build_recommendation_prompt(rec: Dict[str, object], user_input: str) -> str
 
 【推薦清單（結構化資料）】
 {items_json}
-
+{alt_text}
 【預算資訊】
 - 人數：{people or "未指定"}
 - 預算：{f"NT${int(budget)}" if budget else "未指定"}
@@ -601,11 +607,24 @@ def _build_recommendation_prompt(rec: Dict[str, object], user_input: str) -> str
 """
 
 
+# 回覆快取：同一模型 + 同一 prompt（使用者句子 + 推薦 JSON + 預算）直接沿用上次的 LLM 回覆
+# 只快取 LLM 成功的回覆；並行的相同 prompt 由 single-flight 合併成一次模型呼叫
+_REPLY_CACHE = cache_utils.register(cache_utils.LRUCache(
+    int(os.environ.get("REPLY_CACHE_SIZE", "256")),
+    name="llmReply",
+    ttl=float(os.environ.get("REPLY_CACHE_TTL", "600")),
+))
+_REPLY_FLIGHTS = cache_utils.register(cache_utils.SingleFlight(name="llmReplyInFlight"))
+
+
 def generate_ai_reply(
     rec: Dict[str, object],
     user_input: str,
     model: Optional[str] = None,
     timeout: float = 180.0,
+    session: Optional[str] = None,
+    history: Optional[List[ConversationTurn]] = None,
+    prefs: Optional[Preferences] = None,
 ) -> str:
     """呼叫 Gemma3 把推薦 JSON 轉成自然語言回覆。
 
@@ -613,19 +632,49 @@ def generate_ai_reply(
     是同步呼叫 ollama CLI subprocess。
     LLM 失敗（超時、模型不存在等）時自動降級到 _fallback_format，
     確保服務不中斷。
+    session：多台 ollama 後端時盡量送到同一台（重用該 session 的 KV cache）。
+    history / prefs：session 的對話歷史與累積偏好；有給時先前的輪次以 context_window.build_context
+    放在 prompt 前面（最近幾則原文 + 偏好摘要，大小有上限）。
     """
     from ollama_fuc import chat as _ollama_chat
 
     mdl    = model or os.environ.get("OLLAMA_MODEL", "gemma3:12b")
     prompt = _build_recommendation_prompt(rec, user_input)
-
-    try:
+    messages = [{"role": "user", "content": prompt}]
+    if history:
+        past = list(history)
+        if past[-1].get("role") == "user" and past[-1].get("content") == user_input:
+            past.pop()  # 這一輪的使用者訊息已包含在 prompt 中
+        # 與 recommend_turn 保留的則數一致，預先生成（prefetch）時的上下文才會與下一輪相同
+        past = past[-(context_window.HISTORY_MAX_MESSAGES - 2):]
+        budget = context_window.CONTEXT_MAX_TOKENS - context_window.message_tokens(messages[0])
+        messages = [*context_window.build_context(past, prefs or {}, max(0, budget)), *messages]
+    key = hashlib.sha256(
+        f"{mdl}\n{json.dumps(messages, ensure_ascii=False)}".encode("utf-8")
+    ).hexdigest()
+
+    cached = _REPLY_CACHE.get(key)
+    if cached is not None:
+        print(" [generate_ai_reply] 回覆快取命中")
+        return cached
+
+    def call_llm() -> str:
         response = _ollama_chat(
-            [{"role": "user", "content": prompt}],
+            messages,
             model=mdl,
             timeout=timeout,
+            task="reply",
+            session=session,
         )
         cleaned = response.strip() if isinstance(response, str) else ""
+        if cleaned:
+            _REPLY_CACHE.put(key, cleaned)
+        return cleaned
+
+    try:
+        cleaned, shared = _REPLY_FLIGHTS.do(key, call_llm)
+        if shared:
+            print(" [generate_ai_reply] 共用進行中的相同請求")
         if cleaned:
             return cleaned
         print(" [generate_ai_reply] LLM 返回空回覆，降級使用模板")
@@ -651,13 +700,23 @@ conversation_history: List[ConversationTurn] = []  # 對話歷史
 
 conversation_history: List[ConversationTurn] = []  # 對話歷史
 
-def generate_conversation(
+def recommend_turn(
     history: List[ConversationTurn],
     user_input: str,
     menu: Menu,
     prefs: Preferences,
     model: Optional[str] = None,
-) -> Tuple[str, List[ConversationTurn]]:
+    seed: Optional[int] = None,
+    prefetched: Optional[Callable[[Preferences], Optional[Dict[str, object]]]] = None,
+) -> Tuple[Optional[Dict[str, object]], str]:
+    """一輪對話的前半段：記錄使用者訊息、合併偏好、產生推薦。
+
+    回傳 (推薦結果, 模板回覆)；推薦失敗時推薦結果為 None，回覆為錯誤訊息。
+    模板回覆會套用已生成的菜品介紹（CHAT_REPLY_MODE=blurb 時直接當作最終回覆）。
+    prefetched(合併後的偏好) 有回傳結果時直接使用（上一輪結束後預先算好的，見 prefetch）。
+    history 只保留最近幾則（HISTORY_MAX_MESSAGES），較早的條件已累積在 prefs 裡。
+    """
+    context_window.trim_history(history, context_window.HISTORY_MAX_MESSAGES - 2)
     history.append({"role": "user", "content": user_input, "meta": {}})
 
     # 抽取→就地合併（保留上一輪條件）
@@ -669,11 +728,80 @@ def generate_conversation(
     try:
         if ollama_recommend is None:
             raise RuntimeError("推薦功能未載入")
-           # reply="123" #///////////////////////////////////
-        rec = ollama_recommend(menu, prefs, top_k=5, model=model)
-        reply = generate_ai_reply(rec, user_input)
+        rec = prefetched(prefs) if prefetched is not None else None
+        if rec is None:
+            rec = ollama_recommend(menu, prefs, top_k=5, model=model, seed=seed)
+        # 模板套上預先生成的菜品介紹（有的話），不必等 LLM 也有像樣的描述
+        names = [str(it.get("name")) for it in rec.get("items", []) if isinstance(it, dict)]
+        return rec, _fallback_format(rec, blurbs=dish_blurbs.lookup(names))
+    except Exception as e:
+        return None, f"推薦發生錯誤：{e}"
+
+
+def _format_cross(result: Dict[str, object], prefs: Preferences) -> str:
+    """跨餐廳推薦的模板回覆：每家一行（總價 + 菜名）"""
+    results = result.get("results") or []
+    meta = result.get("meta") or {}
+    total = meta.get("restaurants", 0) if isinstance(meta, dict) else 0
+    if not isinstance(results, list) or not results:
+        return f"在已載入的 {total} 家餐廳中找不到符合條件的組合，可以放寬預算或忌口再試試。"
+
+    budget = prefs.get("budget")
+    condition = f"預算 ≤ ${int(budget)}" if isinstance(budget, (int, float)) else "依你的條件"
+    lines = [f"我比較了 {total} 家餐廳（{condition}），最推薦這幾家："]
+    for i, entry in enumerate(results, 1):
+        names = "、".join(str(it.get("name")) for it in entry.get("items", []) if isinstance(it, dict))
+        lines.append(f"{i}. 【{entry.get('restaurant')}】約 $ {float(entry.get('total') or 0):.0f}：{names}")
+    if isinstance(meta, dict) and meta.get("timedOut"):
+        lines.append(f"（時間內比較了 {meta.get('searched')} / {total} 家，其餘餐廳稍後再問會更完整）")
+    lines.append("\n想看哪一家的詳細組合？切換到那家餐廳後再跟我說一次就可以。")
+    return "\n".join(lines)
+
+
+def recommend_all_turn(
+    history: List[ConversationTurn],
+    user_input: str,
+    menus: Dict[str, Menu],
+    prefs: Preferences,
+    searcher: cross_recommend.CrossRecommender,
+    seed: Optional[int] = None,
+    k: int = 3,
+) -> Tuple[Optional[Dict[str, object]], str]:
+    """跨餐廳版的 recommend_turn：合併偏好後在所有已載入的菜單中找出最適合的 k 家
+
+    回傳 (跨餐廳結果, 模板回覆)；失敗時結果為 None，回覆為錯誤訊息。
+    """
+    context_window.trim_history(history, context_window.HISTORY_MAX_MESSAGES - 2)
+    history.append({"role": "user", "content": user_input, "meta": {}})
+
+    dynamic = extract_prefs_from_text(user_input)
+    dynamic.setdefault("notes", user_input)
+    merge_prefs_inplace(prefs, dynamic)
+
+    try:
+        # 各餐廳在不同執行緒讀取偏好，傳副本避免與下一輪的合併互相干擾
+        result = searcher.recommend_all(menus, json.loads(json.dumps(prefs, ensure_ascii=False)), k=k, seed=seed)
+        return result, _format_cross(result, prefs)
     except Exception as e:
-        reply = f"推薦發生錯誤：{e}"
+        return None, f"推薦發生錯誤：{e}"
+
+
+def generate_conversation(
+    history: List[ConversationTurn],
+    user_input: str,
+    menu: Menu,
+    prefs: Preferences,
+    model: Optional[str] = None,
+    seed: Optional[int] = None,
+    session: Optional[str] = None,
+    prefetched: Optional[Callable[[Preferences], Optional[Dict[str, object]]]] = None,
+) -> Tuple[str, List[ConversationTurn]]:
+    rec, reply = recommend_turn(history, user_input, menu, prefs, model=model, seed=seed, prefetched=prefetched)
+    if rec is not None:
+        try:
+            reply = generate_ai_reply(rec, user_input, session=session, history=history, prefs=prefs)
+        except Exception as e:
+            reply = f"推薦發生錯誤：{e}"
 
     history.append({"role": "assistant", "content": reply, "meta": {}})
     return reply, history
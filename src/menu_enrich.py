@@ -0,0 +1,169 @@
+"""菜單 enrichment：匯入 / 爬取後一次算好每道菜的類型與屬性，寫回菜單
+
+每個品項加上：
+- type：main / side / drink / dessert / other（先用關鍵字，關鍵字判斷不出來的才問 LLM）
+- typeSource：keyword 或 llm
+- priceValue：數值價格（與 recommend() 的解析規則相同，無法解析為 None）
+- spicy / vegetarian：由菜名與標籤判斷的提示
+recommend() 遇到有 type 的品項直接查表，不再於請求時分類。
+
+命令列：
+    python src/menu_enrich.py                     enrichment 根目錄的 menu.json 與 menu_*.json
+    python src/menu_enrich.py menu_xxx.json --llm 指定檔案，關鍵字判斷不出的菜交給 LLM
+    python src/menu_enrich.py --sqlite            enrichment SQLite 菜單儲存中的所有餐廳
+"""
+import argparse
+import copy
+import glob
+import json
+import os
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SRC_DIR, os.pardir))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+import ollama_fuc  # noqa: E402
+from menu_facets import MARKET_PRICE_TAG, VEGETARIAN_TAG, numeric_price  # noqa: E402
+
+_SPICY_WORDS = ("辣", "spicy")
+_NOT_SPICY_WORDS = ("不辣",)
+_VEGETARIAN_WORDS = ("素食", "蔬食", "全素", "蛋奶素", "vegan", "vegetarian")
+
+
+def _item_lists(menu: Dict[str, Any]) -> Iterable[List[Dict[str, Any]]]:
+    """逐一取出菜單中的品項列表；支援系統格式、舊版 categories 格式與爬蟲輸出（menu_items）"""
+    if isinstance(menu.get("restaurants"), dict):
+        for restaurant in menu["restaurants"].values():
+            categories = restaurant.get("categories") if isinstance(restaurant, dict) else None
+            if isinstance(categories, dict):
+                for cat in categories.values():
+                    if isinstance(cat, dict) and isinstance(cat.get("items"), list):
+                        yield cat["items"]
+    elif isinstance(menu.get("categories"), list):
+        for cat in menu["categories"]:
+            if isinstance(cat, dict) and isinstance(cat.get("items"), list):
+                yield cat["items"]
+    elif isinstance(menu.get("menu_items"), list):
+        yield menu["menu_items"]
+
+
+def describe(item: Dict[str, Any]) -> Dict[str, Any]:
+    """不需要模型的屬性：關鍵字類型、數值價格、辣 / 素提示"""
+    name = str(item.get("name", ""))
+    lowered = name.lower()
+    tags = [str(t) for t in item.get("tags") or []]
+    price = item.get("price")
+    return {
+        "type": ollama_fuc.keyword_item_type(name),
+        "typeSource": "keyword",
+        # 時價（0）照 recommend() 的規則解析成 0，無價格為 None
+        "priceValue": numeric_price(price) if price is not None else None,
+        "spicy": (any(w in lowered for w in _SPICY_WORDS) and not any(w in lowered for w in _NOT_SPICY_WORDS))
+        or "辣" in tags,
+        "vegetarian": VEGETARIAN_TAG in tags or any(w in lowered for w in _VEGETARIAN_WORDS),
+    }
+
+
+def enrich_items(
+    items: List[Dict[str, Any]],
+    use_llm: bool = False,
+    model: Optional[str] = None,
+    timeout: float = 120.0,
+    force: bool = False,
+) -> Dict[str, int]:
+    """就地寫入 enrichment 欄位，回傳統計；已有 type 的品項除非 force 否則略過"""
+    stats = {"items": 0, "skipped": 0, "keyword": 0, "llm": 0, "other": 0, "marketPrice": 0}
+    todo: List[Dict[str, Any]] = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        stats["items"] += 1
+        if item.get("type") and not force:
+            stats["skipped"] += 1
+            continue
+        item.update(describe(item))
+        if item["priceValue"] == 0 or MARKET_PRICE_TAG in (item.get("tags") or []):
+            stats["marketPrice"] += 1
+        todo.append(item)
+
+    leftovers = [item for item in todo if item["type"] == "other"]
+    if use_llm and leftovers:
+        mdl = model or os.environ.get("CLASSIFY_MODEL", "gemma3:12b")
+        labels = ollama_fuc.CLASSIFIER.classify((str(it.get("name", "")) for it in leftovers), mdl, timeout=timeout)
+        for item in leftovers:
+            label = labels.get(str(item.get("name", "")))
+            if label:
+                item["type"], item["typeSource"] = label, "llm"
+
+    for item in todo:
+        stats["llm" if item["typeSource"] == "llm" else "keyword"] += 1
+        stats["other"] += item["type"] == "other"
+    return stats
+
+
+def enrich_menu(menu: Dict[str, Any], use_llm: bool = False, model: Optional[str] = None,
+                timeout: float = 120.0, force: bool = False) -> Tuple[Dict[str, Any], Dict[str, int]]:
+    """回傳 enrichment 後的菜單副本與統計（已載入的菜單視為不可變，原物件不動）"""
+    enriched = copy.deepcopy(menu)
+    items = [item for lst in _item_lists(enriched) for item in lst]
+    return enriched, enrich_items(items, use_llm=use_llm, model=model, timeout=timeout, force=force)
+
+
+def enrich_file(path: str, use_llm: bool = False, model: Optional[str] = None,
+                force: bool = False, dry_run: bool = False) -> Dict[str, int]:
+    """enrichment 一個菜單 JSON 檔並寫回（先寫暫存檔再替換）"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    enriched, stats = enrich_menu(data, use_llm=use_llm, model=model, force=force)
+    if not dry_run and stats["items"] > stats["skipped"]:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(enriched, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+    return stats
+
+
+def _format_stats(stats: Dict[str, int]) -> str:
+    return (f"{stats['items']} 項（略過 {stats['skipped']}、關鍵字 {stats['keyword']}、LLM {stats['llm']}、"
+            f"仍為 other {stats['other']}、時價 {stats['marketPrice']}）")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="菜單 enrichment：預先寫入品項類型、數值價格與辣 / 素提示")
+    parser.add_argument("files", nargs="*", help="菜單 JSON 檔（預設為根目錄的 menu.json 與 menu_*.json）")
+    parser.add_argument("--llm", action="store_true", help="關鍵字判斷不出類型的菜交給 LLM 分類")
+    parser.add_argument("--model", help="LLM 分類模型（預設 CLASSIFY_MODEL）")
+    parser.add_argument("--force", action="store_true", help="已 enrichment 的品項也重新計算")
+    parser.add_argument("--dry-run", action="store_true", help="只顯示統計，不寫回")
+    parser.add_argument("--sqlite", action="store_true", help="處理 SQLite 菜單儲存（MENU_DB_PATH）而非 JSON 檔")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        from menu_store import MenuStore
+
+        store = MenuStore()
+        for name in store.restaurant_names():
+            menu = store.load_restaurant(name)
+            if menu is None:
+                continue
+            enriched, stats = enrich_menu(menu, use_llm=args.llm, model=args.model, force=args.force)
+            if not args.dry_run and stats["items"] > stats["skipped"]:
+                store.save_restaurant(name, enriched, source="enrich")
+            print(f" {name}：{_format_stats(stats)}")
+        store.close()
+        return
+
+    files = args.files or [
+        p for p in [os.path.join(PROJECT_ROOT, "menu.json"), *sorted(glob.glob(os.path.join(PROJECT_ROOT, "menu_*.json")))]
+        if os.path.exists(p)
+    ]
+    for path in files:
+        stats = enrich_file(path, use_llm=args.llm, model=args.model, force=args.force, dry_run=args.dry_run)
+        print(f" {os.path.basename(path)}：{_format_stats(stats)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""菜單 facet 索引：把標籤、品項類型、價格帶、菜名詞彙各自轉成品項 id 的 bitset
+
+每個品項在該餐廳索引中有一個 id（0..n-1），bitset 用 Python int 表示，
+「素食、不辣、不要牛肉、不要時價、單品 150 以下」這類條件只需幾次位元運算，
+再把存活的品項交給後續排序。
+
+索引依 menu 物件快取（菜單載入後不會原地修改，爬蟲更新時會換成新的 dict）。
+"""
+import bisect
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import menu_snapshot
+from menu_search import tokenize
+
+MARKET_PRICE_TAG = "時價"
+VEGETARIAN_TAG = "素"
+SPICY_TOKEN = "辣"
+
+_CJK_RUN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]+")
+
+# 離線 enrichment（menu_enrich）寫入品項的欄位；攤平時原樣帶過去，有 type 的品項不必再分類
+ENRICHED_KEYS = ("type", "typeSource", "priceValue", "spicy", "vegetarian")
+
+# 預先建立的價格帶上限，任意上限由最接近的價格帶 + 少量補位組成
+_PRICE_BANDS = (50, 100, 150, 200, 300, 500, 800, 1000, 1500, 2000, 3000)
+
+
+def numeric_price(price: Any) -> Optional[float]:
+    """與 recommend() 的 get_price 相同的解析規則，無法解析回傳 None"""
+    if price is None:
+        return None
+    if isinstance(price, str):
+        match = re.search(r'[\d.]+', price)
+        if not match:
+            return None
+        try:
+            return float(match.group())
+        except ValueError:
+            return None
+    try:
+        return float(price)
+    except (TypeError, ValueError):
+        return None
+
+
+def flatten_menu(menu: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """把菜單攤平成品項列表（name / price / category / restaurant / tags，以及已 enrichment 的欄位）
+
+    支援兩種菜單格式：
+    格式1: {"restaurants": {"餐廳名": {"categories": {"分類": {"items": [...]}}}}}
+    格式2: {"categories": [{"name": "分類", "items": [...]}]}
+    """
+    all_items: List[Dict[str, Any]] = []
+    if "restaurants" in menu and isinstance(menu["restaurants"], dict):
+        for restaurant_name, restaurant_data in menu["restaurants"].items():
+            if isinstance(restaurant_data, dict) and "categories" in restaurant_data:
+                categories = restaurant_data["categories"]
+                if isinstance(categories, dict):
+                    for cat_name, cat_data in categories.items():
+                        if isinstance(cat_data, dict) and "items" in cat_data:
+                            for item in cat_data["items"]:
+                                if isinstance(item, dict):
+                                    all_items.append({
+                                        "name": item.get("name", ""),
+                                        "price": item.get("price"),
+                                        "category": cat_name,
+                                        "restaurant": restaurant_name,
+                                        "tags": list(item.get("tags") or []),
+                                        **{k: item[k] for k in ENRICHED_KEYS if k in item},
+                                    })
+    elif "categories" in menu and isinstance(menu["categories"], list):
+        for cat in menu["categories"]:
+            if isinstance(cat, dict) and "items" in cat:
+                cat_name = cat.get("name", "未分類")
+                for item in cat["items"]:
+                    if isinstance(item, dict):
+                        all_items.append({
+                            "name": item.get("name", ""),
+                            "price": item.get("price"),
+                            "category": cat_name,
+                            "tags": list(item.get("tags") or []),
+                            **{k: item[k] for k in ENRICHED_KEYS if k in item},
+                        })
+    return all_items
+
+
+def iter_bits(mask: int) -> Iterable[int]:
+    """由小到大列出 bitset 中的 id"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class FacetIndex:
+    def __init__(self, items: List[Dict[str, Any]], labeler: Callable[[str], Set[str]],
+                 typer: Callable[[Set[str]], str]) -> None:
+        """items：flatten_menu() 的結果；labeler：菜名（小寫）→ 關鍵字標籤；typer：標籤 → 品項類型
+
+        已 enrichment 的品項直接用其 type / spicy / vegetarian，不看關鍵字。
+        """
+        self.items = items
+        self.all = (1 << len(items)) - 1
+        self._names = [str(it.get("name", "")).lower() for it in items]
+        self.tags: Dict[str, int] = {}
+        self.types: Dict[str, int] = {}
+        self.tokens: Dict[str, int] = {}
+        self.spicy = 0  # enrichment 標為辣的品項（菜名沒有「辣」字也算）
+        self._exclude_cache: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        priced: List[Tuple[float, int]] = []
+        for i, (item, name) in enumerate(zip(items, self._names)):
+            bit = 1 << i
+            labels = labeler(name)
+            item["_labels"] = labels
+            t = item.get("type") or typer(labels)
+            self.types[t] = self.types.get(t, 0) | bit
+            for tag in item.get("tags", []):
+                self.tags[tag] = self.tags.get(tag, 0) | bit
+            if item.get("vegetarian") and VEGETARIAN_TAG not in item.get("tags", []):
+                self.tags[VEGETARIAN_TAG] = self.tags.get(VEGETARIAN_TAG, 0) | bit
+            if item.get("spicy"):
+                self.spicy |= bit
+            if item.get("price") == 0 and MARKET_PRICE_TAG not in item.get("tags", []):
+                self.tags[MARKET_PRICE_TAG] = self.tags.get(MARKET_PRICE_TAG, 0) | bit
+            for tok in tokenize(name):
+                self.tokens[tok] = self.tokens.get(tok, 0) | bit
+            p = numeric_price(item.get("price"))
+            if p is not None:
+                priced.append((p, i))
+
+        priced.sort()
+        self._prices = [p for p, _ in priced]
+        self._price_ids = [i for _, i in priced]
+        self.price_bands: Dict[int, int] = {}
+        mask = 0
+        pos = 0
+        for band in _PRICE_BANDS:
+            while pos < len(priced) and priced[pos][0] <= band:
+                mask |= 1 << priced[pos][1]
+                pos += 1
+            self.price_bands[band] = mask
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def price_at_most(self, limit: float) -> int:
+        """價格 <= limit 的品項（無價格者不算）"""
+        i = bisect.bisect_right(_PRICE_BANDS, limit) - 1
+        mask = self.price_bands[_PRICE_BANDS[i]] if i >= 0 else 0
+        start = bisect.bisect_right(self._prices, _PRICE_BANDS[i]) if i >= 0 else 0
+        end = bisect.bisect_right(self._prices, limit)
+        for pos in range(start, end):
+            mask |= 1 << self._price_ids[pos]
+        return mask
+
+    def _substring_mask(self, keyword: str) -> int:
+        """菜名包含 keyword 的品項；語意與 `keyword in name.lower()` 完全一致"""
+        runs = _CJK_RUN.findall(keyword)
+        if len(runs) == 1 and runs[0] == keyword:
+            if len(keyword) <= 2:
+                return self.tokens.get(keyword, 0)
+            mask = self.all
+            for j in range(len(keyword) - 1):
+                mask &= self.tokens.get(keyword[j:j + 2], 0)
+                if not mask:
+                    return 0
+            return sum(1 << i for i in iter_bits(mask) if keyword in self._names[i])
+        # 含英數 / 符號的關鍵字：詞彙切法不同，直接比對原文
+        return sum(1 << i for i, name in enumerate(self._names) if keyword in name)
+
+    def exclude_mask(self, keyword: str) -> int:
+        """排除某個關鍵字時要拿掉的品項；「時價」同時涵蓋時價標籤"""
+        keyword = keyword.lower()
+        with self._lock:
+            cached = self._exclude_cache.get(keyword)
+        if cached is not None:
+            return cached
+        mask = self._substring_mask(keyword) if keyword else 0
+        if keyword == MARKET_PRICE_TAG:
+            mask |= self.tags.get(MARKET_PRICE_TAG, 0)
+        with self._lock:
+            if len(self._exclude_cache) < 256:
+                self._exclude_cache[keyword] = mask
+        return mask
+
+    def filter(
+        self,
+        excludes: Iterable[str] = (),
+        vegetarian: bool = False,
+        no_spicy: bool = False,
+        no_market_price: bool = False,
+        max_price: Optional[float] = None,
+        types: Optional[Iterable[str]] = None,
+    ) -> int:
+        mask = self.all
+        for kw in excludes:
+            mask &= ~self.exclude_mask(kw)
+        if no_spicy:
+            mask &= ~(self.tokens.get(SPICY_TOKEN, 0) | self.spicy)
+        if no_market_price:
+            mask &= ~self.tags.get(MARKET_PRICE_TAG, 0)
+        # 菜單完全沒有素食標籤時無從判斷，不套用（避免整份菜單被濾光）
+        if vegetarian and VEGETARIAN_TAG in self.tags:
+            mask &= self.tags[VEGETARIAN_TAG]
+        if max_price is not None:
+            mask &= self.price_at_most(max_price)
+        if types is not None:
+            type_mask = 0
+            for t in types:
+                type_mask |= self.types.get(t, 0)
+            mask &= type_mask
+        return mask
+
+    def select(self, mask: int) -> List[Dict[str, Any]]:
+        return [self.items[i] for i in iter_bits(mask)]
+
+
+_CACHE_SIZE = 64
+_CACHE: "OrderedDict[int, Tuple[Dict[str, Any], FacetIndex]]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def _reset_locks_in_child() -> None:
+    """fork 當下其他執行緒可能正持有鎖；子行程只有一條執行緒，直接換成新的鎖（見 recommend_pool）"""
+    global _CACHE_LOCK
+    _CACHE_LOCK = threading.Lock()
+    for _, index in _CACHE.values():
+        index._lock = threading.Lock()
+    snap = menu_snapshot.current()
+    for rs in snap.restaurants.values() if snap is not None else ():
+        if rs.facets is not None:
+            rs.facets._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks_in_child)
+
+
+def index_for(menu: Dict[str, Any], labeler: Callable[[str], Set[str]],
+              typer: Callable[[Set[str]], str]) -> FacetIndex:
+    """取得（或建立）菜單的 facet 索引
+
+    已發佈在快照中的菜單，索引存在該餐廳的 RestaurantSnapshot 上，菜單沒換就一直沿用（不受 _CACHE_SIZE 限制，
+    跨餐廳推薦一次走過上百家也不會互相擠掉）；其他菜單以 menu 物件本身為鍵放在 LRU，快取保留物件參照避免 id 重用。
+    """
+    rs = menu_snapshot.owner_of(menu)
+    if rs is not None:
+        if rs.facets is None:
+            rs.facets = FacetIndex(flatten_menu(menu), labeler, typer)
+        return rs.facets
+    key = id(menu)
+    with _CACHE_LOCK:
+        hit = _CACHE.get(key)
+        if hit is not None and hit[0] is menu:
+            _CACHE.move_to_end(key)
+            return hit[1]
+    index = FacetIndex(flatten_menu(menu), labeler, typer)
+    with _CACHE_LOCK:
+        _CACHE[key] = (menu, index)
+        _CACHE.move_to_end(key)
+        while len(_CACHE) > _CACHE_SIZE:
+            _CACHE.popitem(last=False)
+    return index
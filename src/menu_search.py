@@ -0,0 +1,220 @@
+"""菜品搜尋：跨所有餐廳的記憶體反向索引。
+
+- 中文（CJK）取單字與相鄰二字（bigram），例如「冰蜂蜜」→ 冰、蜂、蜜、冰蜂、蜂蜜
+- 英數取完整單字（小寫），例如 "Iced Honey Milk Tea" → iced、honey、milk、tea
+- 查詢最後一個英文字當作前綴，支援邊打邊查（"milk te" 可找到 Milk Tea）
+
+索引以餐廳為單位增量更新：sync() 只重建快照版本有變的餐廳；移除的 doc id 會重用，沒有菜品用到的詞也會移除。
+"""
+import bisect
+import heapq
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+_CJK_RUN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]+")
+_WORD = re.compile(r"[a-z0-9]+")
+_PREFIX_SCAN_LIMIT = 512  # 候選數低於此值時，前綴改用原文比對
+
+
+def _cjk_grams(run: str) -> Iterable[str]:
+    for i, ch in enumerate(run):
+        yield ch
+        if i + 1 < len(run):
+            yield run[i:i + 2]
+
+
+def tokenize(text: str) -> Set[str]:
+    """名稱 → 索引詞集合"""
+    lowered = text.lower()
+    tokens: Set[str] = set()
+    for run in _CJK_RUN.findall(lowered):
+        tokens.update(_cjk_grams(run))
+    tokens.update(_WORD.findall(lowered))
+    return tokens
+
+
+def _query_terms(query: str) -> Tuple[List[str], Optional[str], List[str]]:
+    """查詢 → (必須完整命中的詞, 最後一個英文前綴, 需要原文驗證的中文片段)"""
+    lowered = query.lower()
+    cjk_runs = _CJK_RUN.findall(lowered)
+    terms: List[str] = []
+    for run in cjk_runs:
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+
+    words = _WORD.findall(lowered)
+    prefix: Optional[str] = None
+    if words and re.search(r"[a-z0-9]$", lowered):
+        prefix = words.pop()  # 使用者可能還沒打完最後一個字
+    terms.extend(words)
+    return terms, prefix, [r for r in cjk_runs if len(r) > 2]
+
+
+class MenuSearchIndex:
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Set[int]] = {}
+        self._vocab: List[str] = []  # 已排序的英文詞，用於前綴查詢
+        self._docs: List[Optional[Dict[str, Any]]] = []
+        self._lower: List[str] = []
+        self._free: List[int] = []  # 已移除的 doc id，新增時優先重用（重複 sync 不會讓索引一直變大）
+        self._by_restaurant: Dict[str, List[int]] = {}
+        self._versions: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self._by_restaurant.values())
+
+    # 建索引 -------------------------------------------------------
+
+    def _add_doc(self, doc: Dict[str, Any]) -> int:
+        if self._free:
+            doc_id = self._free.pop()
+            self._docs[doc_id] = doc
+            self._lower[doc_id] = doc["name"].lower()
+        else:
+            doc_id = len(self._docs)
+            self._docs.append(doc)
+            self._lower.append(doc["name"].lower())
+        for tok in tokenize(doc["name"]):
+            ids = self._postings.get(tok)
+            if ids is None:
+                ids = self._postings[tok] = set()
+                if tok.isascii():
+                    bisect.insort(self._vocab, tok)
+            ids.add(doc_id)
+        return doc_id
+
+    def _remove_doc(self, doc_id: int) -> None:
+        doc = self._docs[doc_id]
+        if doc is None:
+            return
+        for tok in tokenize(doc["name"]):
+            ids = self._postings.get(tok)
+            if ids is None:
+                continue
+            ids.discard(doc_id)
+            if not ids:
+                # 沒有菜品再用到的詞一併移除
+                del self._postings[tok]
+                if tok.isascii():
+                    i = bisect.bisect_left(self._vocab, tok)
+                    if i < len(self._vocab) and self._vocab[i] == tok:
+                        del self._vocab[i]
+        self._docs[doc_id] = None
+        self._lower[doc_id] = ""
+        self._free.append(doc_id)
+
+    def remove_restaurant(self, restaurant: str) -> None:
+        with self._lock:
+            for doc_id in self._by_restaurant.pop(restaurant, []):
+                self._remove_doc(doc_id)
+            self._versions.pop(restaurant, None)
+
+    def update_restaurant(self, restaurant: str, categories: List[Dict[str, Any]],
+                          version: Optional[str] = None) -> None:
+        """以前端格式的分類列表 [{"name", "items"}] 重建單一餐廳的索引"""
+        with self._lock:
+            self.remove_restaurant(restaurant)
+            ids: List[int] = []
+            for cat in categories:
+                for item in cat.get("items", []):
+                    if not isinstance(item, dict) or not item.get("name"):
+                        continue
+                    ids.append(self._add_doc({
+                        "restaurant": restaurant,
+                        "category": cat.get("name", "未分類"),
+                        "name": str(item["name"]),
+                        "price": item.get("price"),
+                    }))
+            self._by_restaurant[restaurant] = ids
+            if version is not None:
+                self._versions[restaurant] = version
+
+    def sync(self, snapshot: Any) -> int:
+        """依菜單快照增量更新，回傳重建的餐廳數"""
+        with self._lock:
+            changed = 0
+            for name in list(self._by_restaurant):
+                if name not in snapshot.restaurants:
+                    self.remove_restaurant(name)
+            for name, rs in snapshot.restaurants.items():
+                if self._versions.get(name) != rs.version or name not in self._by_restaurant:
+                    self.update_restaurant(name, rs.categories, rs.version)
+                    changed += 1
+            return changed
+
+    # 查詢 ---------------------------------------------------------
+
+    def _prefix_ids(self, prefix: str) -> Set[int]:
+        ids: Set[int] = set()
+        i = bisect.bisect_left(self._vocab, prefix)
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix):
+            ids |= self._postings.get(self._vocab[i], set())
+            i += 1
+        return ids
+
+    def _candidates(self, query: str) -> Set[int]:
+        terms, prefix, verify = _query_terms(query)
+        postings: List[Set[int]] = []
+        for term in terms:
+            ids = self._postings.get(term)
+            if not ids:
+                return set()
+            postings.append(ids)
+
+        if not postings:
+            if prefix is None or len(prefix) < 2:
+                return set()  # 只有單一英文字母，範圍太廣不查
+            return self._prefix_ids(prefix)
+
+        postings.sort(key=len)
+        result = set(postings[0])
+        for ids in postings[1:]:
+            result &= ids
+            if not result:
+                return result
+        if prefix is not None:
+            if len(result) <= _PREFIX_SCAN_LIMIT:
+                # 候選已經很少，直接比對原文比合併大量 posting 便宜
+                pattern = re.compile(r"(?<![a-z0-9])" + re.escape(prefix))
+                result = {i for i in result if pattern.search(self._lower[i])}
+            else:
+                result &= self._prefix_ids(prefix)
+        # bigram 交集可能跨字命中，較長的中文片段再用原文確認
+        if verify:
+            result = {i for i in result if all(run in self._lower[i] for run in verify)}
+        return result
+
+    def search(self, query: str, limit: int = 20, restaurant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """回傳符合的菜品；名稱以查詢開頭者優先，其次名稱較短者"""
+        q = query.strip().lower()
+        if not q:
+            return []
+        with self._lock:
+            ids = self._candidates(q)
+            if restaurant is not None:
+                ids = {i for i in ids if self._docs[i] is not None and self._docs[i]["restaurant"] == restaurant}
+            top = heapq.nsmallest(
+                limit, ids,
+                key=lambda i: (not self._lower[i].startswith(q), len(self._lower[i]), i),
+            )
+            return [dict(self._docs[i]) for i in top if self._docs[i] is not None]
+
+    def suggest(self, query: str, limit: int = 10) -> List[str]:
+        """自動完成：回傳不重複的菜名"""
+        names: List[str] = []
+        seen: Set[str] = set()
+        for doc in self.search(query, limit=limit * 3):
+            if doc["name"] not in seen:
+                seen.add(doc["name"])
+                names.append(doc["name"])
+                if len(names) >= limit:
+                    break
+        return names
+
+
+# 全域索引：back.py 在每次發佈菜單快照後呼叫 INDEX.sync(snapshot)
+INDEX = MenuSearchIndex()
@@ -0,0 +1,358 @@
+"""菜單快照：在「發佈」時把每家餐廳的回應先序列化、壓縮好，API 只負責挑選位元組回傳。
+
+RESTAURANT_MENUS / ACTIVE_RESTAURANT 有變動時呼叫 publish()，
+之後 /api/current-menu 與 /api/restaurants 都直接讀 current() 的結果。
+"""
+import base64
+import gzip
+import hashlib
+import json
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 選用：有安裝 brotli 才額外產生 br 版本
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None  # type: ignore
+    BROTLI_AVAILABLE = False
+
+
+@dataclass
+class EncodedBody:
+    """同一份 JSON 的原始 / gzip / brotli 版本與對應的強 ETag"""
+    raw: bytes
+    gzip: bytes
+    br: Optional[bytes]
+    etag: str  # 以內容雜湊產生，格式為 "\"<hash>\""
+
+    def variant(self, encoding: Optional[str]) -> Tuple[bytes, str]:
+        """依編碼回傳 (內容, ETag)；不同編碼使用不同的強 ETag"""
+        if encoding == "br" and self.br is not None:
+            return self.br, self.etag[:-1] + '-br"'
+        if encoding == "gzip":
+            return self.gzip, self.etag[:-1] + '-gzip"'
+        return self.raw, self.etag
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """If-None-Match 是否命中（任一編碼版本都算同一份內容）"""
+        if not if_none_match:
+            return False
+        base = self.etag.strip('"')
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            tag = tag.strip('"')
+            if tag in (base, base + "-gzip", base + "-br"):
+                return True
+        return False
+
+
+def encode_body(payload: Any) -> EncodedBody:
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    digest = hashlib.sha256(raw).hexdigest()[:32]
+    return EncodedBody(
+        raw=raw,
+        gzip=gzip.compress(raw, compresslevel=9, mtime=0),
+        br=brotli.compress(raw, quality=11) if BROTLI_AVAILABLE else None,
+        etag=f'"{digest}"',
+    )
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """從 Accept-Encoding 挑出可用的壓縮格式（br 優先，其次 gzip）"""
+    if not accept_encoding:
+        return None
+    accepted = set()
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                pass
+        accepted.add(token)
+    if BROTLI_AVAILABLE and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def restaurant_categories(name: str, menu_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """把單一餐廳菜單轉成前端格式 [{"name": 分類, "items": [...]}]
+
+    支援兩種菜單格式：
+    格式1: {"restaurants": {"餐廳名": {"categories": {"分類": {"items": [...]}}}}}
+    格式2: {"categories": [{"name": "分類", "items": [...]}]}
+    """
+    if isinstance(menu_data.get("restaurants"), dict):
+        restaurant_data = menu_data["restaurants"].get(name, {})
+        categories_dict = restaurant_data.get("categories", {}) if isinstance(restaurant_data, dict) else {}
+        return [
+            {"name": cat_name, "items": cat_data.get("items", [])}
+            for cat_name, cat_data in categories_dict.items()
+            if isinstance(cat_data, dict)
+        ]
+    if isinstance(menu_data.get("categories"), list):
+        return [
+            {"name": cat.get("name", "未分類"), "items": cat.get("items", [])}
+            for cat in menu_data["categories"]
+            if isinstance(cat, dict)
+        ]
+    return []
+
+
+@dataclass
+class RestaurantSnapshot:
+    name: str
+    categories: List[Dict[str, Any]]
+    item_count: int
+    version: str  # 菜單內容雜湊，內容不變版本就不變
+    body: EncodedBody  # /api/current-menu 的完整回應
+    source: Any = field(default=None, repr=False)  # 原始菜單物件，用來判斷是否可沿用
+    blurbs: Dict[str, str] = field(default_factory=dict, repr=False)  # 菜名 → 預先生成的介紹（見 dish_blurbs）
+    facets: Any = field(default=None, repr=False)  # 菜單的 facet 索引（見 menu_facets.index_for），隨快照沿用
+    _projections: Dict[Tuple[str, ...], List[Dict[str, Any]]] = field(default_factory=dict, repr=False)
+
+    def project(self, fields: Optional[Tuple[str, ...]]) -> List[Dict[str, Any]]:
+        """回傳只保留指定欄位的分類列表；同一組欄位只投影一次"""
+        if not fields:
+            return self.categories
+        cached = self._projections.get(fields)
+        if cached is None:
+            cached = [
+                {
+                    "name": cat["name"],
+                    "items": [
+                        {k: item[k] for k in fields if k in item}
+                        for item in cat["items"]
+                        if isinstance(item, dict)
+                    ],
+                }
+                for cat in self.categories
+            ]
+            if len(self._projections) < _MAX_PROJECTIONS:
+                self._projections[fields] = cached
+        return cached
+
+
+@dataclass
+class MenuSnapshot:
+    version: int  # 每次發佈遞增
+    active: Optional[str]
+    restaurants: Dict[str, RestaurantSnapshot]
+    restaurants_body: EncodedBody  # /api/restaurants 的完整回應
+    empty_body: EncodedBody  # 尚未載入任何菜單時的回應
+    by_source: Dict[int, RestaurantSnapshot] = field(default_factory=dict, repr=False)  # id(原始菜單物件) → 餐廳
+
+    def active_restaurant(self) -> Optional[RestaurantSnapshot]:
+        if not self.active:
+            return None
+        return self.restaurants.get(self.active)
+
+    def current_menu_body(self) -> EncodedBody:
+        rs = self.active_restaurant()
+        return rs.body if rs is not None else self.empty_body
+
+
+def build_restaurant_snapshot(name: str, menu_data: Dict[str, Any]) -> RestaurantSnapshot:
+    categories = restaurant_categories(name, menu_data)
+    body = encode_body({
+        "success": True,
+        "restaurantName": name,
+        "categories": categories,
+    })
+    return RestaurantSnapshot(
+        name=name,
+        categories=categories,
+        item_count=sum(len(c["items"]) for c in categories),
+        version=body.etag.strip('"'),
+        body=body,
+        source=menu_data,
+    )
+
+
+# 分頁 / 欄位投影
+ITEM_FIELDS = ("name", "price", "tags", "options")
+_MAX_PROJECTIONS = 16  # ITEM_FIELDS 的組合數，避免快取被任意欄位撐大
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """fields=name,price → ("name", "price")；未知欄位忽略，維持 ITEM_FIELDS 順序"""
+    if not fields:
+        return None
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    return tuple(f for f in ITEM_FIELDS if f in wanted) or None
+
+
+def encode_cursor(version: str, cat_index: int, offset: int) -> str:
+    token = f"{version[:12]}:{cat_index}:{offset}".encode("utf-8")
+    return base64.urlsafe_b64encode(token).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int, int]:
+    """解析游標；格式錯誤時丟 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        version, cat_index, offset = base64.urlsafe_b64decode(padded).decode("utf-8").split(":")
+        return version, int(cat_index), int(offset)
+    except Exception as e:
+        raise ValueError(f"無效的游標: {cursor}") from e
+
+
+def _category_page(rs: RestaurantSnapshot, categories: List[Dict[str, Any]], cat_index: int,
+                   offset: int, limit: int) -> Dict[str, Any]:
+    cat = categories[cat_index]
+    items = cat["items"][offset:offset + limit]
+    end = offset + len(items)
+    return {
+        "name": cat["name"],
+        "total": len(cat["items"]),
+        "items": items,
+        "nextCursor": encode_cursor(rs.version, cat_index, end) if end < len(cat["items"]) else None,
+    }
+
+
+def menu_page(
+    rs: RestaurantSnapshot,
+    limit: int,
+    cursor: Optional[str] = None,
+    fields: Optional[Tuple[str, ...]] = None,
+    category: Optional[str] = None,
+) -> Dict[str, Any]:
+    """分頁版 current-menu：
+
+    - 沒有 cursor：每個分類回傳前 limit 筆與各自的 nextCursor（適合首屏）
+    - 有 cursor：只回傳該分類的下一頁
+    游標綁定菜單版本，菜單更新後舊游標會丟 ValueError，前端應重新載入。
+    """
+    categories = rs.project(fields)
+    limit = max(1, limit)
+
+    if cursor:
+        version, cat_index, offset = decode_cursor(cursor)
+        if version != rs.version[:12]:
+            raise ValueError("菜單已更新，游標失效")
+        if not 0 <= cat_index < len(categories) or offset < 0:
+            raise ValueError(f"無效的游標: {cursor}")
+        pages = [_category_page(rs, categories, cat_index, offset, limit)]
+    else:
+        pages = [
+            _category_page(rs, categories, i, 0, limit)
+            for i, cat in enumerate(categories)
+            if category is None or cat["name"] == category
+        ]
+
+    return {
+        "success": True,
+        "restaurantName": rs.name,
+        "version": rs.version,
+        "categories": pages,
+    }
+
+
+def menu_ndjson(
+    rs: RestaurantSnapshot,
+    fields: Optional[Tuple[str, ...]] = None,
+    category: Optional[str] = None,
+) -> Iterator[bytes]:
+    """NDJSON 串流：先送 meta，再依序送每個分類與其品項，前端可邊收邊渲染
+
+    每行的 type 是紀錄種類（meta / category / item）；enrichment 寫入的品項類型（main、drink…）改放在 itemType。
+    """
+    def line(obj: Dict[str, Any]) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    categories = [c for c in rs.project(fields) if category is None or c["name"] == category]
+    yield line({
+        "type": "meta",
+        "restaurantName": rs.name,
+        "version": rs.version,
+        "categoryCount": len(categories),
+        "itemCount": sum(len(c["items"]) for c in categories),
+    })
+    for cat in categories:
+        yield line({"type": "category", "name": cat["name"], "itemCount": len(cat["items"])})
+        for item in cat["items"]:
+            record = {k: v for k, v in item.items() if k != "type"}
+            if "type" in item:
+                record["itemType"] = item["type"]
+            yield line({**record, "category": cat["name"], "type": "item"})
+
+
+_EMPTY_MENU_BODY = encode_body({
+    "success": False,
+    "message": "目前未載入任何菜單",
+    "restaurantName": None,
+    "categories": [],
+})
+
+_LOCK = threading.Lock()
+_CURRENT: Optional[MenuSnapshot] = None
+
+
+def publish(restaurant_menus: Dict[str, Dict[str, Any]], active: Optional[str]) -> MenuSnapshot:
+    """重建快照並原子替換；菜單物件沒換過的餐廳直接沿用上一版
+
+    菜單有變的餐廳重建快照時，名稱仍存在的菜沿用上一版的介紹。
+    """
+    global _CURRENT
+    with _LOCK:
+        previous = _CURRENT.restaurants if _CURRENT is not None else {}
+        restaurants: Dict[str, RestaurantSnapshot] = {}
+        for name, menu_data in restaurant_menus.items():
+            old = previous.get(name)
+            if old is not None and old.source is menu_data:
+                restaurants[name] = old
+            else:
+                rs = restaurants[name] = build_restaurant_snapshot(name, menu_data)
+                if old is not None and old.blurbs:
+                    names = {item.get("name") for cat in rs.categories for item in cat["items"] if isinstance(item, dict)}
+                    rs.blurbs.update((n, b) for n, b in old.blurbs.items() if n in names)
+
+        restaurants_body = encode_body({
+            "restaurants": [
+                {"name": name, "active": name == active, "itemCount": rs.item_count}
+                for name, rs in restaurants.items()
+            ],
+            "activeRestaurant": active,
+        })
+        _CURRENT = MenuSnapshot(
+            version=(_CURRENT.version + 1) if _CURRENT is not None else 1,
+            active=active,
+            restaurants=restaurants,
+            restaurants_body=restaurants_body,
+            empty_body=_EMPTY_MENU_BODY,
+            by_source={id(rs.source): rs for rs in reversed(list(restaurants.values()))},
+        )
+        return _CURRENT
+
+
+def current() -> Optional[MenuSnapshot]:
+    return _CURRENT
+
+
+def owner_of(menu_data: Any) -> Optional[RestaurantSnapshot]:
+    """目前快照中以 menu_data 這個物件為來源的餐廳（多家共用同一物件時取第一家）；不在快照中時回傳 None"""
+    snap = _CURRENT
+    if snap is None:
+        return None
+    rs = snap.by_source.get(id(menu_data))
+    return rs if rs is not None and rs.source is menu_data else None
+
+
+def versions_of(menu_data: Any) -> Tuple[str, ...]:
+    """目前快照中以 menu_data 這個物件為來源的餐廳版本；菜單尚未發佈時回傳空 tuple"""
+    snap = _CURRENT
+    if snap is None:
+        return ()
+    return tuple(sorted(rs.version for rs in snap.restaurants.values() if rs.source is menu_data))
@@ -0,0 +1,366 @@
+"""SQLite 菜單儲存（選用後端）
+
+取代專案根目錄下一家餐廳一個 menu_*.json 的做法：
+餐廳 / 分類 / 品項 / 標籤分表存放，價格另存數值欄位並建索引，
+菜名用 FTS5 全文索引（支援時使用 trigram 斷詞，中文子字串也查得到）。
+
+啟用方式：.env 設定 MENU_STORE=sqlite（資料庫路徑 MENU_DB_PATH，預設 db/menus.sqlite3）
+
+命令列：
+    python src/menu_store.py import          匯入既有 menu.json / menu_*.json
+    python src/menu_store.py list
+    python src/menu_store.py search 奶茶 --max-price 80
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from menu_facets import ENRICHED_KEYS
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SRC_DIR, os.pardir))
+DEFAULT_DB_PATH = os.environ.get("MENU_DB_PATH", os.path.join(PROJECT_ROOT, "db", "menus.sqlite3"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS restaurants (
+    id           INTEGER PRIMARY KEY,
+    name         TEXT NOT NULL UNIQUE,
+    display_name TEXT,
+    source       TEXT,
+    updated_at   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS categories (
+    id            INTEGER PRIMARY KEY,
+    restaurant_id INTEGER NOT NULL REFERENCES restaurants(id) ON DELETE CASCADE,
+    name          TEXT NOT NULL,
+    position      INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    id            INTEGER PRIMARY KEY,
+    restaurant_id INTEGER NOT NULL REFERENCES restaurants(id) ON DELETE CASCADE,
+    category_id   INTEGER NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+    name          TEXT NOT NULL,
+    price         REAL,          -- 數值價格，可排序 / 範圍查詢；時價或無價格為 NULL
+    price_json    TEXT,          -- 原始價格（JSON），讀回菜單時保留原樣，例如 "70.00" 或 0
+    options_json  TEXT,
+    attrs_json    TEXT,          -- enrichment 欄位（type、priceValue、spicy…，見 menu_enrich）
+    position      INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS item_tags (
+    item_id INTEGER NOT NULL REFERENCES items(id) ON DELETE CASCADE,
+    tag     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_categories_restaurant ON categories(restaurant_id, position);
+CREATE INDEX IF NOT EXISTS idx_items_category ON items(category_id, position);
+CREATE INDEX IF NOT EXISTS idx_items_restaurant_price ON items(restaurant_id, price);
+CREATE INDEX IF NOT EXISTS idx_items_price ON items(price);
+CREATE INDEX IF NOT EXISTS idx_item_tags_item ON item_tags(item_id);
+CREATE INDEX IF NOT EXISTS idx_item_tags_tag ON item_tags(tag);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    name, content='items', content_rowid='id', tokenize='{tokenizer}'
+);
+CREATE TRIGGER IF NOT EXISTS items_ai AFTER INSERT ON items BEGIN
+    INSERT INTO items_fts(rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS items_ad AFTER DELETE ON items BEGIN
+    INSERT INTO items_fts(items_fts, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS items_au AFTER UPDATE OF name ON items BEGIN
+    INSERT INTO items_fts(items_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO items_fts(rowid, name) VALUES (new.id, new.name);
+END;
+"""
+
+
+def parse_price(price: Any) -> Optional[float]:
+    """'$1,109.00' / '109' / 109 → 109.0；時價（0）、無法解析 → None"""
+    if isinstance(price, bool):
+        return None
+    if isinstance(price, (int, float)):
+        return float(price) if price > 0 else None
+    if isinstance(price, str):
+        m = re.search(r"\d+(?:\.\d+)?", price.replace(",", ""))
+        if m:
+            value = float(m.group())
+            return value if value > 0 else None
+    return None
+
+
+def menu_from_crawled(restaurant_name: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """爬蟲輸出（{"name", "menu_items": [...]}）→ 系統菜單格式"""
+    return {
+        "restaurants": {
+            restaurant_name: {
+                "name": data.get("name", restaurant_name),
+                "categories": {
+                    "全部菜色": {
+                        "items": [
+                            {
+                                "name": item.get("name", ""),
+                                "price": item.get("price", "價格未提供").replace("$", "").replace(",", "").strip()
+                                if isinstance(item.get("price"), str) else item.get("price"),
+                                **{k: item[k] for k in ENRICHED_KEYS if k in item},
+                            }
+                            for item in data.get("menu_items", [])
+                        ]
+                    }
+                },
+            }
+        }
+    }
+
+
+def _iter_categories(name: str, menu_data: Dict[str, Any]) -> Tuple[str, List[Tuple[str, List[Dict[str, Any]]]]]:
+    """支援兩種菜單格式，回傳 (顯示名稱, [(分類名, 品項列表), ...])"""
+    if isinstance(menu_data.get("restaurants"), dict):
+        rd = menu_data["restaurants"].get(name, {})
+        cats = rd.get("categories", {}) if isinstance(rd, dict) else {}
+        return rd.get("name", name), [(c, d.get("items", [])) for c, d in cats.items() if isinstance(d, dict)]
+    if isinstance(menu_data.get("categories"), list):
+        return name, [(c.get("name", "未分類"), c.get("items", [])) for c in menu_data["categories"] if isinstance(c, dict)]
+    return name, []
+
+
+class MenuStore:
+    def __init__(self, db_path: str = DEFAULT_DB_PATH) -> None:
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {r["name"] for r in self._conn.execute("PRAGMA table_info(items)")}
+        if "attrs_json" not in columns:  # 舊資料庫補欄位
+            self._conn.execute("ALTER TABLE items ADD COLUMN attrs_json TEXT")
+        self.fts_tokenizer = self._init_fts()
+
+    def _init_fts(self) -> Optional[str]:
+        """建立 FTS5 索引；優先 trigram（中文子字串），其次 unicode61；都不支援時回傳 None"""
+        for tokenizer in ("trigram", "unicode61"):
+            try:
+                self._conn.executescript(_FTS_SCHEMA.format(tokenizer=tokenizer))
+                return tokenizer
+            except sqlite3.OperationalError:
+                continue
+        print("[警告] SQLite 未支援 FTS5，菜名搜尋改用 LIKE")
+        return None
+
+    def close(self) -> None:
+        self._conn.close()
+
+    # 寫入 ---------------------------------------------------------
+
+    def save_restaurant(self, name: str, menu_data: Dict[str, Any], source: Optional[str] = None) -> int:
+        """以單一交易取代整家餐廳的資料，回傳品項數"""
+        display_name, categories = _iter_categories(name, menu_data)
+        count = 0
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM restaurants WHERE name = ?", (name,))
+            rid = self._conn.execute(
+                "INSERT INTO restaurants(name, display_name, source, updated_at) VALUES (?, ?, ?, ?)",
+                (name, display_name, source, time.time()),
+            ).lastrowid
+            for cpos, (cat_name, items) in enumerate(categories):
+                cid = self._conn.execute(
+                    "INSERT INTO categories(restaurant_id, name, position) VALUES (?, ?, ?)",
+                    (rid, cat_name, cpos),
+                ).lastrowid
+                for ipos, item in enumerate(items):
+                    if not isinstance(item, dict):
+                        continue
+                    attrs = {k: item[k] for k in ENRICHED_KEYS if k in item}
+                    iid = self._conn.execute(
+                        "INSERT INTO items(restaurant_id, category_id, name, price, price_json, options_json, attrs_json, position)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            rid, cid, str(item.get("name", "")), parse_price(item.get("price")),
+                            json.dumps(item["price"], ensure_ascii=False) if "price" in item else None,
+                            json.dumps(item["options"], ensure_ascii=False) if item.get("options") else None,
+                            json.dumps(attrs, ensure_ascii=False) if attrs else None,
+                            ipos,
+                        ),
+                    ).lastrowid
+                    tags = item.get("tags") or []
+                    if tags:
+                        self._conn.executemany(
+                            "INSERT INTO item_tags(item_id, tag) VALUES (?, ?)",
+                            [(iid, str(t)) for t in tags],
+                        )
+                    count += 1
+        return count
+
+    def delete_restaurant(self, name: str) -> bool:
+        with self._lock, self._conn:
+            cur = self._conn.execute("DELETE FROM restaurants WHERE name = ?", (name,))
+            return cur.rowcount > 0
+
+    # 讀取 ---------------------------------------------------------
+
+    def restaurant_names(self) -> List[str]:
+        with self._lock:
+            return [r["name"] for r in self._conn.execute("SELECT name FROM restaurants ORDER BY updated_at")]
+
+    def list_restaurants(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT r.name, r.display_name, r.updated_at, COUNT(i.id) AS item_count"
+                " FROM restaurants r LEFT JOIN items i ON i.restaurant_id = r.id"
+                " GROUP BY r.id ORDER BY r.updated_at"
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def load_restaurant(self, name: str) -> Optional[Dict[str, Any]]:
+        """讀回系統菜單格式 {"restaurants": {name: {"name", "categories": {...}}}}"""
+        with self._lock:
+            r = self._conn.execute("SELECT id, display_name FROM restaurants WHERE name = ?", (name,)).fetchone()
+            if r is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT c.name AS category, i.id, i.name, i.price_json, i.options_json, i.attrs_json"
+                " FROM categories c LEFT JOIN items i ON i.category_id = c.id"
+                " WHERE c.restaurant_id = ? ORDER BY c.position, i.position",
+                (r["id"],),
+            ).fetchall()
+            tag_rows = self._conn.execute(
+                "SELECT t.item_id, t.tag FROM item_tags t JOIN items i ON i.id = t.item_id"
+                " WHERE i.restaurant_id = ? ORDER BY t.rowid",
+                (r["id"],),
+            ).fetchall()
+
+        tags: Dict[int, List[str]] = {}
+        for t in tag_rows:
+            tags.setdefault(t["item_id"], []).append(t["tag"])
+
+        categories: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        for row in rows:
+            items = categories.setdefault(row["category"], {"items": []})["items"]
+            if row["id"] is None:
+                continue
+            item: Dict[str, Any] = {"name": row["name"]}
+            if row["price_json"] is not None:
+                item["price"] = json.loads(row["price_json"])
+            if row["options_json"]:
+                item["options"] = json.loads(row["options_json"])
+            if row["id"] in tags:
+                item["tags"] = tags[row["id"]]
+            if row["attrs_json"]:
+                item.update(json.loads(row["attrs_json"]))
+            items.append(item)
+
+        return {"restaurants": {name: {"name": r["display_name"] or name, "categories": categories}}}
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        return {name: menu for name in self.restaurant_names() if (menu := self.load_restaurant(name)) is not None}
+
+    # 查詢 ---------------------------------------------------------
+
+    def search(
+        self,
+        query: str,
+        restaurant: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        limit: int = 20,
+    ) -> List[Dict[str, Any]]:
+        """菜名全文搜尋 + 價格範圍；query 為空時只依價格篩選"""
+        where: List[str] = []
+        params: List[Any] = []
+        join = ""
+        q = query.strip()
+        if q:
+            if (self.fts_tokenizer == "trigram" and len(q) >= 3) or self.fts_tokenizer == "unicode61":
+                join = "JOIN items_fts f ON f.rowid = i.id"
+                where.append("items_fts MATCH ?")
+                params.append('"' + q.replace('"', '""') + '"')
+            else:
+                # trigram 需要至少三個字；較短查詢或無 FTS5 時用 LIKE
+                where.append("i.name LIKE ?")
+                params.append(f"%{q}%")
+        if restaurant is not None:
+            where.append("r.name = ?")
+            params.append(restaurant)
+        if min_price is not None:
+            where.append("i.price >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            where.append("i.price <= ?")
+            params.append(max_price)
+        sql = (
+            "SELECT r.name AS restaurant, c.name AS category, i.name, i.price"
+            f" FROM items i {join}"
+            " JOIN restaurants r ON r.id = i.restaurant_id"
+            " JOIN categories c ON c.id = i.category_id"
+            + (" WHERE " + " AND ".join(where) if where else "")
+            + " ORDER BY i.price IS NULL, i.price LIMIT ?"
+        )
+        params.append(limit)
+        with self._lock:
+            return [dict(r) for r in self._conn.execute(sql, params)]
+
+
+def import_json_files(store: MenuStore, project_root: str = PROJECT_ROOT) -> Dict[str, int]:
+    """匯入根目錄的 menu.json（舊格式視為「大肥鵝」）與所有 menu_*.json，回傳 {餐廳: 品項數}"""
+    imported: Dict[str, int] = {}
+    default_path = os.path.join(project_root, "menu.json")
+    if os.path.exists(default_path):
+        with open(default_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if "categories" in data:
+            imported["大肥鵝"] = store.save_restaurant("大肥鵝", data, source=default_path)
+        elif isinstance(data.get("restaurants"), dict):
+            for name in data["restaurants"]:
+                imported[name] = store.save_restaurant(name, data, source=default_path)
+
+    for path in sorted(glob.glob(os.path.join(project_root, "menu_*.json")), key=os.path.getmtime):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f" 匯入 {path} 失敗：{e}")
+            continue
+        name = os.path.basename(path).replace("menu_", "").replace(".json", "")
+        if isinstance(data.get("menu_items"), list):
+            imported[name] = store.save_restaurant(name, menu_from_crawled(name, data), source=path)
+    return imported
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SQLite 菜單儲存")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("import", help="匯入 menu.json / menu_*.json")
+    sub.add_parser("list", help="列出餐廳")
+    p = sub.add_parser("search", help="搜尋菜名")
+    p.add_argument("query")
+    p.add_argument("--restaurant")
+    p.add_argument("--max-price", type=float)
+    p.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    store = MenuStore(args.db)
+    if args.cmd == "import":
+        for name, count in import_json_files(store).items():
+            print(f" 已匯入 {name}（{count} 項）")
+    elif args.cmd == "list":
+        for r in store.list_restaurants():
+            print(f" {r['name']}：{r['item_count']} 項")
+    elif args.cmd == "search":
+        for r in store.search(args.query, restaurant=args.restaurant, max_price=args.max_price, limit=args.limit):
+            print(f" [{r['restaurant']}] {r['name']}（{r['category']}）${r['price']}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""依延遲與錯誤率在大 / 小模型之間切換的路由器
+
+每個任務（reply / pref / classify / blurb）各有主要模型，可另外設定較小的備援模型。
+路由器記錄每個 (任務, 模型) 最近的呼叫延遲與成敗：
+- 主要模型 p95 超過該任務的延遲目標、錯誤率過高，或同時進行中的請求太多 → 降級到小模型
+- 降級後每隔一段時間放一個請求給主要模型試探；最近的 p95 回到目標的 80% 以下且錯誤率低 → 恢復
+路由決策與切換紀錄由 stats() 匯出到 /api/metrics。
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# 每個任務的預設延遲目標（p95，毫秒）
+DEFAULT_SLO_MS = {"reply": 20000.0, "pref": 4000.0, "classify": 8000.0, "blurb": 60000.0}
+
+_WINDOW_SIZE = 50          # 每個 (任務, 模型) 保留最近幾筆
+_WINDOW_SECONDS = 300.0    # 超過此時間的樣本不計
+_MIN_SAMPLES = 5           # 樣本太少不做降級判斷
+_MAX_ERROR_RATE = 0.3
+_RECOVER_ERROR_RATE = 0.1
+_RECOVER_RATIO = 0.8       # 恢復門檻：p95 < SLO * 0.8（避免來回震盪）
+_COOLDOWN_SECONDS = 30.0   # 降級後至少維持多久才試探主要模型
+_PROBE_INTERVAL = 10.0     # 降級期間每隔多久放一個請求給主要模型
+_RECOVER_SAMPLES = 3       # 降級後主要模型至少要有幾筆新樣本才判斷能否恢復
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+class _Window:
+    __slots__ = ("samples", "calls", "errors")
+
+    def __init__(self) -> None:
+        self.samples: Deque[Tuple[float, float, bool]] = deque(maxlen=_WINDOW_SIZE)  # (時間, 毫秒, 成功)
+        self.calls = 0
+        self.errors = 0
+
+    def recent(self, now: float) -> List[Tuple[float, float, bool]]:
+        return [s for s in self.samples if now - s[0] <= _WINDOW_SECONDS]
+
+    def summary(self, now: float, since: float = 0.0) -> Dict[str, Any]:
+        recent = [s for s in self.recent(now) if s[0] >= since]
+        latencies = sorted(ms for _, ms, ok in recent if ok)
+        errors = sum(1 for _, _, ok in recent if not ok)
+        return {
+            "samples": len(recent),
+            "p50Ms": round(_percentile(latencies, 0.5), 1),
+            "p95Ms": round(_percentile(latencies, 0.95), 1),
+            "errorRate": round(errors / len(recent), 4) if recent else 0.0,
+        }
+
+
+class _TaskState:
+    __slots__ = ("degraded", "since", "last_probe", "decisions")
+
+    def __init__(self) -> None:
+        self.degraded = False
+        self.since = 0.0  # 上次切換（降級或恢復）的時間
+        self.last_probe = 0.0
+        self.decisions: Dict[str, int] = {}
+
+
+class ModelRouter:
+    def __init__(self, name: str = "modelRouter", max_inflight: Optional[int] = None) -> None:
+        self.name = name
+        self.max_inflight = max_inflight if max_inflight is not None else int(os.environ.get("ROUTER_MAX_INFLIGHT", "4"))
+        self._lock = threading.Lock()
+        self._windows: Dict[Tuple[str, str], _Window] = {}
+        self._inflight: Dict[str, int] = {}
+        self._tasks: Dict[str, _TaskState] = {}
+        self._events: Deque[Dict[str, Any]] = deque(maxlen=20)
+
+    # 設定 ---------------------------------------------------------------
+
+    @staticmethod
+    def slo_ms(task: str) -> float:
+        env = os.environ.get(f"ROUTER_SLO_{task.upper()}_MS")
+        return float(env) if env else DEFAULT_SLO_MS.get(task, 10000.0)
+
+    @staticmethod
+    def small_model(task: str) -> Optional[str]:
+        """任務的備援小模型：<TASK>_SMALL_MODEL，未設定時用 OLLAMA_SMALL_MODEL；都沒有則不降級"""
+        return os.environ.get(f"{task.upper()}_SMALL_MODEL") or os.environ.get("OLLAMA_SMALL_MODEL") or None
+
+    # 路由 ---------------------------------------------------------------
+
+    def _at_risk(self, task: str, model: str, since: float, now: float) -> Optional[str]:
+        """主要模型是否有風險，回傳原因（呼叫時須持有鎖）；只看上次切換之後的樣本"""
+        if self._inflight.get(model, 0) >= self.max_inflight:
+            return f"inflight>={self.max_inflight}"
+        window = self._windows.get((task, model))
+        if window is None:
+            return None
+        s = window.summary(now, since)
+        if s["samples"] < _MIN_SAMPLES:
+            return None
+        if s["errorRate"] > _MAX_ERROR_RATE:
+            return f"errorRate={s['errorRate']}"
+        if s["p95Ms"] > self.slo_ms(task):
+            return f"p95={s['p95Ms']}ms"
+        return None
+
+    def _recovered(self, task: str, model: str, since: float, now: float) -> bool:
+        """只看降級之後（試探請求）的樣本，避免被降級前的慢樣本拖住"""
+        window = self._windows.get((task, model))
+        if window is None:
+            return False
+        s = window.summary(now, since)
+        if s["samples"] < _RECOVER_SAMPLES:
+            return False
+        return s["errorRate"] <= _RECOVER_ERROR_RATE and s["p95Ms"] < self.slo_ms(task) * _RECOVER_RATIO
+
+    def _event(self, task: str, action: str, reason: str, now: float) -> None:
+        self._events.append({"at": round(now, 1), "task": task, "action": action, "reason": reason})
+        print(f" [路由] {task}：{action}（{reason}）")
+
+    def route(self, task: str, primary: str) -> str:
+        """回傳這次 task 要用的模型"""
+        small = self.small_model(task)
+        now = time.time()
+        with self._lock:
+            state = self._tasks.setdefault(task, _TaskState())
+            if not small or small == primary:
+                chosen = primary
+            elif not state.degraded:
+                reason = self._at_risk(task, primary, state.since, now)
+                if reason:
+                    state.degraded, state.since = True, now
+                    self._event(task, f"降級 {primary} → {small}", reason, now)
+                chosen = small if state.degraded else primary
+            elif self._recovered(task, primary, state.since, now) \
+                    and self._inflight.get(primary, 0) < self.max_inflight:
+                state.degraded, state.since = False, now
+                self._event(task, f"恢復 {primary}", "延遲與錯誤率回到目標內", now)
+                chosen = primary
+            elif now - state.since >= _COOLDOWN_SECONDS and now - state.last_probe >= _PROBE_INTERVAL:
+                state.last_probe = now  # 試探：放一個請求給主要模型以取得新樣本
+                chosen = primary
+            else:
+                chosen = small
+            state.decisions[chosen] = state.decisions.get(chosen, 0) + 1
+            self._inflight[chosen] = self._inflight.get(chosen, 0) + 1
+        return chosen
+
+    def record(self, task: str, model: str, latency_ms: float, ok: bool) -> None:
+        """呼叫結束後回報（每次 route() 都要對應一次 record()）"""
+        with self._lock:
+            self._inflight[model] = max(0, self._inflight.get(model, 0) - 1)
+            window = self._windows.setdefault((task, model), _Window())
+            window.samples.append((time.time(), latency_ms, ok))
+            window.calls += 1
+            window.errors += 0 if ok else 1
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            tasks: Dict[str, Any] = {}
+            for task, state in self._tasks.items():
+                tasks[task] = {
+                    "sloMs": self.slo_ms(task),
+                    "smallModel": self.small_model(task),
+                    "degraded": state.degraded,
+                    "decisions": dict(state.decisions),
+                    "models": {
+                        model: {**w.summary(now), "calls": w.calls, "errors": w.errors}
+                        for (t, model), w in self._windows.items() if t == task
+                    },
+                }
+            return {"tasks": tasks, "inflight": dict(self._inflight), "events": list(self._events)}
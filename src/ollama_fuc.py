@@ -1,6 +1,20 @@
 
-import os, json, re, shutil, subprocess, random, time
-from typing import Any, Dict, List, Optional, Tuple
+import os, json, re, shutil, subprocess, random, time, hashlib, threading
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from keyword_matcher import KeywordMatcher, compile_tables
+import cache_utils
+import context_window
+from classify_batcher import ClassifyBatcher
+from combo_table import ComboTables
+import group_combos
+import menu_facets
+import menu_snapshot
+from model_router import ModelRouter
+from ollama_pool import OllamaPool
+from recommend_pool import RecommendPool
 
 # 修正導入路徑（src 目錄下要用 db.db_client）
 
@@ -8,6 +22,13 @@ from typing import Any, Dict, List, Optional, Tuple
 #從環境變數讀取設定
 DEFAULT_MODEL = os.environ.get("OLLAMA_MODEL", "gemma3:12b")
 OLLAMA_BIN = os.getenv("OLLAMA_BIN", "ollama")
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
+if not OLLAMA_HOST.startswith(("http://", "https://")):
+    OLLAMA_HOST = "http://" + OLLAMA_HOST
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # 模型載入後常駐多久
+OLLAMA_READY_TIMEOUT = float(os.getenv("OLLAMA_READY_TIMEOUT", "15"))  # 啟動 daemon 後最多等多久
+# OLLAMA_HOSTS 設定多台後端時改走 HTTP 並做負載平衡（見 ollama_pool），不需要本機 daemon
+POOL = OllamaPool.from_env()
 
 def _cli_available() -> bool:
     return shutil.which(OLLAMA_BIN) is not None #檢查路徑是否找到執行檔
@@ -18,6 +39,13 @@ def ensure_daemon() -> None:
     global _DAEMON_SPAWNED
     if _DAEMON_SPAWNED: #避免重複啟動
         return
+    if POOL is not None:  # 多後端模式：不在本機啟動 daemon；健康檢查在此或第一次挑後端時啟動（只會有一條）
+        POOL.start_health_checks()
+        _DAEMON_SPAWNED = True
+        return
+    if probe() is not None:  # daemon 已在跑（本機或 OLLAMA_HOST 指定的主機）就不必再啟動
+        _DAEMON_SPAWNED = True
+        return
     if not _cli_available():
         raise RuntimeError(f"找不到 ollama 可執行檔，請設定 PATH 或 OLLAMA_BIN（目前：{OLLAMA_BIN}）。")
     kwargs = dict(stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
@@ -35,10 +63,144 @@ def ensure_daemon() -> None:
         kwargs["startupinfo"] = startupinfo
         kwargs["creationflags"] = creationflags
     subprocess.Popen([OLLAMA_BIN, "serve"], **kwargs)
-    time.sleep(0.3) #給服務0.3秒時間啟動
+    if not wait_until_ready(): #輪詢直到 daemon 回應，取代固定 sleep
+        print(f" [ollama] {OLLAMA_READY_TIMEOUT:.0f}s 內未就緒，之後的請求仍會嘗試連線")
     _DAEMON_SPAWNED = True
 
 
+# daemon / 模型狀態（HTTP API，供 /health、/ready 回報）------------------------
+_STATUS_LOCK = threading.Lock()
+_STATUS: Dict[str, Any] = {"daemonUp": False, "probeMs": None, "probedAt": None, "warmup": {}}
+
+
+def _http_json(path: str, payload: Optional[Dict[str, Any]] = None, timeout: float = 2.0) -> Any:
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(
+        OLLAMA_HOST.rstrip("/") + path, data=data,
+        headers={"Content-Type": "application/json"} if data is not None else {},
+    )
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read().decode("utf-8") or "null")
+
+
+def probe(timeout: float = 1.0) -> Optional[float]:
+    """打一次 /api/version，回傳延遲毫秒；daemon 沒回應時回傳 None"""
+    start = time.perf_counter()
+    try:
+        _http_json("/api/version", timeout=timeout)
+        latency: Optional[float] = round((time.perf_counter() - start) * 1000, 1)
+    except (urllib.error.URLError, OSError, ValueError):
+        latency = None
+    with _STATUS_LOCK:
+        _STATUS.update(daemonUp=latency is not None, probeMs=latency, probedAt=time.time())
+    return latency
+
+
+def wait_until_ready(timeout: float = OLLAMA_READY_TIMEOUT) -> bool:
+    """輪詢 daemon 直到有回應（間隔由 50ms 逐步拉長到 500ms），逾時回傳 False"""
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    while True:
+        if probe() is not None:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+        delay = min(delay * 2, 0.5)
+
+
+def _model_tag(name: str) -> str:
+    return name if ":" in name else name + ":latest"
+
+
+def loaded_models() -> List[str]:
+    """目前常駐記憶體中的模型（/api/ps）"""
+    try:
+        data = _http_json("/api/ps")
+    except (urllib.error.URLError, OSError, ValueError):
+        return []
+    return [m.get("name") or m.get("model", "") for m in (data or {}).get("models", [])]
+
+
+def warm_models() -> List[str]:
+    """需要預熱的模型：主對話模型，以及有啟用時的偏好抽取 / 分類模型（可用 OLLAMA_WARM_MODELS 覆寫）"""
+    override = os.environ.get("OLLAMA_WARM_MODELS", "").strip()
+    if override:
+        return [m.strip() for m in override.split(",") if m.strip()]
+    models = [os.environ.get("OLLAMA_MODEL", DEFAULT_MODEL)]
+    if os.environ.get("USE_LLM_EXTRACTION", "false").lower() == "true":
+        models.append(os.environ.get("PREF_MODEL", "gemma3:latest"))
+    if os.environ.get("USE_LLM_CLASSIFICATION", "true").lower() == "true":
+        models.append(os.environ.get("CLASSIFY_MODEL", "gemma3:12b"))
+    return list(dict.fromkeys(models))
+
+
+def warm_up(models: Optional[List[str]] = None, timeout: float = 300.0) -> Dict[str, str]:
+    """確保 daemon 就緒後逐一載入模型（空 prompt 只載入不生成），並設定 keep_alive 常駐"""
+    try:
+        ensure_daemon()
+    except Exception as e:
+        print(f" [預熱] 無法啟動 ollama：{e}")
+        return {}
+    if POOL is not None:
+        result = POOL.warm_up(models or warm_models(), OLLAMA_KEEP_ALIVE, timeout=timeout)
+        with _STATUS_LOCK:
+            _STATUS["warmup"].update(result)
+        for key, state in result.items():
+            print(f" [預熱] {key}：{state}")
+        return result
+    result: Dict[str, str] = {}
+    for model in models or warm_models():
+        with _STATUS_LOCK:
+            _STATUS["warmup"][model] = "loading"
+        start = time.perf_counter()
+        try:
+            _http_json("/api/generate", {"model": model, "prompt": "", "keep_alive": OLLAMA_KEEP_ALIVE}, timeout=timeout)
+            result[model] = "loaded"
+            print(f" [預熱] {model} 載入完成（{time.perf_counter() - start:.1f}s）")
+        except Exception as e:
+            result[model] = f"error: {e}"
+            print(f" [預熱] {model} 載入失敗：{e}")
+        with _STATUS_LOCK:
+            _STATUS["warmup"][model] = result[model]
+    return result
+
+
+def readiness(max_probe_age: float = 5.0) -> Dict[str, Any]:
+    """daemon 是否在線、最近一次探測延遲、各預熱模型是否常駐；probe 結果超過 max_probe_age 秒才重新探測"""
+    if POOL is not None:
+        if any(b.last_check is None or time.time() - b.last_check > max_probe_age for b in POOL.backends):
+            POOL.check_health()
+        with _STATUS_LOCK:
+            warmup = dict(_STATUS["warmup"])
+        pool = POOL.stats()
+        backends, available = pool["backends"], pool["available"]
+        models = {
+            f"{b['url']} {m}": {"warmup": warmup.get(f"{b['url']} {m}", "pending"), "available": b["available"]}
+            for b in backends for m in warm_models()
+        }
+        # 被剔除的後端不影響就緒；可用的後端上每個模型都預熱完成才算就緒
+        return {
+            "daemonUp": available > 0,
+            "probeMs": None,
+            "pool": backends,
+            "models": models,
+            "ready": available > 0 and all(v["warmup"] == "loaded" for v in models.values() if v["available"]),
+        }
+    with _STATUS_LOCK:
+        probed_at = _STATUS["probedAt"]
+    if probed_at is None or time.time() - probed_at > max_probe_age:
+        probe()
+    with _STATUS_LOCK:
+        status = {k: v for k, v in _STATUS.items() if k != "warmup"}
+        warmup = dict(_STATUS["warmup"])
+    resident = {_model_tag(m) for m in loaded_models()} if status["daemonUp"] else set()
+    models = {m: {"warmup": warmup.get(m, "pending"), "loaded": _model_tag(m) in resident} for m in warm_models()}
+    status["models"] = models
+    status["ready"] = bool(status["daemonUp"]) and all(m["loaded"] for m in models.values())
+    return status
+
+
 #呼叫外部的 ollama 可執行檔並回傳結果
 def _cli_run(args: List[str], input_text: Optional[str] = None, timeout: float = 120.0) -> str:
     try:
@@ -70,9 +232,10 @@ def _cli_run(args: List[str], input_text: Optional[str] = None, timeout: float =
 
 
 #把一串對話訊息 messages組裝成一段適合丟給 CLI/文字模型的提示字串
-def _build_prompt_from_messages(messages: List[Dict[str, str]]) -> str:
+#（超過 token 上限時只留 system 訊息與最近的幾則，見 context_window.fit_messages）
+def _build_prompt_from_messages(messages: List[Dict[str, str]], max_tokens: Optional[int] = None) -> str:
     parts: List[str] = []
-    for m in messages:
+    for m in context_window.fit_messages(messages, max_tokens or context_window.CONTEXT_MAX_TOKENS):
         role = m.get("role", "user")
         content = m.get("content", "")
         if role == "system":
@@ -83,11 +246,33 @@ def _build_prompt_from_messages(messages: List[Dict[str, str]]) -> str:
             parts.append(f"使用者: {content}")
     parts.append("助理:")
     return "\n".join(parts)
-#把多輪對話messages轉成一段提示字串，再用CLI方式呼叫Ollama
-def chat(messages: List[Dict[str, str]], model: Optional[str] = None, timeout: float = 180.0) -> str:
+#把多輪對話messages轉成一段提示字串，再用CLI方式呼叫Ollama（有設定 OLLAMA_HOSTS 時改送叢集中的後端）
+#task（reply / pref / classify）有給時交由 ROUTER 依延遲、錯誤率決定用主要模型或備援小模型
+#session 有給時叢集會盡量把同一 session 送到同一台後端
+ROUTER = ModelRouter()
+
+
+def _generate(prompt: str, mdl: str, timeout: float, session: Optional[str]) -> str:
+    if POOL is not None:
+        return POOL.generate(mdl, prompt, timeout=timeout, session=session, keep_alive=OLLAMA_KEEP_ALIVE)
+    return _cli_run(["run", "--keepalive", OLLAMA_KEEP_ALIVE, mdl], input_text=prompt, timeout=timeout)
+
+
+def chat(messages: List[Dict[str, str]], model: Optional[str] = None, timeout: float = 180.0,
+         task: Optional[str] = None, session: Optional[str] = None) -> str:
     mdl = model or DEFAULT_MODEL
     prompt = _build_prompt_from_messages(messages)
-    return _cli_run(["run", mdl], input_text=prompt, timeout=timeout)
+    if task is None:
+        return _generate(prompt, mdl, timeout, session)
+    mdl = ROUTER.route(task, mdl)
+    start = time.perf_counter()
+    ok = False
+    try:
+        out = _generate(prompt, mdl, timeout, session)
+        ok = True
+        return out
+    finally:
+        ROUTER.record(task, mdl, (time.perf_counter() - start) * 1000, ok)
 
 def _extract_json(text: str) -> Any:
     try:
@@ -102,18 +287,183 @@ def _extract_json(text: str) -> Any:
             return None
     return None
 
-def recommend(menu: Dict[str, Any], prefs: Optional[Dict[str, Any]] = None, top_k: int = 5, model: Optional[str] = None) -> Dict[str, Any]:
+# 關鍵字分類表：依序判斷（先命中的類型優先），與 LLM 分類的代碼一致
+_ITEM_TYPE_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    # 飲料關鍵字（包含酒類）
+    "drink": ("茶", "飲料", "果汁", "咖啡", "奶茶", "可樂", "汽水", "豆漿", "拿鐵", "摩卡", "雪碧", "芬達", "氣泡", "啤酒", "紅酒", "白酒", "威士忌", "酒", "beer", "wine"),
+    # 配菜/小食關鍵字（優先於主食判斷）
+    "side": ("薯條", "雞塊", "魚圈", "蝦塊", "上校雞塊", "黃金", "青花椒", "沙拉", "蔬菜棒"),
+    # 甜點關鍵字
+    "dessert": ("冰淇淋", "蛋糕", "甜點", "派", "可頌", "甜甜圈", "煉乳", "蛋撻", "起司", "大福", "QQ球", "比司吉"),
+    # 主食關鍵字（漢堡、吐司、貝果等）
+    "main": ("堡", "漢堡", "burger", "吐司", "貝果", "三明治", "套餐", "義大利麵", "燉飯", "米堡", "麵", "飯", "獨享餐"),
+}
+_ITEM_TYPE_ORDER = ("drink", "side", "dessert", "main")
+
+# preferredDish → 菜名需包含的關鍵字
+_PREFERRED_DISH_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "漢堡": ("堡", "漢堡", "burger", "芝加哥"),
+    "吐司": ("吐司", "toast"),
+    "貝果": ("貝果", "bagel"),
+    "套餐": ("套餐", "combo"),
+}
+
+_EXCLUDE_LABEL = "exclude"
+
+
+def _item_matcher(exclude_keywords: Tuple[str, ...] = ()) -> KeywordMatcher:
+    """分類 / 偏好 / 排除關鍵字編譯成同一個自動機，每個菜名只掃一次
+
+    菜名會先轉小寫，所以關鍵字也以小寫比對。
+    """
+    tables = [(t, tuple(kw.lower() for kw in _ITEM_TYPE_KEYWORDS[t])) for t in _ITEM_TYPE_ORDER]
+    tables += [(f"pref:{dish}", kws) for dish, kws in _PREFERRED_DISH_KEYWORDS.items()]
+    if exclude_keywords:
+        tables.append((_EXCLUDE_LABEL, exclude_keywords))
+    return compile_tables(tuple(tables))
+
+
+def item_type_from_labels(labels: Set[str]) -> str:
+    for t in _ITEM_TYPE_ORDER:
+        if t in labels:
+            return t
+    return "other"
+
+
+def keyword_item_type(name: str) -> str:
+    """只用關鍵字判斷菜名的類型（main / side / drink / dessert / other）"""
+    return item_type_from_labels(_item_matcher().labels(name.lower()))
+
+
+# 菜品 LLM 分類：各次 recommend() 與菜單 enrichment 的未分類菜名合併、切塊後平行送出（見 classify_batcher）
+# recommend() 最多等 CLASSIFY_DEADLINE 秒，未完成的菜品先用關鍵字分類
+CLASSIFY_DEADLINE = float(os.environ.get("CLASSIFY_DEADLINE", "8"))
+CLASSIFIER = cache_utils.register(ClassifyBatcher(
+    lambda prompt, model: chat([{"role": "user", "content": prompt}], model=model, timeout=30.0, task="classify")
+))
+
+
+# 連鎖店套餐組合表：發佈快照時預先算好（COMBO_TABLE=true），有預算的請求改為 bisect 查表（見 combo_table）
+COMBO_TABLE = os.environ.get("COMBO_TABLE", "false").lower() == "true"
+COMBO_TABLE_CHOICES = int(os.environ.get("COMBO_TABLE_CHOICES", "3"))  # 從最佳幾套中依 seed 挑一套
+COMBO_TABLES = cache_utils.register(ComboTables(lambda name: _item_matcher().labels(name), item_type_from_labels))
+
+
+# 推薦結果快取：鍵 = (菜單版本, 偏好指紋, seed, top_k, 分類方式)
+# 菜單版本取自已發佈的快照（內容雜湊），菜單換掉後舊結果由 prune_recommendations() 清掉
+_RECOMMEND_CACHE = cache_utils.register(
+    cache_utils.LRUCache(int(os.environ.get("RECOMMEND_CACHE_SIZE", "512")), name="recommendation")
+)
+# recommend() 實際會讀的偏好欄位（weights、notes 不影響結果，不列入指紋）
+_RECOMMEND_PREF_KEYS = (
+    "budget", "excludes", "spiceLevel", "maxItemPrice", "vegetarian", "noMarketPrice",
+    "preferredDish", "needDrink", "people", "cuisine",
+)
+
+
+def prefs_fingerprint(prefs: Dict[str, Any]) -> str:
+    """偏好的標準化雜湊；只看 recommend() 用得到的欄位（needDrink 為 None 與未設定意義不同，故以 in 判斷）"""
+    canonical = {k: prefs[k] for k in _RECOMMEND_PREF_KEYS if k in prefs}
+    raw = json.dumps(canonical, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _classification_mode() -> str:
+    if os.environ.get("USE_LLM_CLASSIFICATION", "true").lower() == "true":
+        return "llm:" + os.environ.get("CLASSIFY_MODEL", "gemma3:12b")
+    return "keyword"
+
+
+def prune_recommendations(valid_versions: Set[str]) -> int:
+    """菜單發佈新版後呼叫：移除用到已不存在菜單版本的快取，回傳移除筆數"""
+    return _RECOMMEND_CACHE.prune(lambda key: all(v in valid_versions for v in key[0]))
+
+
+# 推薦過程的除錯輸出；跨餐廳推薦一次跑上百家時以 quiet=True 關閉（各執行緒各自設定）
+_QUIET = threading.local()
+
+
+def _log(*args: Any) -> None:
+    if not getattr(_QUIET, "on", False):
+        print(*args)
+
+
+def _recommend_in_worker(menu: Dict[str, Any], prefs: Dict[str, Any], top_k: int, model: Optional[str],
+                         seed: Optional[int]) -> Dict[str, Any]:
+    """工作行程中執行（見 recommend_pool）：不經推薦快取（快取在主行程），也不輸出除錯訊息"""
+    _QUIET.on = True
+    return _recommend(menu, prefs, top_k, model, random.Random(seed))
+
+
+def _warm_indexes(snapshot: Any) -> None:
+    """fork 工作行程前先建好各餐廳的 facet 索引，工作行程以 copy-on-write 共用"""
+    for rs in snapshot.restaurants.values():
+        menu_facets.index_for(rs.source, _item_matcher().labels, item_type_from_labels)
+
+
+# 多行程推薦（RECOMMEND_POOL=true）：快照發佈後 fork 工作行程，推薦快取未命中時交給工作行程計算
+RECOMMEND_POOL = cache_utils.register(RecommendPool(_recommend_in_worker, prepare=_warm_indexes))
+
+
+def _compute(menu: Dict[str, Any], prefs: Dict[str, Any], top_k: int, model: Optional[str],
+             seed: Optional[int]) -> Dict[str, Any]:
+    # LLM 分類主要在等 I/O，且分類批次的背景執行緒不會跟著 fork，只有關鍵字分類才交給工作行程
+    if RECOMMEND_POOL.enabled and _classification_mode() == "keyword":
+        rec = RECOMMEND_POOL.run(menu, prefs, top_k, model, seed)
+        if rec is not None:
+            return rec
+    return _recommend(menu, prefs, top_k, model, random.Random(seed))
+
+
+def recommend(
+    menu: Dict[str, Any],
+    prefs: Optional[Dict[str, Any]] = None,
+    top_k: int = 5,
+    model: Optional[str] = None,
+    seed: Optional[int] = None,
+    quiet: bool = False,
+) -> Dict[str, Any]:
     """
     從傳入的 menu 參數（爬蟲抓取的菜單）進行推薦，而不是從資料庫查詢。
     這樣才能推薦正確的餐廳菜色。
+
+    seed：隨機挑選用的種子（通常每個 session 一個）；給定 seed 時結果可重現，
+    且菜單已發佈於快照中時會依 (菜單版本, 偏好指紋, seed, top_k) 快取。
+    quiet：不輸出除錯訊息。
     """
+    previous = getattr(_QUIET, "on", False)
+    _QUIET.on = quiet
+    try:
+        return _recommend_cached(menu, prefs or {}, top_k, model, seed)
+    finally:
+        _QUIET.on = previous
+
+
+def _recommend_cached(menu: Dict[str, Any], prefs: Dict[str, Any], top_k: int, model: Optional[str],
+                      seed: Optional[int]) -> Dict[str, Any]:
+    versions = menu_snapshot.versions_of(menu) if seed is not None else ()
+    if not versions:
+        return _compute(menu, prefs, top_k, model, seed)
+
+    key = (versions, prefs_fingerprint(prefs), seed, top_k, _classification_mode())
+    rec = _RECOMMEND_CACHE.get(key)
+    if rec is not None:
+        _log(f" [推薦快取] 命中（seed={seed}）")
+    else:
+        rec = _compute(menu, prefs, top_k, model, seed)
+        if not rec["meta"].get("classificationPending"):
+            _RECOMMEND_CACHE.put(key, rec)
+    # 呼叫端可能修改結果，回傳副本
+    return json.loads(json.dumps(rec, ensure_ascii=False))
+
+
+def _recommend(menu: Dict[str, Any], prefs: Dict[str, Any], top_k: int, model: Optional[str],
+               rng: random.Random) -> Dict[str, Any]:
     # 調試：查看傳入的菜單結構
-    print(f"\n [DEBUG] recommend() 被呼叫")
-    print(f" [DEBUG] menu 的 keys: {list(menu.keys()) if isinstance(menu, dict) else 'NOT A DICT'}")
+    _log(f"\n [DEBUG] recommend() 被呼叫")
+    _log(f" [DEBUG] menu 的 keys: {list(menu.keys()) if isinstance(menu, dict) else 'NOT A DICT'}")
     if "restaurants" in menu:
-        print(f" [DEBUG] 餐廳列表: {list(menu['restaurants'].keys())}")
-    
-    prefs = prefs or {}
+        _log(f" [DEBUG] 餐廳列表: {list(menu['restaurants'].keys())}")
 
     # 1) 解析偏好
     budget: Optional[float] = None
@@ -131,46 +481,13 @@ def recommend(menu: Dict[str, Any], prefs: Optional[Dict[str, Any]] = None, top_
     if prefs.get("spiceLevel") == "不辣":
         exclude_keywords.append("辣")
 
-    # 2) 從 menu 中提取所有菜品
-    all_items: List[Dict[str, Any]] = []
-    
-    # 支援兩種菜單格式：
-    # 格式1: {"restaurants": {"餐廳名": {"categories": {"分類": {"items": [...]}}}}}
-    # 格式2: {"categories": [{"name": "分類", "items": [...]}]}
-    
-    if "restaurants" in menu and isinstance(menu["restaurants"], dict):
-        # 格式1: 從 restaurants 中提取
-        for restaurant_name, restaurant_data in menu["restaurants"].items():
-            if isinstance(restaurant_data, dict) and "categories" in restaurant_data:
-                categories = restaurant_data["categories"]
-                if isinstance(categories, dict):
-                    # categories 是字典格式
-                    for cat_name, cat_data in categories.items():
-                        if isinstance(cat_data, dict) and "items" in cat_data:
-                            for item in cat_data["items"]:
-                                if isinstance(item, dict):
-                                    all_items.append({
-                                        "name": item.get("name", ""),
-                                        "price": item.get("price"),
-                                        "category": cat_name,
-                                        "restaurant": restaurant_name
-                                    })
-    elif "categories" in menu and isinstance(menu["categories"], list):
-        # 格式2: 直接從 categories 列表提取
-        for cat in menu["categories"]:
-            if isinstance(cat, dict) and "items" in cat:
-                cat_name = cat.get("name", "未分類")
-                for item in cat["items"]:
-                    if isinstance(item, dict):
-                        all_items.append({
-                            "name": item.get("name", ""),
-                            "price": item.get("price"),
-                            "category": cat_name
-                        })
-
-    print(f" [DEBUG] 從菜單提取了 {len(all_items)} 個項目")
+    # 2) 從 menu 中提取所有菜品（攤平、關鍵字標籤、facet bitset 依菜單快取，只建一次）
+    facets = menu_facets.index_for(menu, _item_matcher().labels, item_type_from_labels)
+    all_items = facets.items
+
+    _log(f" [DEBUG] 從菜單提取了 {len(all_items)} 個項目")
     if all_items:
-        print(f" [DEBUG] 前3個項目: {[item['name'] for item in all_items[:3]]}")
+        _log(f" [DEBUG] 前3個項目: {[item['name'] for item in all_items[:3]]}")
 
     if not all_items:
         return {
@@ -185,14 +502,18 @@ def recommend(menu: Dict[str, Any], prefs: Optional[Dict[str, Any]] = None, top_
             }
         }
 
-    # 3) 過濾：排除不想要的項目
-    filtered_items = []
-    for item in all_items:
-        name = str(item.get("name", "")).lower()
-        # 檢查是否包含排除關鍵字
-        should_exclude = any(kw in name for kw in exclude_keywords)
-        if not should_exclude:
-            filtered_items.append(item)
+    # 3) 過濾：排除不想要的項目（facet bitset 運算，不再逐項比對菜名）
+    max_item_price = prefs.get("maxItemPrice")
+    mask = facets.filter(
+        excludes=exclude_keywords,
+        vegetarian=bool(prefs.get("vegetarian")),
+        no_spicy=prefs.get("spiceLevel") == "不辣",  # 菜名的「辣」已在排除字中，這裡再涵蓋 enrichment 標為辣的品項
+        no_market_price=bool(prefs.get("noMarketPrice")),
+        max_price=float(max_item_price) if isinstance(max_item_price, (int, float)) else None,
+    )
+    filtered_items = facets.select(mask)
+    # 分類與偏好比對沿用建索引時算好的標籤
+    matcher = _item_matcher()
 
     if not filtered_items:
         return {
@@ -209,6 +530,8 @@ def recommend(menu: Dict[str, Any], prefs: Optional[Dict[str, Any]] = None, top_
 
     # 4) 價格提取函數
     def get_price(item: Dict[str, Any]) -> float:
+        if item.get("priceValue") is not None:  # enrichment 已算好的數值價格
+            return float(item["priceValue"])
         price = item.get("price")
         if price is None:
             return 999999.0  # 無價格的排最後
@@ -228,105 +551,32 @@ def recommend(menu: Dict[str, Any], prefs: Optional[Dict[str, Any]] = None, top_
             return 999999.0
 
     # 5) 智能分類：將菜品分為主食、飲料、甜點、配菜、其他
+    classification_pending = 0
+
     def classify_items_batch_with_llm(items: List[Dict[str, Any]]) -> Dict[str, str]:
-        """ 使用 LLM 批次智能分類菜品（一次處理多個，提升效率）"""
-        try:
-            # 使用更小更快的模型
-            model = os.environ.get("CLASSIFY_MODEL", "gemma3:12b")
-            
-            # 建立菜品列表字串
-            items_text = "\n".join([f"{i+1}. {item.get('name', '')}" for i, item in enumerate(items)])
-            
-            prompt = f"""請分類以下菜品，每個菜品只回答一個分類代碼：
-- main: 主食/主餐（漢堡、套餐、吐司、貝果、米飯、麵食等）
-- side: 配菜/小食（薯條、雞塊、魚圈、蝦塊、沙拉等）
-- drink: 飲料（茶、咖啡、可樂、果汁、奶茶、啤酒、紅酒、白酒、各種酒類等）
-- dessert: 甜點（蛋撻、蛋糕、冰淇淋、派等）
-- other: 其他
-
-重要：所有酒類（啤酒、紅酒、白酒、威士忌等）都應分類為 drink（飲料）
-
-菜品列表：
-{items_text}
-
-請依序回答每個菜品的分類，每行一個代碼（只寫 main/side/drink/dessert/other），範例：
-main
-drink
-side
-"""
-            
-            response = chat([{"role": "user", "content": prompt}], model=model, timeout=30.0)
-            
-            # 解析回應
-            lines = [line.strip().lower() for line in response.split('\n') if line.strip()]
-            result_map = {}
-            
-            for i, item in enumerate(items):
-                if i < len(lines) and lines[i] in ["main", "side", "drink", "dessert", "other"]:
-                    result_map[item.get("name", "")] = lines[i]
-                else:
-                    # 如果 LLM 回覆不完整，使用關鍵字分類
-                    result_map[item.get("name", "")] = classify_item_keyword(item)
-            
-            return result_map
-            
-        except Exception as e:
-            print(f" [LLM批次分類] 錯誤: {e}，降級使用關鍵字分類")
-            # 降級：使用關鍵字分類
-            return {item.get("name", ""): classify_item_keyword(item) for item in items}
-    
+        """ 使用 LLM 批次智能分類菜品（交給 CLASSIFIER 切塊平行處理，並與其他請求合併）
+
+        最多等 CLASSIFY_DEADLINE 秒：已回來的部分直接用，其餘先用關鍵字分類，LLM 結果之後寫入分類快取。
+        """
+        nonlocal classification_pending
+        model = os.environ.get("CLASSIFY_MODEL", "gemma3:12b")
+        labels = CLASSIFIER.classify((str(item.get("name", "")) for item in items), model, timeout=CLASSIFY_DEADLINE)
+        classification_pending = sum(1 for label in labels.values() if label is None)
+        # 逾時或 LLM 回覆不完整的菜品，使用關鍵字分類
+        return {item.get("name", ""): labels.get(str(item.get("name", ""))) or classify_item_keyword(item) for item in items}
+
     def classify_item_with_llm(item: Dict[str, Any]) -> str:
         """ 使用 LLM 智能分類單個菜品（僅在必要時使用）"""
         name = str(item.get("name", ""))
-        
-        try:
-            model = os.environ.get("CLASSIFY_MODEL", "gemma3:12b")
-            
-            prompt = f"""請分類這道菜品屬於哪一類，只回答一個代碼：
-- main: 主食/主餐（漢堡、套餐、吐司、貝果、米飯、麵食等）
-- side: 配菜/小食（薯條、雞塊、魚圈、蝦塊、沙拉等）
-- drink: 飲料（茶、咖啡、可樂、果汁、奶茶、啤酒、紅酒、白酒、各種酒類等）
-- dessert: 甜點
-- other: 其他
-
-重要：所有酒類都應分類為 drink（飲料）
+        model = os.environ.get("CLASSIFY_MODEL", "gemma3:12b")
+        return CLASSIFIER.classify([name], model, timeout=20.0).get(name) or classify_item_keyword(item)
 
-菜品名稱：{name}
-
-只回答一個代碼（main/side/drink/dessert/other）："""
-            
-            response = chat([{"role": "user", "content": prompt}], model=model, timeout=20.0)
-            result = response.strip().lower()
-            
-            if result in ["main", "side", "drink", "dessert", "other"]:
-                return result
-            else:
-                return classify_item_keyword(item)
-        except Exception as e:
-            print(f" [LLM分類] 錯誤: {e}，使用關鍵字分類")
-            return classify_item_keyword(item)
-    
     def classify_item_keyword(item: Dict[str, Any]) -> str:
         """關鍵字分類（作為備用）"""
-        name = str(item.get("name", "")).lower()
-        
-        # 飲料關鍵字（包含酒類）
-        if any(kw in name for kw in ["茶", "飲料", "果汁", "咖啡", "奶茶", "可樂", "汽水", "豆漿", "拿鐵", "摩卡", "雪碧", "芬達", "氣泡", "啤酒", "紅酒", "白酒", "威士忌", "酒", "beer", "wine"]):
-            return "drink"
-        
-        # 配菜/小食關鍵字（優先於主食判斷）
-        if any(kw in name for kw in ["薯條", "雞塊", "魚圈", "蝦塊", "上校雞塊", "黃金", "青花椒", "沙拉", "蔬菜棒"]):
-            return "side"
-        
-        # 甜點關鍵字
-        if any(kw in name for kw in ["冰淇淋", "蛋糕", "甜點", "派", "可頌", "甜甜圈", "煉乳", "蛋撻", "起司", "大福", "QQ球", "比司吉"]):
-            return "dessert"
-        
-        # 主食關鍵字（漢堡、吐司、貝果等）
-        if any(kw in name for kw in ["堡", "漢堡", "burger", "吐司", "貝果", "三明治", "套餐", "義大利麵", "燉飯", "米堡", "麵", "飯", "獨享餐"]):
-            return "main"
-        
-        return "other"
+        labels = item.get("_labels")
+        if labels is None:
+            labels = matcher.labels(str(item.get("name", "")).lower())
+        return item_type_from_labels(labels)
     
     def classify_item(item: Dict[str, Any]) -> str:
         """主要入口：優先使用 LLM，失敗時降級到關鍵字"""
@@ -341,35 +591,77 @@ side
     # 檢查菜品是否符合使用者偏好
     def matches_preference(item: Dict[str, Any]) -> bool:
         preferred = prefs.get("preferredDish")
-        if not preferred:
-            return True  # 沒有指定偏好，都符合
-        
-        name = str(item.get("name", "")).lower()
+        if not preferred or preferred not in _PREFERRED_DISH_KEYWORDS:
+            return True  # 沒有指定偏好（或無對應關鍵字），都符合
         
-        if preferred == "漢堡":
-            return any(kw in name for kw in ["堡", "漢堡", "burger", "芝加哥"])
-        elif preferred == "吐司":
-            return "吐司" in name or "toast" in name
-        elif preferred == "貝果":
-            return "貝果" in name or "bagel" in name
-        elif preferred == "套餐":
-            return "套餐" in name or "combo" in name
-        
-        return True
+        labels = item.get("_labels")
+        if labels is None:
+            labels = matcher.labels(str(item.get("name", "")).lower())
+        return f"pref:{preferred}" in labels
 
     # 使用批次 LLM 分類所有菜品（更高效）
-    print(f" [分類] 開始智能分類 {len(filtered_items)} 個菜品...")
+    _log(f" [分類] 開始智能分類 {len(filtered_items)} 個菜品...")
     
     USE_LLM_CLASSIFICATION = os.environ.get("USE_LLM_CLASSIFICATION", "true").lower() == "true"
-    
-    if USE_LLM_CLASSIFICATION:
+
+    # 已 enrichment 的菜品直接查表，只有剩下的才需要分類
+    classification_map = {item.get("name", ""): item["type"] for item in filtered_items if item.get("type")}
+    unclassified = [item for item in filtered_items if not item.get("type")]
+
+    # 套餐組合表：每人一套（主食不重複），每套在 預算 / 人數 內，從最佳 COMBO_TABLE_CHOICES 套中依 seed 挑選
+    # 組合表的分類來自 facet 索引，只有與這次分類方式一致（已 enrichment 或關鍵字分類）時才使用，查表時不必再分類
+    # 多人聚餐（GROUP_COMBO_MIN_PEOPLE 以上）改走下方的組合搜尋
+    people = prefs.get("people")
+    table = COMBO_TABLES.for_menu(menu) if COMBO_TABLE and budget and prefs.get("needDrink", True) else None
+    if table is not None and (not unclassified or not USE_LLM_CLASSIFICATION) \
+            and not (isinstance(people, int) and people >= group_combos.GROUP_MIN_PEOPLE):
+        sets = people if isinstance(people, int) and people > 1 else 1
+        prefer = 0
+        if prefs.get("preferredDish") is not None:
+            prefer = sum(1 << i for i in menu_facets.iter_bits(mask) if matches_preference(facets.items[i]))
+        picks: List[int] = []
+        avoid = 0
+        for _ in range(sets):
+            hits = table.query(budget / sets, mask, prefer=prefer, avoid=avoid, limit=COMBO_TABLE_CHOICES)
+            if not hits:
+                break
+            j = rng.choice(hits)
+            picks.append(j)
+            avoid |= 1 << table.ids[j][0]
+        _log(f" [組合表] {len(table)} 套中挑出 {len(picks)} 套（每套 ≤ ${budget / sets:.0f}）")
+        if picks:
+            meta = {
+                "budget": budget,
+                "people": people,
+                "needDrink": prefs.get("needDrink", False),
+                "spiceLevel": prefs.get("spiceLevel"),
+                "cuisine": prefs.get("cuisine"),
+                "comboTable": {"combos": len(table), "sets": len(picks)},
+            }
+            return {
+                "items": [
+                    {
+                        "name": facets.items[i].get("name"),
+                        "price": get_price(facets.items[i]),
+                        "category": facets.items[i].get("category", "未分類"),
+                        "reason": group_combos.REASONS[t],
+                    }
+                    for j in picks for i, t in zip(table.ids[j], table.types[j])
+                ],
+                "notes": "",
+                "meta": meta,
+            }
+
+    if not unclassified:
+        _log(f" [分類] 全部 {len(classification_map)} 項已預先分類")
+    elif USE_LLM_CLASSIFICATION:
         # 批次分類：一次處理所有菜品
-        classification_map = classify_items_batch_with_llm(filtered_items)
-        print(f" [分類] LLM 批次分類完成")
+        classification_map.update(classify_items_batch_with_llm(unclassified))
+        _log(f" [分類] LLM 批次分類完成")
     else:
         # 使用關鍵字分類
-        classification_map = {item.get("name", ""): classify_item_keyword(item) for item in filtered_items}
-        print(f" [分類] 關鍵字分類完成")
+        classification_map.update({item.get("name", ""): classify_item_keyword(item) for item in unclassified})
+        _log(f" [分類] 關鍵字分類完成")
     
     # 將菜品分類到不同列表
     preferred_main = []
@@ -397,7 +689,7 @@ side
         else:
             other_items.append(item)
     
-    print(f" [分類結果] 主食:{len(preferred_main)+len(other_main)} 飲料:{len(drink_items)} 配菜:{len(side_items)} 甜點:{len(dessert_items)} 其他:{len(other_items)}")
+    _log(f" [分類結果] 主食:{len(preferred_main)+len(other_main)} 飲料:{len(drink_items)} 配菜:{len(side_items)} 甜點:{len(dessert_items)} 其他:{len(other_items)}")
     
     # 合併主食：優先推薦符合偏好的
     main_items = preferred_main + other_main
@@ -406,16 +698,14 @@ side
     # - 如果有偏好，preferred_main 保持順序（或按價格排），other_main 按價格排
     # - 如果沒有偏好，所有主食按價格排
     has_preference = prefs.get("preferredDish") is not None
-    
-    import random
-    
+
     if has_preference and preferred_main:
         # 有偏好：符合偏好的按價格排序，其他的也按價格排序
         preferred_main_sorted = sorted(preferred_main, key=get_price)
         other_main_sorted = sorted(other_main, key=get_price)
         # 優先選符合偏好的，然後才是其他的
         main_items_sorted = preferred_main_sorted + other_main_sorted
-        print(f" [推薦] 有偏好，優先推薦符合偏好的主食（共 {len(preferred_main)} 項）")
+        _log(f" [推薦] 有偏好，優先推薦符合偏好的主食（共 {len(preferred_main)} 項）")
     else:
         # 沒有偏好：按價格排序後添加隨機性
         main_items_sorted = sorted(main_items, key=get_price)
@@ -423,7 +713,7 @@ side
         # 添加隨機性：從前面較便宜的選項中隨機選擇
         if len(main_items_sorted) > 5:
             top_items = main_items_sorted[:min(15, len(main_items_sorted))]
-            random.shuffle(top_items)
+            rng.shuffle(top_items)
             main_items_sorted = top_items + main_items_sorted[15:]
     
     # 對其他類別也添加隨機性，避免每次推薦相同組合
@@ -434,7 +724,7 @@ side
         sorted_items = sorted(items_list, key=get_price)
         # 從前 10 個中隨機選擇順序
         top_items = sorted_items[:min(10, len(sorted_items))]
-        random.shuffle(top_items)
+        rng.shuffle(top_items)
         return top_items + sorted_items[10:]
     
     drink_items_sorted = add_randomness(drink_items)
@@ -443,9 +733,35 @@ side
     other_items_sorted = sorted(other_items, key=get_price)  # 其他類別不需要隨機
 
     if preferred_main:
-        print(f" [推薦] 符合偏好的前3項: {[item['name'] for item in preferred_main[:3]]}")
+        _log(f" [推薦] 符合偏好的前3項: {[item['name'] for item in preferred_main[:3]]}")
     if main_items_sorted:
-        print(f" [推薦] 將推薦的主食前3項: {[item['name'] for item in main_items_sorted[:3]]}")
+        _log(f" [推薦] 將推薦的主食前3項: {[item['name'] for item in main_items_sorted[:3]]}")
+
+    # 多人聚餐：道數依人數配置，一次找出數套彼此不同的組合（見 group_combos），不受 top_k 限制
+    if isinstance(people, int) and people >= group_combos.GROUP_MIN_PEOPLE:
+        combos, combo_stats = group_combos.search(
+            {"main": main_items, "side": side_items, "drink": drink_items, "dessert": dessert_items},
+            people,
+            get_price,
+            budget=budget or None,
+            need_drink=bool(prefs.get("needDrink", True)),
+            bonus=lambda item: 0.5 if has_preference and matches_preference(item) else 0.0,
+            rng=rng,
+        )
+        _log(f" [多人組合] {people} 人，道數 {combo_stats['slots']}，找到 {len(combos)} 套"
+              f"（{combo_stats['elapsedMs']}ms{'，逾時' if combo_stats['timedOut'] else ''}）")
+        if combos:
+            meta = {
+                "budget": budget,
+                "people": people,
+                "needDrink": prefs.get("needDrink", False),
+                "spiceLevel": prefs.get("spiceLevel"),
+                "cuisine": prefs.get("cuisine"),
+                "comboSearch": combo_stats,
+            }
+            if classification_pending:
+                meta["classificationPending"] = classification_pending
+            return {"items": combos[0]["items"], "notes": "", "meta": meta, "alternatives": combos[1:]}
 
     # 6) 智能選擇：主食 + 配菜/飲料 組合
     selected_items: List[Dict[str, Any]] = []
@@ -453,7 +769,7 @@ side
     
     # 調試輸出預算
     if budget and isinstance(budget, (int, float)):
-        print(f" [預算控制] 使用者預算: ${budget:.0f}")
+        _log(f" [預算控制] 使用者預算: ${budget:.0f}")
 
     # 優先選擇 1-2 個主食（套餐/主餐）
     main_count = 0
@@ -467,12 +783,12 @@ side
             if main_count == 0:
                 max_first_main = budget * 0.4
                 if price > max_first_main:
-                    print(f" [預算控制] 跳過主食 {item.get('name')} (${price:.0f}) - 超過第一主食限額 ${max_first_main:.0f}")
+                    _log(f" [預算控制] 跳過主食 {item.get('name')} (${price:.0f}) - 超過第一主食限額 ${max_first_main:.0f}")
                     continue
             else:
                 max_total_main = budget * 0.65
                 if total_cost + price > max_total_main:
-                    print(f" [預算控制] 跳過主食 {item.get('name')} (${price:.0f}) - 主食總額會超過 ${max_total_main:.0f}")
+                    _log(f" [預算控制] 跳過主食 {item.get('name')} (${price:.0f}) - 主食總額會超過 ${max_total_main:.0f}")
                     continue
         
         selected_items.append({
@@ -488,7 +804,7 @@ side
         if main_count >= 2:  # 最多選 2 個主食
             break
 
-    print(f" [推薦] 已選主食 {main_count} 項，目前花費 ${total_cost:.0f}")
+    _log(f" [推薦] 已選主食 {main_count} 項，目前花費 ${total_cost:.0f}")
 
     # 選擇 0-1 個配菜（如果有預算空間）
     side_count = 0
@@ -499,7 +815,7 @@ side
             # 嚴格檢查：加入此配菜後不能超過預算
             max_with_side = budget * 0.90  # 最多用到 90% 預算（留 10% 緩衝）
             if total_cost + price > max_with_side:
-                print(f" [預算控制] 跳過配菜 {item.get('name')} (${price:.0f}) - 會超過 90% 預算限額")
+                _log(f" [預算控制] 跳過配菜 {item.get('name')} (${price:.0f}) - 會超過 90% 預算限額")
                 continue
         
         selected_items.append({
@@ -516,7 +832,7 @@ side
             break
 
     if side_count > 0:
-        print(f" [推薦] 已選配菜 {side_count} 項，目前花費 ${total_cost:.0f}")
+        _log(f" [推薦] 已選配菜 {side_count} 項，目前花費 ${total_cost:.0f}")
 
     # 選擇飲料：檢查使用者是否要飲料
     need_drink = prefs.get("needDrink", True)  # 預設為 True
@@ -530,7 +846,7 @@ side
             if budget and isinstance(budget, (int, float)):
                 # 嚴格檢查：不能超過預算
                 if total_cost + price > budget:
-                    print(f" [預算控制] 跳過飲料 {item.get('name')} (${price:.0f}) - 會超過預算 ${budget:.0f}")
+                    _log(f" [預算控制] 跳過飲料 {item.get('name')} (${price:.0f}) - 會超過預算 ${budget:.0f}")
                     continue
             
             selected_items.append({
@@ -547,12 +863,12 @@ side
                 break
         
         if drink_count > 0:
-            print(f" [推薦] 已選飲料 {drink_count} 項，目前花費 ${total_cost:.0f}")
+            _log(f" [推薦] 已選飲料 {drink_count} 項，目前花費 ${total_cost:.0f}")
     else:
-        print(f" [推薦] 使用者不要飲料，跳過飲料推薦")
+        _log(f" [推薦] 使用者不要飲料，跳過飲料推薦")
 
     if drink_count > 0:
-        print(f" [推薦] 已選飲料 {drink_count} 項，目前花費 ${total_cost:.0f}")
+        _log(f" [推薦] 已選飲料 {drink_count} 項，目前花費 ${total_cost:.0f}")
 
     # 如果還有預算，考慮加入甜點
     dessert_count = 0
@@ -580,7 +896,7 @@ side
             break
 
     if dessert_count > 0:
-        print(f" [推薦] 已選甜點 {dessert_count} 項，目前花費 ${total_cost:.0f}")
+        _log(f" [推薦] 已選甜點 {dessert_count} 項，目前花費 ${total_cost:.0f}")
 
     # 如果還有預算空間，加入其他項目
     for item in other_items_sorted:
@@ -633,5 +949,7 @@ side
         "spiceLevel": prefs.get("spiceLevel"),
         "cuisine": prefs.get("cuisine"),
     }
-    
+    if classification_pending:
+        meta["classificationPending"] = classification_pending  # 部分菜品暫用關鍵字分類，此結果不快取
+
     return {"items": selected_items, "notes": notes, "meta": meta}
\ No newline at end of file
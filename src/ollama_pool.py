@@ -0,0 +1,267 @@
+"""多台 ollama 後端的負載平衡
+
+OLLAMA_HOSTS 設定多個位址（逗號分隔）時，chat() 改走各後端的 HTTP /api/generate，
+不再經過只能連本機 daemon 的 CLI：
+- 依「進行中請求數」挑最閒的後端（同數時挑平均延遲較低者）
+- 同一 session 優先送到同一台（rendezvous hash），讓後端可重用 KV cache；
+  該台比最閒的後端多出 AFFINITY_SLACK 個以上進行中請求時才改送別台
+- 連線失敗或 5xx 才換一台重試並計入後端失敗；讀取逾時是這個請求太慢，不重試也不計入
+- 連續失敗 OLLAMA_POOL_MAX_FAILURES 次就暫時剔除，剔除期滿或健康檢查成功後重新加入
+- 背景健康檢查定期打 /api/version（第一次挑後端時自動啟動，不必等 ensure_daemon / 預熱）
+"""
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Optional, Set
+
+AFFINITY_SLACK = 1          # 偏好後端最多可比最閒的後端多幾個進行中請求
+_LATENCY_ALPHA = 0.2        # 平均延遲（EWMA）的權重
+
+
+class PoolUnavailable(RuntimeError):
+    """沒有任何後端可用"""
+
+
+def _normalize(url: str) -> str:
+    url = url.strip().rstrip("/")
+    return url if url.startswith(("http://", "https://")) else "http://" + url
+
+
+class Backend:
+    __slots__ = ("url", "outstanding", "latency_ms", "failures", "ejected_until", "ejections",
+                 "calls", "errors", "affinity_hits", "last_check")
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.outstanding = 0
+        self.latency_ms: Optional[float] = None
+        self.failures = 0           # 連續失敗次數
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.calls = 0
+        self.errors = 0
+        self.affinity_hits = 0
+        self.last_check: Optional[float] = None
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "available": self.available(now),
+            "outstanding": self.outstanding,
+            "latencyMs": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "failures": self.failures,
+            "ejectedFor": round(max(0.0, self.ejected_until - now), 1),
+            "ejections": self.ejections,
+            "calls": self.calls,
+            "errors": self.errors,
+            "affinityHits": self.affinity_hits,
+        }
+
+
+class OllamaPool:
+    def __init__(
+        self,
+        urls: List[str],
+        name: str = "ollamaPool",
+        max_failures: int = 3,
+        eject_seconds: float = 30.0,
+        health_interval: float = 10.0,
+    ) -> None:
+        if not urls:
+            raise ValueError("OllamaPool 至少需要一個後端")
+        self.name = name
+        self.backends = [Backend(_normalize(u)) for u in dict.fromkeys(urls)]
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._health_thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["OllamaPool"]:
+        """依 OLLAMA_HOSTS 建立；未設定時回傳 None（沿用單一 daemon 的 CLI 路徑）"""
+        urls = [u for u in os.environ.get("OLLAMA_HOSTS", "").split(",") if u.strip()]
+        if not urls:
+            return None
+        return cls(
+            urls,
+            max_failures=int(os.environ.get("OLLAMA_POOL_MAX_FAILURES", "3")),
+            eject_seconds=float(os.environ.get("OLLAMA_POOL_EJECT_SECONDS", "30")),
+            health_interval=float(os.environ.get("OLLAMA_POOL_HEALTH_INTERVAL", "10")),
+        )
+
+    # 挑選後端 -----------------------------------------------------------
+
+    @staticmethod
+    def _affinity_score(session: str, backend: Backend) -> str:
+        return hashlib.sha1(f"{session}|{backend.url}".encode("utf-8")).hexdigest()
+
+    def acquire(self, session: Optional[str] = None, exclude: Set[str] = frozenset()) -> Backend:  # type: ignore[assignment]
+        """挑一台後端並把它的進行中請求數 +1（用完必須呼叫 release()）"""
+        if self._health_thread is None:
+            self.start_health_checks()
+        now = time.time()
+        with self._lock:
+            candidates = [b for b in self.backends if b.url not in exclude and b.available(now)]
+            if not candidates:
+                # 全部被剔除時仍給剔除期最快結束的那台一次機會，總比直接失敗好
+                candidates = sorted((b for b in self.backends if b.url not in exclude), key=lambda b: b.ejected_until)[:1]
+            if not candidates:
+                raise PoolUnavailable("沒有可用的 ollama 後端")
+
+            def load(b: Backend) -> Any:
+                return (b.outstanding, b.latency_ms if b.latency_ms is not None else 0.0)
+
+            chosen = min(candidates, key=load)
+            if session:
+                preferred = max(candidates, key=lambda b: self._affinity_score(session, b))
+                if preferred.outstanding <= chosen.outstanding + AFFINITY_SLACK:
+                    chosen = preferred
+                    chosen.affinity_hits += 1
+            chosen.outstanding += 1
+            return chosen
+
+    def release(self, backend: Backend, latency_ms: float, ok: Optional[bool]) -> None:
+        """ok=None 表示請求本身出錯（例如讀取逾時）：不更新延遲，也不計入後端的連續失敗"""
+        with self._lock:
+            backend.outstanding = max(0, backend.outstanding - 1)
+            backend.calls += 1
+            if ok is None:
+                backend.errors += 1
+            elif ok:
+                backend.failures = 0
+                backend.latency_ms = latency_ms if backend.latency_ms is None else \
+                    (1 - _LATENCY_ALPHA) * backend.latency_ms + _LATENCY_ALPHA * latency_ms
+            else:
+                backend.errors += 1
+                self._failed(backend)
+
+    def _failed(self, backend: Backend) -> None:
+        """記一次失敗；連續失敗達上限就剔除一段時間（呼叫時須持有鎖）"""
+        backend.failures += 1
+        if backend.failures >= self.max_failures:
+            backend.ejected_until = time.time() + self.eject_seconds
+            backend.ejections += 1
+            print(f" [ollama 叢集] 剔除 {backend.url}（連續失敗 {backend.failures} 次，{self.eject_seconds:.0f}s）")
+
+    # 呼叫 ---------------------------------------------------------------
+
+    @staticmethod
+    def _post(url: str, payload: Dict[str, Any], timeout: float) -> Any:
+        req = urllib.request.Request(
+            url, data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read().decode("utf-8") or "null")
+
+    def generate(
+        self,
+        model: str,
+        prompt: str,
+        timeout: float = 180.0,
+        session: Optional[str] = None,
+        keep_alive: Optional[str] = None,
+    ) -> str:
+        """送到挑中的後端的 /api/generate；連線失敗或 5xx 時換一台重試（每台最多一次），讀取逾時直接丟出"""
+        payload: Dict[str, Any] = {"model": model, "prompt": prompt, "stream": False}
+        if keep_alive:
+            payload["keep_alive"] = keep_alive
+        tried: Set[str] = set()
+        last_error: Optional[Exception] = None
+        while len(tried) < len(self.backends):
+            try:
+                backend = self.acquire(session, exclude=tried)
+            except PoolUnavailable:
+                break
+            tried.add(backend.url)
+            start = time.perf_counter()
+            ok: Optional[bool] = False
+            try:
+                data = self._post(backend.url + "/api/generate", payload, timeout)
+                ok = True
+            except urllib.error.HTTPError as e:
+                if e.code < 500:
+                    # 4xx（例如模型不存在）換哪台都一樣，不算後端故障
+                    ok = True
+                    raise RuntimeError(f"ollama {backend.url} 回應 {e.code}: {e.read().decode('utf-8', 'ignore')}") from e
+                last_error = e
+            except (TimeoutError, socket.timeout) as e:
+                # 連上了但 timeout 秒內沒生成完：換台重跑只會把每台都拖住同樣久，也不代表後端故障
+                ok = None
+                raise RuntimeError(f"ollama {backend.url} 超過 {timeout:g}s 沒有回應") from e
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                last_error = e
+            finally:
+                self.release(backend, (time.perf_counter() - start) * 1000, ok)
+            if ok:
+                return str((data or {}).get("response", "")).strip()
+            print(f" [ollama 叢集] {backend.url} 失敗：{last_error}，改送其他後端")
+        raise RuntimeError(f"所有 ollama 後端都失敗：{last_error}")
+
+    def warm_up(self, models: List[str], keep_alive: str, timeout: float = 300.0) -> Dict[str, str]:
+        """在每一台後端載入模型（空 prompt 只載入不生成）"""
+        result: Dict[str, str] = {}
+        for backend in self.backends:
+            for model in models:
+                key = f"{backend.url} {model}"
+                try:
+                    self._post(backend.url + "/api/generate", {"model": model, "prompt": "", "keep_alive": keep_alive}, timeout)
+                    result[key] = "loaded"
+                except Exception as e:
+                    result[key] = f"error: {e}"
+        return result
+
+    # 健康檢查 -----------------------------------------------------------
+
+    def check_health(self, timeout: float = 1.0) -> int:
+        """對每台後端打 /api/version；成功就解除剔除，失敗記一次失敗。回傳可用的後端數"""
+        for backend in self.backends:
+            try:
+                req = urllib.request.Request(backend.url + "/api/version")
+                with urllib.request.urlopen(req, timeout=timeout) as resp:
+                    resp.read()
+                up = True
+            except (urllib.error.URLError, OSError, ValueError):
+                up = False
+            with self._lock:
+                backend.last_check = time.time()
+                if up:
+                    if backend.ejected_until > backend.last_check:
+                        print(f" [ollama 叢集] {backend.url} 恢復")
+                    backend.failures = 0
+                    backend.ejected_until = 0.0
+                elif backend.available(backend.last_check):
+                    self._failed(backend)
+        now = time.time()
+        return sum(1 for b in self.backends if b.available(now))
+
+    def start_health_checks(self) -> None:
+        """啟動背景健康檢查；重複呼叫（含多條執行緒同時呼叫）只會有一條"""
+
+        def loop() -> None:
+            while True:
+                try:
+                    self.check_health()
+                except Exception as e:
+                    print(f" [ollama 叢集] 健康檢查錯誤：{e}")
+                time.sleep(self.health_interval)
+
+        with self._lock:
+            if self._health_thread is not None:
+                return
+            self._health_thread = threading.Thread(target=loop, name="ollama-pool-health", daemon=True)
+            self._health_thread.start()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            backends = [b.stats(now) for b in self.backends]
+        return {"backends": backends, "available": sum(1 for b in backends if b["available"])}
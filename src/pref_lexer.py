@@ -0,0 +1,311 @@
+"""偏好抽取的單次掃描詞法分析器
+
+原本的關鍵字抽取對同一句話做十幾次掃描（辣度逐字 in、三個忌口 find、
+多個未編譯的 re.search、菜品 / 菜系 / 權重線索各一輪 any(...)）。
+這裡把所有線索詞與數字編譯成一個正規表示式，一次 finditer 取得：
+- 每個位置開始的最長線索詞（lookahead，不吃字元，所以重疊的詞也抓得到；
+  同一位置較短的線索詞必為最長者的前綴，事先展開）
+- 所有數字串的位置
+之後只在這些命中結果上組出偏好，輸出與舊版逐項掃描完全一致。
+
+keyword_prefs_with_coverage() 另外回報句子有多少被規則「讀懂」：
+沒被任何線索、採用的數字或忌口片段涵蓋、也不是贅字的部分即為殘餘文字，
+呼叫端據此決定要不要再問 LLM。
+"""
+import re
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+SPICE_WORDS = ("不辣", "微辣", "小辣", "中辣", "大辣", "很辣")
+SPICE_FALLBACK = ("要辣", "吃辣", "辣一點", "重口味")
+EXCLUDE_CUES = ("不要", "不吃", "忌口")
+EXCLUDE_STOPS = ("。", " ", "，", ",", ";", "！", "?", "\n")
+ITEM_PRICE_CUES = ("單品", "每道", "每樣", "每份")
+BUDGET_CUES = ("預算", "不超過", "小於", "低於", "<=")
+VEGETARIAN_CUES = ("吃素", "素食", "全素", "蛋奶素")
+MARKET_PRICE_NEG = ("不要", "不吃", "不含", "排除")
+CUISINES = ("中式", "日式", "泰式", "美式", "韓式", "義式")
+PREFERRED_DISHES = (
+    ("漢堡", ("漢堡", "burger", "堡", "芝加哥堡")),
+    ("吐司", ("吐司", "toast")),
+    ("貝果", ("貝果", "bagel")),
+    ("套餐", ("套餐", "combo")),
+)
+DRINK_NEG = ("不要", "不含", "無", "不需要", "別加")
+DRINK_POS = ("飲料", "喝", "飲品")
+CUE_MAIN = ("主菜", "吃飽", "份量", "大份", "有菜有肉")
+CUE_VARIETY = ("多樣", "不要都一樣", "各點一些", "分著吃", "分享", "拼盤", "試試看")
+CUE_LIGHT = ("清爽", "清淡", "健康", "少油")
+PEOPLE_UNIT = "人"
+
+# 只需要知道「有沒有出現」的線索，依類別標記；其餘線索另外記錄位置
+_CATEGORIES: Dict[str, Tuple[str, ...]] = {
+    "spiceFallback": SPICE_FALLBACK,
+    "itemPrice": ITEM_PRICE_CUES,
+    "vegetarian": VEGETARIAN_CUES,
+    "drink": DRINK_POS,
+    "main": CUE_MAIN,
+    "variety": CUE_VARIETY,
+    "light": CUE_LIGHT,
+    **{"dish:" + dish: kws for dish, kws in PREFERRED_DISHES},
+}
+_DISH_CATEGORIES = tuple((dish, "dish:" + dish) for dish, _ in PREFERRED_DISHES)
+
+_ALL_WORDS: Set[str] = {
+    *SPICE_WORDS, *EXCLUDE_CUES, *BUDGET_CUES, *MARKET_PRICE_NEG, "時價", PEOPLE_UNIT,
+    *CUISINES, *DRINK_NEG, *(w for words in _CATEGORIES.values() for w in words),
+}
+# 長的放前面：同一位置 lookahead 會取到最長的詞；開頭先檢查首字，大多數位置可直接略過
+_WORDS_BY_LENGTH = sorted(_ALL_WORDS, key=lambda w: (-len(w), w))
+_FIRST_CHARS = "".join(sorted({re.escape(w[0]) for w in _ALL_WORDS}))
+_LEXER = re.compile(
+    "(?=(?=[" + _FIRST_CHARS + "])(" + "|".join(re.escape(w) for w in _WORDS_BY_LENGTH) + "))|(\\d+)"
+)
+# 最長詞 → 同一起點也會命中的所有詞（自己與是線索詞的前綴），以及這些詞所屬的類別
+_PREFIX_CLOSURE: Dict[str, Tuple[str, ...]] = {
+    w: tuple(p for p in _WORDS_BY_LENGTH if w.startswith(p)) for w in _WORDS_BY_LENGTH
+}
+_CLOSURE_CATEGORIES: Dict[str, FrozenSet[str]] = {
+    w: frozenset(c for c, words in _CATEGORIES.items() if any(p in words for p in closure))
+    for w, closure in _PREFIX_CLOSURE.items()
+}
+
+# 罕見路徑（出現單品價格線索時）沿用原本的正規表示式，確保移除片段後的預算判斷一致
+_ITEM_PRICE_RE = re.compile(r"(單品|每道|每樣|每份)\s*(?:不超過|小於|低於)?\s*(\d{2,5})\s*(?:元|塊)?\s*(?:以下|以內)?")
+_BUDGET_RE = re.compile(r"(預算|不超過|小於|低於|<=)\s*(\d{2,6})")
+_EXCLUDE_SPLIT_RE = re.compile(r"[、,\s]+")
+
+# 不帶偏好資訊的贅字（數字、國字數字、單位不算，例如「兩個人」「500元」都該交給 LLM 判斷）
+FILLER_WORDS = (
+    "我們", "我", "你", "想要", "想", "要", "吃", "點", "幫忙", "幫", "推薦", "一下", "一些",
+    "的", "了", "嗎", "呢", "吧", "啊", "喔", "哦", "請", "可以", "給", "和", "跟", "還有",
+    "也", "都", "就", "好", "有", "只", "總共", "在", "什麼", "甚麼", "啥", "怎麼", "怎",
+    "東西", "今天", "早餐", "午餐", "晚餐", "餐點", "餐", "菜單", "菜色", "組合", "搭配", "其他",
+    "換一套", "另一套", "一套", "換", "價位", "以下", "以內", "個", "元", "塊", "謝謝",
+)
+_FILLER_RE = re.compile("|".join(re.escape(w) for w in sorted(FILLER_WORDS, key=len, reverse=True)))
+_RESIDUAL_RE = re.compile(r"\w+")
+
+
+class Lexed:
+    """一次掃描的結果：每個線索詞的起點列表、命中的類別，與數字串 (start, end)"""
+    __slots__ = ("text", "hits", "categories", "digits")
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        hits: Dict[str, List[int]] = {}
+        categories: Set[str] = set()
+        digits: List[Tuple[int, int]] = []
+        for m in _LEXER.finditer(text):
+            word = m.group(1)
+            if word is not None:
+                start = m.start()
+                for w in _PREFIX_CLOSURE[word]:
+                    if w in hits:
+                        hits[w].append(start)
+                    else:
+                        hits[w] = [start]
+                categories |= _CLOSURE_CATEGORIES[word]
+            else:
+                digits.append(m.span(2))
+        self.hits = hits
+        self.categories = categories
+        self.digits = digits
+
+    def first(self, words: Tuple[str, ...]) -> Optional[str]:
+        """依 words 的順序（不是出現位置）回傳第一個出現過的詞"""
+        hits = self.hits
+        for w in words:
+            if w in hits:
+                return w
+        return None
+
+    def followed_by(self, cues: Tuple[str, ...], target: str) -> bool:
+        """是否存在「cue + 任意空白 + target」，等同 re.search(r"(cue|...)\\s*target")"""
+        targets = self.hits.get(target)
+        if not targets:
+            return False
+        t = self.text
+        for cue in cues:
+            for start in self.hits.get(cue, ()):
+                end = start + len(cue)
+                for ts in targets:
+                    if ts >= end and not t[end:ts].strip():
+                        return True
+        return False
+
+    def number_after(self, cues: Tuple[str, ...], min_len: int, max_len: int) -> Optional[Tuple[int, int]]:
+        """最左邊的「cue + 空白 + 數字」取前 max_len 位的範圍，等同 re.search(r"(cue)\\s*(\\d{min,max})").span(2)"""
+        if not self.digits:
+            return None
+        t = self.text
+        best: Optional[Tuple[int, Tuple[int, int]]] = None
+        for cue in cues:
+            for start in self.hits.get(cue, ()):
+                if best is not None and start >= best[0]:
+                    break
+                end = start + len(cue)
+                for ds, de in self.digits:
+                    if ds < end:
+                        continue
+                    if t[end:ds].strip() == "" and de - ds >= min_len:
+                        best = (start, (ds, min(de, ds + max_len)))
+                    break
+        return best[1] if best else None
+
+    def number_before(self, word: str, max_len: int) -> Optional[Tuple[int, int]]:
+        """最左邊的「數字 + 空白 + word」，數字取結尾最多 max_len 位的範圍，等同 re.search(r"(\\d{1,max})\\s*word").span(1)"""
+        starts = self.hits.get(word)
+        if not starts:
+            return None
+        t = self.text
+        for ds, de in self.digits:
+            for ws in starts:
+                if ws >= de and not t[de:ws].strip():
+                    return max(ds, de - max_len), de
+        return None
+
+
+def _exclusion_segment(t: str, idx: int, cue: str, spans: Optional[List[Tuple[int, int]]] = None) -> List[str]:
+    start = idx + len(cue)
+    seg = t[start:]
+    for stop in EXCLUDE_STOPS:
+        cut = seg.find(stop)
+        if cut != -1:
+            seg = seg[:cut]
+            break
+    if spans is not None:
+        spans.append((start, start + len(seg)))
+    return [p.strip() for p in _EXCLUDE_SPLIT_RE.split(seg) if p.strip()]
+
+
+def keyword_prefs(text: str) -> Dict[str, object]:
+    """關鍵字偏好抽取（單次掃描版）；輸出與 main 舊版逐項掃描一致"""
+    t = text.strip()
+    return _build_prefs(t, Lexed(t), None)
+
+
+def keyword_prefs_with_coverage(text: str) -> Tuple[Dict[str, object], float, str]:
+    """關鍵字偏好 + (信心分數 0~1, 殘餘文字)
+
+    信心分數 = 被規則涵蓋的有效字數 / 全部有效字數（有效字：英數與漢字，扣掉贅字），
+    句子沒有有效字時為 1.0；殘餘文字是未涵蓋片段以空白相接。
+    """
+    t = text.strip()
+    lx = Lexed(t)
+    spans: List[Tuple[int, int]] = []
+    prefs = _build_prefs(t, lx, spans)
+
+    covered = bytearray(len(t))
+    for word, starts in lx.hits.items():
+        for s in starts:
+            covered[s:s + len(word)] = b"\x01" * len(word)
+    for s, e in spans:
+        covered[s:e] = b"\x01" * (e - s)
+
+    masked = "".join(" " if c else ch for c, ch in zip(covered, t))
+    residual = " ".join(_RESIDUAL_RE.findall(_FILLER_RE.sub(" ", masked)))
+    residual_count = sum(ch.isalnum() for ch in residual)
+    covered_count = sum(1 for c, ch in zip(covered, t) if c and ch.isalnum())
+    total = covered_count + residual_count
+    return prefs, (covered_count / total if total else 1.0), residual
+
+
+def _build_prefs(t: str, lx: Lexed, spans: Optional[List[Tuple[int, int]]]) -> Dict[str, object]:
+    """spans 不為 None 時，另外記下忌口片段與實際採用的數字範圍（供涵蓋率計算）"""
+    cats = lx.categories
+    prefs: Dict[str, object] = {}
+
+    # 辣度
+    spice = lx.first(SPICE_WORDS)
+    if spice is not None:
+        prefs["spiceLevel"] = "小辣" if spice == "微辣" else spice
+    elif "spiceFallback" in cats:
+        prefs["spiceLevel"] = "辣"
+
+    # 忌口（每個線索詞只看第一次出現）
+    excludes: List[str] = []
+    for cue in EXCLUDE_CUES:
+        starts = lx.hits.get(cue)
+        if starts:
+            excludes.extend(_exclusion_segment(t, starts[0], cue, spans))
+    if excludes:
+        prefs["excludes"] = list(dict.fromkeys(excludes))
+
+    # 單品價格上限與預算
+    if "itemPrice" in cats and (m_item := _ITEM_PRICE_RE.search(t)):
+        prefs["maxItemPrice"] = float(m_item.group(2))
+        if spans is not None:
+            spans.append(m_item.span())
+        m = _BUDGET_RE.search(t[:m_item.start()] + t[m_item.end():])
+        if m:
+            # 預算從移除單品價格後的句子直接取值（數字可能跨過被移除的片段，例如「預算300每道1500300」）
+            prefs["budget"] = float(m.group(2))
+            if spans is not None:
+                # 換回原句位置：整段在片段之前不動、整段在片段之後補回被移除的長度；跨過片段的不計入涵蓋範圍
+                s, e = m.span(2)
+                cut = m_item.start()
+                if e <= cut:
+                    spans.append((s, e))
+                elif s >= cut:
+                    shift = m_item.end() - m_item.start()
+                    spans.append((s + shift, e + shift))
+    else:
+        budget = lx.number_after(BUDGET_CUES, 2, 6)
+        if budget is not None:
+            prefs["budget"] = float(t[budget[0]:budget[1]])
+            if spans is not None:
+                spans.append(budget)
+
+    # 素食 / 時價
+    if "vegetarian" in cats:
+        prefs["vegetarian"] = True
+    if lx.followed_by(MARKET_PRICE_NEG, "時價"):
+        prefs["noMarketPrice"] = True
+
+    # 菜系
+    cuisine = lx.first(CUISINES)
+    if cuisine is not None:
+        prefs["cuisine"] = cuisine
+
+    # 特定菜品類型偏好
+    for dish, category in _DISH_CATEGORIES:
+        if category in cats:
+            prefs["preferredDish"] = dish
+            break
+
+    # 飲料：excludes 有「飲料」> 否定詞 + 飲料 > 提到飲料 / 喝
+    if "飲料" in excludes or lx.followed_by(DRINK_NEG, "飲料"):
+        prefs["needDrink"] = False
+    elif "drink" in cats:
+        prefs["needDrink"] = True
+
+    # 人數
+    people = lx.number_before(PEOPLE_UNIT, 2)
+    if people is not None:
+        prefs["people"] = int(t[people[0]:people[1]])
+        if spans is not None:
+            spans.append(people)
+
+    # 動態權重線索
+    cue_main = "main" in cats
+    cue_variety = "variety" in cats
+    cue_light = "light" in cats
+
+    has_budget = prefs.get("budget") is not None
+    need_drink = prefs.get("needDrink", False)
+    constraint_count = sum([
+        has_budget, bool(need_drink), "spiceLevel" in prefs, bool(excludes),
+        "cuisine" in prefs, cue_main, cue_variety, cue_light,
+    ])
+    only_budget = has_budget and constraint_count == 1
+
+    prefs["weights"] = {
+        "price": 1.0 if only_budget else (0.8 if has_budget else 0.3),
+        "main": 0.8 if cue_main else 0.5,
+        "variety": 0.8 if cue_variety else 0.4,
+        "drink": (0.6 if need_drink else -0.8),  # 不要飲料給更大的負權重
+        "spice": 0.7 if prefs.get("spiceLevel") == "不辣" or cue_light else 0.2,
+        "category": 0.5,
+        "cuisine": 0.6 if "cuisine" in prefs else 0.0,
+    }
+    return prefs
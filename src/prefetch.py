@@ -0,0 +1,130 @@
+"""推測性預先計算：一輪對話結束後，在背景先算好最常見的下一句會得到的推薦
+
+chat_log 中最常見的追問是「換一套」、降低預算、切換要不要飲料。每輪結束後把這幾句
+當成下一輪的輸入，照真正的流程（抽取偏好 → 合併 → recommend()，seed + 1）先算一次，
+結果依 session 存放；下一輪合併後的偏好與 seed 對得上就直接使用。
+- 只用單一背景執行緒，排隊過多時略過（不與即時請求搶資源）
+- PREFETCH_REPLIES=true 時連 LLM 回覆也先生成（只有使用者剛好說出同一句時才會命中回覆快取）
+- stats() 匯出各變化的命中次數與命中率，供調整
+"""
+import copy
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import cache_utils
+import main
+import menu_snapshot
+from ollama_fuc import prefs_fingerprint
+
+
+def variants(prefs: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """(變化名稱, 預測的下一句)"""
+    out = [("reseed", "換一套")]
+    budget = prefs.get("budget")
+    if isinstance(budget, (int, float)) and budget > 0:
+        out.append(("budgetDown", f"預算{int(round(budget * 0.8))}"))
+    out.append(("drinkToggle", "不要飲料" if prefs.get("needDrink", True) else "要飲料"))
+    return out
+
+
+class Prefetcher:
+    def __init__(self, name: str = "prefetch") -> None:
+        self.name = name
+        self.enabled = os.environ.get("PREFETCH", "true").lower() == "true"
+        self.replies = os.environ.get("PREFETCH_REPLIES", "false").lower() == "true"
+        self.max_pending = int(os.environ.get("PREFETCH_MAX_PENDING", "8"))
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        # session → {(菜單版本, 偏好指紋, seed): (變化名稱, 推薦結果)}
+        self._sessions = cache_utils.LRUCache(int(os.environ.get("PREFETCH_SESSIONS", "1024")), name="prefetchSessions", ttl=600)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.scheduled = 0
+        self.computed = 0
+        self.skipped = 0
+        self.errors = 0
+        self.misses = 0
+        self.hits: Dict[str, int] = {}
+
+    @staticmethod
+    def _key(menu: Dict[str, Any], prefs: Dict[str, Any], seed: int) -> Tuple[Any, ...]:
+        return (menu_snapshot.versions_of(menu) or id(menu), prefs_fingerprint(prefs), seed)
+
+    def schedule(self, session_id: str, menu: Dict[str, Any], prefs: Dict[str, Any], seed: int,
+                 history: Optional[List[Dict[str, Any]]] = None) -> int:
+        """一輪結束後呼叫；回傳排入的變化數（忙碌時為 0）
+
+        history：這一輪結束時的對話歷史，PREFETCH_REPLIES 預先生成回覆時當作上下文（與下一輪相同才會命中回覆快取）
+        """
+        if not self.enabled:
+            return 0
+        todo = variants(prefs)
+        with self._lock:
+            if self._pending + len(todo) > self.max_pending:
+                self.skipped += len(todo)
+                self._sessions.put(session_id, None)  # 這輪沒有預測，下一輪不計入命中率
+                return 0
+            self._pending += len(todo)
+            self.scheduled += len(todo)
+        table: Dict[Tuple[Any, ...], Tuple[str, Dict[str, Any]]] = {}
+        self._sessions.put(session_id, table)  # 換掉上一輪的預測
+        base = copy.deepcopy(prefs)
+        context = copy.deepcopy(history or [])
+        for variant, text in todo:
+            self._pool.submit(self._compute, session_id, table, menu, base, seed + 1, variant, text, context)
+        return len(todo)
+
+    def _compute(self, session_id: str, table: Dict[Tuple[Any, ...], Tuple[str, Dict[str, Any]]],
+                 menu: Dict[str, Any], base: Dict[str, Any], seed: int, variant: str, text: str,
+                 context: List[Dict[str, Any]]) -> None:
+        try:
+            if self._sessions.get(session_id) is not table:
+                return  # 使用者已經送出下一句，這組預測用不到了
+            prefs = copy.deepcopy(base)
+            delta = main.extract_prefs_from_text(text)
+            delta.setdefault("notes", text)
+            main.merge_prefs_inplace(prefs, delta)
+            rec = main.ollama_recommend(menu, prefs, top_k=5, seed=seed)
+            if self.replies:
+                # 只為了寫入回覆快取
+                main.generate_ai_reply(rec, text, session=session_id, history=context, prefs=prefs)
+            table[self._key(menu, prefs, seed)] = (variant, rec)
+            with self._lock:
+                self.computed += 1
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f" [預先計算] {variant} 失敗：{e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def take(self, session_id: str, menu: Dict[str, Any], prefs: Dict[str, Any], seed: int) -> Optional[Dict[str, Any]]:
+        """取出與這一輪（合併後偏好、seed）相符的預先結果；沒有則回傳 None"""
+        table = self._sessions.get(session_id)
+        if table is None:
+            return None
+        entry = table.pop(self._key(menu, prefs, seed), None)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits[entry[0]] = self.hits.get(entry[0], 0) + 1
+        print(f" [預先計算] 命中 {entry[0]}")
+        return entry[1]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = sum(self.hits.values())
+            return {
+                "enabled": self.enabled,
+                "pending": self._pending,
+                "scheduled": self.scheduled,
+                "computed": self.computed,
+                "skipped": self.skipped,
+                "errors": self.errors,
+                "hits": dict(self.hits),
+                "misses": self.misses,
+                "hitRate": round(hits / (hits + self.misses), 4) if hits + self.misses else 0.0,
+            }
@@ -0,0 +1,154 @@
+"""推薦運算的多行程後端：把 CPU 密集的 recommend() 交給預先 fork 好的工作行程
+
+api_chat 是同步端點，跑在 FastAPI 的執行緒池裡；關鍵字推薦、多人組合搜尋、組合表查詢都是純 Python，
+同時進來的請求會被 GIL 排成一條。RECOMMEND_POOL=true 時：
+- 每次發佈菜單快照（back._publish_snapshot → sync()）先在主行程建好各餐廳的 facet 索引
+  （存在 RestaurantSnapshot 上，不受索引 LRU 上限影響；沒建到的餐廳記在 stats 的 unsharedIndexes），再一次 fork
+  RECOMMEND_POOL_WORKERS 個工作行程：菜單、索引與組合表以 copy-on-write 共用，
+  每次只送（餐廳名稱, 菜單版本, 偏好, top_k, seed），菜單本身不經 pickle
+- 快照換版就換一組工作行程，舊的做完手上的工作後結束；工作行程只認 fork 當下的快照，版本對不上時回傳 None
+- 有界佇列：同時交給工作行程的工作最多 RECOMMEND_POOL_MAX_PENDING 件，滿了最多等
+  RECOMMEND_POOL_QUEUE_TIMEOUT 秒，仍排不進去就回傳 None，由呼叫端在原執行緒計算
+推薦快取仍在主行程，命中時不會經過工作行程。
+"""
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import menu_snapshot
+
+# 工作行程中的實際計算：work(菜單, 偏好, top_k, model, seed) → 推薦結果；fork 時繼承，不經 pickle
+_WORK: Optional[Callable[..., Dict[str, Any]]] = None
+
+
+def _init_worker(work: Callable[..., Dict[str, Any]]) -> None:
+    global _WORK
+    _WORK = work
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C 由主行程處理
+
+
+def _run(name: str, version: str, prefs: Dict[str, Any], top_k: int, model: Optional[str],
+         seed: Optional[int]) -> Optional[Dict[str, Any]]:
+    snap = menu_snapshot.current()
+    rs = snap.restaurants.get(name) if snap is not None else None
+    if rs is None or rs.version != version or _WORK is None:
+        return None
+    return _WORK(rs.source, prefs, top_k, model, seed)
+
+
+class RecommendPool:
+    def __init__(
+        self,
+        work: Callable[..., Dict[str, Any]],
+        prepare: Optional[Callable[[Any], None]] = None,
+        name: str = "recommendPool",
+        workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+    ) -> None:
+        """work 在工作行程中執行；prepare(snapshot) 在 fork 前於主行程呼叫，預先建好要共用的索引"""
+        self.work = work
+        self.prepare = prepare
+        self.name = name
+        self.enabled = os.environ.get("RECOMMEND_POOL", "false").lower() == "true"
+        self.workers = workers or int(os.environ.get("RECOMMEND_POOL_WORKERS") or os.cpu_count() or 2)
+        self.max_pending = max_pending or int(os.environ.get("RECOMMEND_POOL_MAX_PENDING") or self.workers * 4)
+        self.queue_timeout = float(os.environ.get("RECOMMEND_POOL_QUEUE_TIMEOUT", "2"))
+        self.timeout = float(os.environ.get("RECOMMEND_POOL_TIMEOUT", "30"))
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._pool: Any = None
+        self._snapshot_version: Optional[int] = None
+        # id(菜單物件) → (菜單物件, 餐廳名稱, 菜單版本)；保留物件參照避免 id 重用
+        self._owners: Dict[int, Tuple[Dict[str, Any], str, str]] = {}
+        self.pending = 0
+        self.dispatched = 0
+        self.stale = 0
+        self.rejected = 0
+        self.errors = 0
+        self.forks = 0
+        self.fork_ms = 0.0
+        self.unshared = 0  # fork 時還沒有 facet 索引的餐廳數（工作行程得各自重建，不會共用）
+
+    def sync(self, snapshot: Any) -> int:
+        """快照發佈後呼叫：換一組從目前狀態 fork 的工作行程，回傳工作行程數（未啟用時為 0）"""
+        if not self.enabled:
+            return 0
+        started = time.perf_counter()
+        if self.prepare is not None:
+            self.prepare(snapshot)
+        unshared = [name for name, rs in snapshot.restaurants.items() if rs.facets is None]
+        if unshared:
+            print(f" [推薦行程池] {len(unshared)} 家餐廳 fork 前沒有 facet 索引，工作行程會各自重建：{unshared[:5]}")
+        owners = {id(rs.source): (rs.source, name, rs.version) for name, rs in snapshot.restaurants.items()}
+        # multiprocessing.Pool 建立時就 fork 全部工作行程（不像 ProcessPoolExecutor 在送出工作時才 fork）
+        pool = multiprocessing.get_context("fork").Pool(self.workers, initializer=_init_worker, initargs=(self.work,))
+        with self._lock:
+            old, self._pool = self._pool, pool
+            self._snapshot_version = snapshot.version
+            self._owners = owners
+            self.forks += 1
+            self.unshared = len(unshared)
+            self.fork_ms = round((time.perf_counter() - started) * 1000, 1)
+        if old is not None:
+            old.close()  # 不再收新工作，手上的做完就結束
+            threading.Thread(target=old.join, name="recommend-pool-retire", daemon=True).start()
+        return self.workers
+
+    def run(self, menu: Dict[str, Any], prefs: Dict[str, Any], top_k: int, model: Optional[str],
+            seed: Optional[int]) -> Optional[Dict[str, Any]]:
+        """在工作行程中計算；工作行程沒有這份菜單、佇列已滿或失敗時回傳 None"""
+        with self._lock:
+            pool = self._pool
+            owner = self._owners.get(id(menu))
+        if pool is None or owner is None or owner[0] is not menu:
+            return None
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            return None
+        with self._lock:
+            self.pending += 1
+        try:
+            rec = pool.apply_async(_run, (owner[1], owner[2], prefs, top_k, model, seed)).get(self.timeout)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f" [推薦行程池] {owner[1]} 失敗：{e!r}")
+            return None
+        finally:
+            self._slots.release()
+            with self._lock:
+                self.pending -= 1
+        with self._lock:
+            if rec is None:
+                self.stale += 1
+            else:
+                self.dispatched += 1
+        return rec
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._owners = {}
+        if pool is not None:
+            pool.terminate()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "workers": self.workers if self._pool is not None else 0,
+                "maxPending": self.max_pending,
+                "pending": self.pending,
+                "dispatched": self.dispatched,
+                "stale": self.stale,
+                "rejected": self.rejected,
+                "errors": self.errors,
+                "forks": self.forks,
+                "forkMs": self.fork_ms,
+                "unsharedIndexes": self.unshared,
+                "snapshotVersion": self._snapshot_version,
+            }